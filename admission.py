@@ -0,0 +1,103 @@
+from threading import Lock
+from typing import Any, Dict, Optional, Set, Tuple
+
+import logger
+import metrics
+import rms
+from config.rms import AdmissionConfig
+
+IN_FLIGHT = "in_flight"
+PENDING = "pending"
+HOST = "host"
+
+
+class AdmissionControl:
+    """
+    Sheds requests to the callback-producing routes instead of letting pending callbacks pile up against an RMS
+    that doesn't answer. Three limits, checked without waiting: requests in flight per route, callbacks pending in
+    the process, and callbacks pending against one RMS host. A pending limit, once hit, keeps shedding until the
+    count drops below its low watermark, so admission doesn't flap around the limit. Pre-forked workers each count
+    their own requests and callbacks.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._in_flight: Dict[str, int] = {}
+        # (PENDING, "") or (HOST, host) while that limit is shedding
+        self._shedding: Set[Tuple[str, str]] = set()
+        self._shed: Dict[str, int] = {IN_FLIGHT: 0, PENDING: 0, HOST: 0}
+
+    def enter(self, route: str, host: str, conf: AdmissionConfig) -> Optional[str]:
+        """
+        Admit a request to route whose callback goes to host, or return the limit shedding it. An admitted request
+        must call leave(route) when handled.
+        """
+        registry = rms.get_registry()
+        with self._lock:
+            in_flight = self._in_flight.get(route, 0)
+            max_in_flight = conf.routes.get(route, conf.max_in_flight)
+            if max_in_flight and in_flight >= max_in_flight:
+                shed = IN_FLIGHT
+            elif self._over((PENDING, ""), len(registry), conf.max_pending, conf.low_watermark):
+                shed = PENDING
+            elif self._over((HOST, host), registry.count(host), conf.max_pending_per_host, conf.low_watermark):
+                shed = HOST
+            else:
+                self._in_flight[route] = in_flight + 1
+                return None
+            self._shed[shed] += 1
+        return shed
+
+    def leave(self, route: str) -> None:
+        with self._lock:
+            self._in_flight[route] -= 1
+
+    def _over(self, key: Tuple[str, str], pending: int, limit: int, low_watermark: float) -> bool:
+        if not limit:
+            self._shedding.discard(key)
+            return False
+        if key in self._shedding:
+            if pending > limit * low_watermark:
+                return True
+            self._shedding.discard(key)
+            logger.info("admission recovered on %s: %s callbacks pending, limit %s", _label(key), pending, limit)
+            return False
+        if pending < limit:
+            return False
+        self._shedding.add(key)
+        logger.warning("admission shedding on %s: %s callbacks pending, limit %s, admitting again below %s",
+                       _label(key), pending, limit, int(limit * low_watermark))
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": dict(self._in_flight),
+                "shedding": sorted(map(_label, self._shedding)),
+                "shed": dict(self._shed),
+            }
+
+
+def _label(key: Tuple[str, str]) -> str:
+    return f"{key[0]} {key[1]}" if key[1] else key[0]
+
+
+__admission: Optional[AdmissionControl] = None
+__admission_lock = Lock()
+
+
+def get_admission() -> AdmissionControl:
+    global __admission
+    if __admission is None:
+        with __admission_lock:
+            if __admission is None:
+                __admission = AdmissionControl()
+    return __admission
+
+
+metrics.REGISTRY.gauge("wcs_admission_in_flight", "Requests in flight on the admission-controlled routes.",
+                       lambda: {(route,): count for route, count in __admission.stats()["in_flight"].items()}
+                       if __admission is not None else {}, ("route",))
+metrics.REGISTRY.gauge("wcs_admission_shedding", "Pending callback limits currently shedding requests.",
+                       lambda: {(key,): 1 for key in __admission.stats()["shedding"]}
+                       if __admission is not None else {}, ("limit",))
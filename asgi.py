@@ -0,0 +1,108 @@
+import asyncio
+import socket
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import controller
+import logger
+import rms
+import sites
+from config.rms import get_rms_config
+from scheduler import AsyncCallbackScheduler
+from sites import Site
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+_JSON_CONTENT_TYPE = controller.JSON_CONTENT_TYPE
+
+
+class WcsAsgiApp:
+    """
+    ASGI application serving the routes registered in controller, answering exactly like the Flask app does.
+    RMS callbacks are scheduled on the serving loop instead of worker threads. Every site is served on its own
+    port by the one application, a request is handled for the site of the port it came in on.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        methods = controller.get_routes().get(scope["path"])
+        if methods is None:
+            await _respond(send, 404, controller.NOT_FOUND)
+            return
+        handler = methods.get(scope["method"])
+        if handler is None:
+            await _respond(send, 405, controller.METHOD_NOT_ALLOWED)
+            return
+        body = await _read_body(receive)
+        client = scope.get("client")
+        server = scope.get("server")
+        site = sites.by_port(server[1] if server else None)
+        reply = controller.dispatch(handler, body, client[0] if client else None, site)
+        if reply.delay:
+            await asyncio.sleep(reply.delay)
+        await _respond(send, reply.status, reply.body, reply.content_type)
+
+    @staticmethod
+    async def _lifespan(receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                scheduler = AsyncCallbackScheduler(
+                    asyncio.get_running_loop(), workers=get_rms_config().request.workers, name="rms-callback"
+                )
+                rms.set_scheduler(scheduler)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                rms.get_scheduler().stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def _read_body(receive: Receive) -> bytes:
+    message = await receive()
+    body = message.get("body", b"")
+    if not message.get("more_body", False):
+        return body
+    chunks = [body]
+    while message.get("more_body", False):
+        message = await receive()
+        chunks.append(message.get("body", b""))
+    return b"".join(chunks)
+
+
+async def _respond(send: Send, status: int, payload: bytes, content_type: str = _JSON_CONTENT_TYPE) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(payload)).encode())],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+def _listen(port: int, backlog: int = 1024) -> socket.socket:
+    # with proto set, asyncio turns on TCP_NODELAY for every accepted connection as it does when it binds itself
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def serve(served: List[Site], sock: Optional[socket.socket] = None) -> None:
+    """Serve every site from one uvicorn server and one loop, sock instead of binding for a pre-forked worker."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("the asyncio engine requires uvicorn, install it with: pip install uvicorn")
+    for site in served:
+        logger.info("wcs-baffle serve site: %s on port: %s, engine: asyncio", site.name or "-", site.port)
+    config = uvicorn.Config(WcsAsgiApp(), host="0.0.0.0", port=served[0].port, loop="asyncio", log_config=None,
+                            access_log=False)
+    sockets = [sock] if sock is not None else [_listen(site.port) for site in served]
+    uvicorn.Server(config).run(sockets=sockets)
@@ -0,0 +1,102 @@
+import math
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import logger
+from clock import get_clock
+from config.rms import BatchConfig
+from scheduler import CallbackScheduler
+
+# (url, params, rest of the send arguments)
+Callback = Tuple[str, Dict[str, Any], Tuple[Any, ...]]
+DedupeKey = Tuple[str, Any, Any]
+
+
+class CallbackBatcher:
+    """
+    Groups RMS callbacks per host into batches that come due together, aligned on `window` second slots, and
+    sends each batch concurrently over the pooled connections when it is due. A callback identical to one still
+    pending (same url, serial and station_id) is dropped instead of becoming another POST.
+    """
+
+    def __init__(self, conf: BatchConfig, get_scheduler: Callable[[], CallbackScheduler],
+                 send: Callable[..., None]):
+        self._conf = conf
+        self._get_scheduler = get_scheduler
+        self._send = send
+        self._batches = 0
+        self._batched = 0
+        self._deduped = 0
+        self._start()
+        # executor threads don't survive a fork; open batches stay with the parent like the scheduler's callbacks
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    def _start(self) -> None:
+        self._executor = ThreadPoolExecutor(self._conf.concurrency, thread_name_prefix="rms-batch")
+        self._lock = Lock()
+        self._open: Dict[Tuple[str, int], List[Callback]] = {}
+        self._pending_keys: Set[DedupeKey] = set()
+
+    def submit(self, delay: float, url: str, params: Dict[str, Any], *args: Any) -> bool:
+        """
+        Queue send(url, params, *args) into the url host's batch, return False if it was dropped as a duplicate.
+        """
+        host = urlsplit(url).netloc
+        window = self._conf.window
+        now = get_clock().time()
+        slot = math.ceil((now + delay) / window)
+        key = (url, params.get("serial"), params.get("station_id"))
+        with self._lock:
+            if self._conf.dedupe:
+                if key in self._pending_keys:
+                    self._deduped += 1
+                    return False
+                self._pending_keys.add(key)
+            batch = self._open.get((host, slot))
+            if batch is None or len(batch) >= self._conf.max_size:
+                batch = self._open[(host, slot)] = []
+                self._get_scheduler().submit(max(slot * window - now, 0), self._flush, host, slot, batch)
+            batch.append((url, params, args))
+        return True
+
+    def _flush(self, host: str, slot: int, batch: List[Callback]) -> None:
+        with self._lock:
+            if self._open.get((host, slot)) is batch:
+                del self._open[(host, slot)]
+            # a retry of these callbacks must not be deduped against themselves
+            for url, params, _ in batch:
+                self._pending_keys.discard((url, params.get("serial"), params.get("station_id")))
+            self._batches += 1
+            self._batched += len(batch)
+        futures = [self._executor.submit(self._send, url, params, *args) for url, params, args in batch]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception("batched callback error, host: %s", host)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "batched": self._batched,
+                "avg_batch_size": self._batched / self._batches if self._batches else 0.0,
+                "open_batches": len(self._open),
+                "pending": len(self._pending_keys),
+                "posts_saved": self._deduped,
+            }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def open_batcher(conf: BatchConfig, get_scheduler: Callable[[], CallbackScheduler],
+                 send: Callable[..., None]) -> Optional[CallbackBatcher]:
+    if not conf.enabled:
+        return None
+    return CallbackBatcher(conf, get_scheduler, send)
@@ -0,0 +1,131 @@
+"""
+Compare the gevent and asyncio serving engines on /api/wcs/station/prepare.
+
+    python -m bench.engines --requests 20000 --concurrency 32
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import yaml
+
+from bench.stub import start_rms
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREPARE_PATH = "/api/wcs/station/prepare"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve(engine: str, port: int, rms_port: int) -> None:
+    os.chdir(ROOT)
+    import logger
+    from config.rms import RMSConfig, set_rms_config
+
+    logger.set_level(logging.WARNING)
+    with open("config/service.yaml", "r") as yaml_file:
+        rms_conf = yaml.safe_load(yaml_file)["rms"]
+    rms_conf["port"] = rms_port
+    rms_conf["request"]["delay"] = 0
+    rms_conf["journal"]["enabled"] = False
+    set_rms_config(RMSConfig(**rms_conf))
+
+    from controller import serve
+
+    serve(port, engine)
+
+
+def _wait_ready(port: int, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+def _client(port: int, count: int) -> List[float]:
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json"}
+    latencies = []
+    for i in range(count):
+        body = json.dumps({"serial": f"robot-{i}", "robot_type": 1, "station_id": f"st-{i % 16}"})
+        start = time.perf_counter()
+        conn.request("POST", PREPARE_PATH, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        latencies.append(time.perf_counter() - start)
+        if resp.status != 200:
+            raise RuntimeError(f"unexpected status {resp.status}")
+    conn.close()
+    return latencies
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_engine(engine: str, requests: int, concurrency: int, rms_port: int) -> Dict[str, Any]:
+    port = _free_port()
+    proc = multiprocessing.get_context("spawn").Process(target=_serve, args=(engine, port, rms_port), daemon=True)
+    proc.start()
+    try:
+        _wait_ready(port)
+        _client(port, 200)  # warm up
+        per_client = requests // concurrency
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(lambda _: _client(port, per_client), range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.join()
+    latencies = sorted(latency for result in results for latency in result)
+    return {
+        "engine": engine,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["gevent", "asyncio"])
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    rms_server = start_rms()
+    results = [run_engine(e, args.requests, args.concurrency, rms_server.server_port) for e in args.engines]
+    rms_server.shutdown()
+
+    print(f"{'engine':<10}{'requests':>10}{'rps':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['engine']:<10}{r['requests']:>10}{r['rps']:>12.1f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure the tote inventory at scale: memory per tote, putup throughput, latency of the inventory query routes
+through the controller, and the size and speed of a snapshot and restore.
+
+    python -m bench.inventory --totes 1000000 --queries 20000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from bench.engines import _percentile
+from bench.load import _process_usage
+
+
+def _latencies(fn: Any, bodies: List[bytes]) -> Dict[str, float]:
+    samples = []
+    for body in bodies:
+        start = time.perf_counter()
+        fn(body)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {"p50_us": _percentile(samples, 50) * 1e6, "p99_us": _percentile(samples, 99) * 1e6,
+            "max_us": samples[-1] * 1e6}
+
+
+def run(totes: int, per_order: int, queries: int, seed: int) -> Dict[str, Any]:
+    import controller
+    import logger
+    from inventory import get_inventory
+
+    logger.set_level("WARNING")
+    inventory = get_inventory()
+    rng = random.Random(seed)
+    rss_before = _process_usage(os.getpid())["rss_kb"]
+    start = time.perf_counter()
+    for i in range(totes):
+        inventory.put_up(f"box-{i:08d}", f"order-{i // per_order:07d}", f"A{i % 40:02d}-{i // 40 % 500:03d}-{i:08d}")
+    put_seconds = time.perf_counter() - start
+    rss_after = _process_usage(os.getpid())["rss_kb"]
+
+    routes = controller.get_routes()
+
+    def dispatcher(path: str) -> Any:
+        handler = routes[path]["GET"]
+        return lambda body: controller.dispatch(handler, body, "127.0.0.1")
+
+    picks = [rng.randrange(totes) for _ in range(queries)]
+    result = {
+        "totes": totes,
+        "putup_per_second": totes / put_seconds,
+        "bytes_per_tote": (rss_after - rss_before) * 1024 / totes,
+        "tote": _latencies(dispatcher("/api/wcs/inventory/tote"),
+                           [json.dumps({"boxnumber": f"box-{i:08d}"}).encode() for i in picks]),
+        "location": _latencies(dispatcher("/api/wcs/inventory/location"),
+                               [json.dumps({"location": f"A{i % 40:02d}-{i // 40 % 500:03d}-{i:08d}"}).encode()
+                                for i in picks]),
+        "order": _latencies(dispatcher("/api/wcs/inventory/order"),
+                            [json.dumps({"order_id": f"order-{i // per_order:07d}"}).encode() for i in picks]),
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.bin")
+        result["snapshot"] = inventory.snapshot(path)
+        result["restore"] = inventory.restore(path)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--totes", type=int, default=1000000)
+    parser.add_argument("--per-order", type=int, default=20, help="totes per order")
+    parser.add_argument("--queries", type=int, default=20000, help="queries per route")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    result = run(args.totes, args.per_order, args.queries, args.seed)
+    print(f"totes: {result['totes']}, putup: {result['putup_per_second']:.0f}/s, "
+          f"memory: {result['bytes_per_tote']:.0f} bytes/tote")
+    for name in ("tote", "location", "order"):
+        lat = result[name]
+        print(f"  {name:<9} p50 {lat['p50_us']:.1f}us  p99 {lat['p99_us']:.1f}us  max {lat['max_us']:.1f}us")
+    snap, restore = result["snapshot"], result["restore"]
+    print(f"snapshot: {snap['bytes'] / 1e6:.1f} MB in {snap['seconds']:.2f}s, restore: {restore['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
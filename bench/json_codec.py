@@ -0,0 +1,112 @@
+"""
+Measure the CPU time controller.dispatch spends per request with the stdlib json codec and per-request response
+encoding (how every handler used to run) against the fast codec with pre-serialized static responses. Handlers run
+in-process with logging below WARNING disabled, so the numbers are dominated by decoding, handling and encoding.
+
+    python -m bench.json_codec --requests 20000
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import yaml
+
+from bench.engines import ROOT
+from bench.load import FLOWS
+
+# (handler, body) pairs: one pass of every flow, without the admin endpoints whose cost is the stats they collect
+Call = Tuple[Callable[..., Any], bytes]
+
+
+def _calls() -> List[Call]:
+    import controller
+
+    routes = controller.get_routes()
+    calls = []
+    for flow in ("inbound", "outbound", "probe"):
+        for method, path, body in FLOWS[flow]("robot-1", "st-1"):
+            calls.append((routes[path][method], json.dumps(body).encode()))
+    # the validation failures are answered from static responses too
+    calls.append((routes["/api/wcs/station/prepare"]["POST"], b'{"serial": "robot-1"}'))
+    calls.append((routes["/api/wcs/mode/inbound"]["POST"], b"{}"))
+    return calls
+
+
+def _per_request_encoding(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a handler so that a static result goes back through encode() like a plain dict."""
+    import controller
+
+    @functools.wraps(handler)
+    def wrapper(req):
+        result = handler(req)
+        return dict(result.result) if isinstance(result, controller.StaticResponse) else result
+
+    return wrapper
+
+
+def run(mode: str, requests: int) -> Dict[str, Any]:
+    import codec
+    import controller
+
+    calls = _calls()
+    if mode == "baseline":
+        codec.set_codec("stdlib")
+        calls = [(_per_request_encoding(handler), body) for handler, body in calls]
+    else:
+        codec.set_codec("auto")
+    for handler, body in calls:  # warm up
+        controller.dispatch(handler, body, "127.0.0.1")
+
+    rounds = max(requests // len(calls), 1)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(rounds):
+        for handler, body in calls:
+            controller.dispatch(handler, body, "127.0.0.1")
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    count = rounds * len(calls)
+    return {
+        "mode": mode,
+        "codec": codec.get_codec().name,
+        "requests": count,
+        "cpu_us_per_request": cpu / count * 1e6,
+        "wall_us_per_request": wall / count * 1e6,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import logger
+    from config.rms import RMSConfig, set_rms_config
+
+    with open("config/service.yaml", "r") as yaml_file:
+        rms_conf = yaml.safe_load(yaml_file)["rms"]
+    # callbacks must not fire during the run, only their scheduling is part of the request
+    rms_conf["request"]["delay"] = 3600
+    rms_conf["journal"]["enabled"] = False
+    set_rms_config(RMSConfig(**rms_conf))
+    logger.set_level(logging.WARNING)
+
+    results = [run("baseline", args.requests), run("fast", args.requests)]
+
+    print(f"{'mode':<10}{'codec':<8}{'requests':>10}{'cpu us/req':>12}{'wall us/req':>13}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['codec']:<8}{r['requests']:>10}{r['cpu_us_per_request']:>12.2f}"
+              f"{r['wall_us_per_request']:>13.2f}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
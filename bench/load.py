@@ -0,0 +1,358 @@
+"""
+Load generator for the WCS endpoints. Starts the baffle in a child process plus a stand-in RMS that receives the
+dock callbacks, drives a weighted mix of flows from `concurrency` clients and reports throughput, request latency
+per route, request-to-callback latency and the server's memory and thread counts.
+
+    python -m bench --duration 30 --concurrency 32 --mix inbound=4,outbound=4,probe=1,admin=1 --json run.json
+
+Flows:
+    inbound   prepare -> inboundstart -> checkM1100 -> putup
+    outbound  outboundready -> outboundstart -> checkM1108
+    probe     station/full -> mode/inbound -> stack/num -> mode/outbound -> rms/demo
+    admin     /metrics and every /api/admin endpoint
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from bench.engines import ROOT, _free_port, _percentile, _wait_ready
+from bench.stub import start_rms
+
+DOCK_READY = "/api/rms/wcs/station_ready"
+DOCK_FINISH = "/api/rms/order-materials/finish"
+
+# (method, path, body or None)
+Step = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+class _CallbackLog:
+    """Send times of the requests that schedule a callback, and arrival times of the callbacks at the stand-in RMS."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.expected: Dict[Tuple[str, str], float] = {}
+        self.arrived: Dict[Tuple[str, str], float] = {}
+
+    def expect(self, path: str, serial: str, sent: float) -> None:
+        with self._lock:
+            self.expected[(path, serial)] = sent
+
+    def arrive(self, path: str, serial: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.arrived.setdefault((path, serial), now)
+
+    def on_callback(self, path: str, body: bytes, accepted: bool) -> None:
+        try:
+            self.arrive(path, json.loads(body).get("serial"))
+        except ValueError:
+            pass
+
+    def latencies(self) -> List[float]:
+        with self._lock:
+            return sorted(self.arrived[key] - sent for key, sent in self.expected.items() if key in self.arrived)
+
+    def missing(self) -> int:
+        with self._lock:
+            return sum(1 for key in self.expected if key not in self.arrived)
+
+
+def _serve(engine: str, workers: int, port: int, rms_port: int, delay: float, batch: bool, work_dir: str) -> None:
+    os.chdir(ROOT)
+    import logger
+    from config.rms import RMSConfig, set_rms_config
+    from config.server import ServerConfig
+
+    logger.set_level(logging.WARNING)
+    with open("config/service.yaml", "r") as yaml_file:
+        conf = yaml.safe_load(yaml_file)
+    rms_conf = conf["rms"]
+    rms_conf["port"] = rms_port
+    rms_conf["request"]["delay"] = delay
+    rms_conf["apis"] = {"dock_ready": DOCK_READY, "dock_finish": DOCK_FINISH}
+    rms_conf["journal"]["path"] = os.path.join(work_dir, "rms-journal.db")
+    rms_conf["batch"]["enabled"] = batch
+    set_rms_config(RMSConfig(**rms_conf))
+
+    from controller import serve
+
+    serve(port, engine, workers, ServerConfig(**conf["server"]).stations)
+
+
+def _inbound(serial: str, station: str) -> List[Step]:
+    return [
+        ("POST", "/api/wcs/station/prepare", {"serial": serial, "robot_type": 1, "station_id": station}),
+        ("POST", "/api/wcs/inbound/order_materials/inboundstart",
+         {"serial": serial, "robot_type": 1, "station_id": station}),
+        ("POST", "/api/wcs/inbound/order_materials/checkM1100", {"robot_type": 1, "station_id": station}),
+        ("POST", "/api/wcs/putup", {"order_id": f"order-{serial}", "boxnumber": f"box-{serial}", "location": "A-01"}),
+    ]
+
+
+def _outbound(serial: str, station: str) -> List[Step]:
+    return [
+        ("POST", "/api/wcs/outbound/order_materials/outboundready", {"station_id": station}),
+        ("POST", "/api/wcs/outbound/order_materials/outboundstart",
+         {"order_id": f"order-{serial}", "tote_ids": [f"tote-{serial}"], "station_id": station, "serial": serial,
+          "robot_type": 1}),
+        ("POST", "/api/wcs/outbound/order_materials/checkM1108", {"robot_type": 1, "station_id": station}),
+    ]
+
+
+def _probe(serial: str, station: str) -> List[Step]:
+    return [
+        ("GET", "/api/wcs/station/full", {"station_id": station}),
+        ("POST", "/api/wcs/mode/inbound", {"station_id": station}),
+        ("POST", "/api/wcs/inbound/stack/num", {"station_id": station, "num": 4}),
+        ("POST", "/api/wcs/mode/outbound", {"station_id": station}),
+        ("POST", "/api/rms/demo", {"serial": serial, "station_id": station}),
+    ]
+
+
+def _admin(serial: str, station: str) -> List[Step]:
+    return [
+        ("GET", "/metrics", None),
+        ("GET", "/api/admin/scheduler", None),
+        ("GET", "/api/admin/stations", None),
+        ("GET", "/api/admin/http_pool", None),
+        ("GET", "/api/admin/batcher", None),
+        ("GET", "/api/admin/logging", None),
+        ("GET", "/api/admin/deadletter", None),
+        ("POST", "/api/admin/deadletter/replay", {"ids": []}),
+    ]
+
+
+FLOWS: Dict[str, Callable[[str, str], List[Step]]] = {
+    "inbound": _inbound,
+    "outbound": _outbound,
+    "probe": _probe,
+    "admin": _admin,
+}
+
+# requests whose handler schedules an RMS callback, and the path the callback is posted to
+CALLBACK_PATHS = {
+    "/api/wcs/station/prepare": DOCK_READY,
+    "/api/wcs/inbound/order_materials/inboundstart": DOCK_FINISH,
+    "/api/wcs/outbound/order_materials/outboundstart": DOCK_FINISH,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError(f"unknown flow: {name}, expected one of {', '.join(FLOWS)}")
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+class _Client:
+    def __init__(self, index: int, port: int, mix: Dict[str, float], stations: int, callbacks: _CallbackLog,
+                 seed: int):
+        self._index = index
+        self._conn = http.client.HTTPConnection("127.0.0.1", port)
+        self._flows = list(mix)
+        self._weights = [mix[name] for name in self._flows]
+        self._stations = stations
+        self._callbacks = callbacks
+        self._random = random.Random(seed + index)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Dict[str, int] = defaultdict(int)
+        self.flows: Dict[str, int] = defaultdict(int)
+
+    def run(self, stop: Event) -> None:
+        headers = {"Content-Type": "application/json"}
+        n = 0
+        try:
+            while not stop.is_set():
+                flow = self._random.choices(self._flows, self._weights)[0]
+                serial = f"robot-{self._index}-{n}"
+                station = f"st-{self._random.randrange(self._stations)}"
+                n += 1
+                for method, path, body in FLOWS[flow](serial, station):
+                    payload = json.dumps(body) if body is not None else None
+                    start = time.monotonic()
+                    self._conn.request(method, path, body=payload, headers=headers)
+                    resp = self._conn.getresponse()
+                    data = resp.read()
+                    self.latencies[path].append(time.monotonic() - start)
+                    if resp.status != 200 or (resp.headers.get_content_type() == "application/json"
+                                              and json.loads(data).get("code") != 0):
+                        self.failures[path] += 1
+                    elif path in CALLBACK_PATHS:
+                        self._callbacks.expect(CALLBACK_PATHS[path], serial, start)
+                self.flows[flow] += 1
+        finally:
+            self._conn.close()
+
+
+def _process_usage(pid: int) -> Dict[str, int]:
+    """RSS and thread count of pid and its child processes (pre-forked workers), from /proc."""
+    rss_kb = threads = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+                    elif line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+        except OSError:
+            continue
+    return {"rss_kb": rss_kb, "threads": threads, "processes": len(pids)}
+
+
+def _summary(latencies: List[float]) -> Dict[str, Any]:
+    if not latencies:
+        return {"count": 0}
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def run(engine: str, workers: int, duration: float, concurrency: int, mix: Dict[str, float], stations: int,
+        delay: float, batch: bool, seed: int, callback_grace: float) -> Dict[str, Any]:
+    callbacks = _CallbackLog()
+    rms_server = start_rms(callbacks.on_callback)
+
+    port = _free_port()
+    with tempfile.TemporaryDirectory(prefix="wcs-bench-") as work_dir:
+        proc = multiprocessing.get_context("spawn").Process(
+            target=_serve, args=(engine, workers, port, rms_server.server_port, delay, batch, work_dir), daemon=True)
+        proc.start()
+        try:
+            _wait_ready(port)
+            idle = _process_usage(proc.pid)
+            clients = [_Client(i, port, mix, stations, callbacks, seed) for i in range(concurrency)]
+            stop = Event()
+            samples = []
+            start = time.monotonic()
+            with ThreadPoolExecutor(concurrency) as pool:
+                futures = [pool.submit(client.run, stop) for client in clients]
+                while time.monotonic() - start < duration:
+                    samples.append(_process_usage(proc.pid))
+                    time.sleep(min(0.5, max(duration - (time.monotonic() - start), 0)))
+                stop.set()
+                for future in futures:
+                    future.result()
+            elapsed = time.monotonic() - start
+            # callbacks fire `delay` seconds after their request, give the last ones time to arrive
+            deadline = time.monotonic() + delay + callback_grace
+            while callbacks.missing() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            final = _process_usage(proc.pid)
+        finally:
+            proc.terminate()
+            proc.join()
+            rms_server.shutdown()
+
+    by_route: Dict[str, List[float]] = defaultdict(list)
+    failures: Dict[str, int] = defaultdict(int)
+    flows: Dict[str, int] = defaultdict(int)
+    for client in clients:
+        for path, values in client.latencies.items():
+            by_route[path].extend(values)
+        for path, count in client.failures.items():
+            failures[path] += count
+        for flow, count in client.flows.items():
+            flows[flow] += count
+    total = sum(len(values) for values in by_route.values())
+    return {
+        "config": {
+            "engine": engine, "workers": workers, "duration": duration, "concurrency": concurrency, "mix": mix,
+            "stations": stations, "callback_delay": delay, "batch": batch, "seed": seed,
+        },
+        "elapsed": elapsed,
+        "requests": total,
+        "rps": total / elapsed,
+        "flows": dict(flows),
+        "failures": dict(failures),
+        "latency": _summary([v for values in by_route.values() for v in values]),
+        "routes": {path: _summary(values) for path, values in sorted(by_route.items())},
+        "callbacks": dict(_summary([v - delay for v in callbacks.latencies()]), expected=len(callbacks.expected),
+                          missing=callbacks.missing()),
+        "server": {
+            "idle": idle,
+            "peak_rss_kb": max([s["rss_kb"] for s in samples] + [final["rss_kb"]]),
+            "peak_threads": max([s["threads"] for s in samples] + [final["threads"]]),
+            "final": final,
+        },
+    }
+
+
+def _print(result: Dict[str, Any]) -> None:
+    conf = result["config"]
+    print(f"engine: {conf['engine']}, workers: {conf['workers']}, concurrency: {conf['concurrency']}, "
+          f"flows: {result['flows']}")
+    print(f"{'route':<52}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'fail':>7}")
+    for path, s in result["routes"].items():
+        print(f"{path:<52}{s['count']:>8}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}"
+              f"{result['failures'].get(path, 0):>7}")
+    s = result["latency"]
+    print(f"{'all':<52}{s['count']:>8}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}"
+          f"{sum(result['failures'].values()):>7}")
+    print(f"throughput: {result['rps']:.1f} req/s")
+    cb = result["callbacks"]
+    if cb["count"]:
+        print(f"callbacks: {cb['count']}/{cb['expected']} received, request-to-callback beyond the configured delay "
+              f"p50 {cb['p50_ms']:.3f} ms, p95 {cb['p95_ms']:.3f} ms, p99 {cb['p99_ms']:.3f} ms")
+    server = result["server"]
+    print(f"server: peak rss {server['peak_rss_kb'] / 1024:.1f} MiB, peak threads {server['peak_threads']}, "
+          f"idle rss {server['idle']['rss_kb'] / 1024:.1f} MiB, idle threads {server['idle']['threads']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=["gevent", "asyncio"], default="gevent")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("inbound=4,outbound=4,probe=1,admin=1"),
+                        help="weighted flows, e.g. inbound=4,outbound=4,probe=1,admin=1")
+    parser.add_argument("--stations", type=int, default=64, help="distinct station ids")
+    parser.add_argument("--callback-delay", type=float, default=0, help="rms.request.delay for the run")
+    parser.add_argument("--callback-grace", type=float, default=10,
+                        help="seconds to wait for outstanding callbacks after the load stops")
+    parser.add_argument("--batch", action="store_true", help="enable rms.batch for the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args.engine, args.workers, args.duration, args.concurrency, args.mix, args.stations,
+                 args.callback_delay, args.batch, args.seed, args.callback_grace)
+    _print(result)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
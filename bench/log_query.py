@@ -0,0 +1,105 @@
+"""
+Write a JSONL log of --records request records through the rotating handler, wait for the archiver to compress
+and index the segments, then look up serials, stations and orders through the sidecar indexes against reading
+every segment in full, the way grepping the log for them would.
+
+    python -m bench.log_query --records 500000 --max-mb 16
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+
+def _write(log_dir: str, records: int, max_bytes: int) -> Dict[str, Any]:
+    import logger
+    from logger.rotation import get_archiver
+
+    bench_logger = logger.Logger(name="bench-query", log_dir=log_dir,
+                                 rotation=logger.RotationOptions(max_bytes=max_bytes, backups=0))
+    bench_logger.handlers[0].setLevel(logging.CRITICAL + 1)
+    logger.set_global_logger(bench_logger)
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("station prepare request: %s.",
+                    {"serial": f"robot-{i % 2000}", "robot_type": 1, "station_id": f"st-{i % 64}"})
+        if i % 10 == 0:
+            logger.info("outbound_start, order_id: %s, tote_ids: %s, station_id: %s, serial: %s",
+                        f"order-{i // 10}", [f"box-{i}"], f"st-{i % 64}", f"robot-{i % 2000}")
+    written = time.perf_counter() - start
+    start = time.perf_counter()
+    get_archiver().join()
+    return {"write_s": written, "archive_wait_s": time.perf_counter() - start}
+
+
+def _full_scan(path: str, value: str) -> int:
+    """Every segment decompressed and searched line by line for the value, what grepping the log amounts to."""
+    from logger.rotation import list_segments
+
+    needle = value.encode()
+    found = 0
+    for segment in list_segments(path) + [path]:
+        with (gzip.open if segment.endswith(".gz") else open)(segment, "rb") as f:
+            found += sum(1 for line in f if needle in line)
+    return found
+
+
+def _timed(fn: Any, lookups: List[Tuple[str, str]]) -> Tuple[float, int]:
+    start = time.perf_counter()
+    found = sum(fn(field, value) for field, value in lookups)
+    return (time.perf_counter() - start) / len(lookups), found
+
+
+def run(records: int, max_bytes: int, lookups: int, seed: int) -> Dict[str, Any]:
+    from logger.rotation import list_segments, query
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as log_dir:
+        result = _write(log_dir, records, max_bytes)
+        path = os.path.join(log_dir, "bench-query.jsonl")
+        segments = list_segments(path)
+        result["segments"] = len(segments)
+        result["compressed_mb"] = sum(os.path.getsize(s) for s in segments) / 1e6
+        result["index_mb"] = sum(os.path.getsize(s + ".idx") for s in segments) / 1e6
+        result["live_mb"] = os.path.getsize(path) / 1e6
+        picks = [("serial", f"robot-{rng.randrange(2000)}") for _ in range(lookups)]
+        picks += [("station_id", f"st-{rng.randrange(64)}") for _ in range(lookups)]
+        picks += [("order_id", f"order-{rng.randrange(records // 10)}") for _ in range(lookups)]
+        for field in ("serial", "station_id", "order_id"):
+            chosen = [pick for pick in picks if pick[0] == field]
+            indexed, found = _timed(lambda f, v: sum(1 for _ in query(path, {f: v})), chosen)
+            scanned, _ = _timed(lambda f, v: _full_scan(path, v), chosen[:max(1, lookups // 10)])
+            result[field] = {"indexed_ms": indexed * 1000, "scan_ms": scanned * 1000,
+                             "records_per_lookup": found / len(chosen)}
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=500000)
+    parser.add_argument("--max-mb", type=float, default=16, help="segment size the log rolls over at")
+    parser.add_argument("--lookups", type=int, default=20, help="lookups per field")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+    result = run(args.records, int(args.max_mb * 1024 * 1024), args.lookups, args.seed)
+
+    print(f"wrote {args.records} requests in {result['write_s']:.1f}s, archiver done {result['archive_wait_s']:.1f}s "
+          f"later: {result['segments']} segments, {result['compressed_mb']:.1f} MB compressed, "
+          f"{result['index_mb']:.2f} MB of indexes, {result['live_mb']:.1f} MB live")
+    print(f"{'field':<12}{'indexed ms':>12}{'full scan ms':>14}{'records':>10}")
+    for field in ("serial", "station_id", "order_id"):
+        r = result[field]
+        print(f"{field:<12}{r['indexed_ms']:>12.1f}{r['scan_ms']:>14.1f}{r['records_per_lookup']:>10.1f}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
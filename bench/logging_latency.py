@@ -0,0 +1,92 @@
+"""
+Measure request latency with synchronous and asynchronous (batched) logging on /api/wcs/station/prepare.
+The handler runs in-process through controller.dispatch with real file handlers in a temporary log dir.
+
+    python -m bench.logging_latency --requests 20000
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(mode: str, requests: int, log_dir: str, options: Optional[Any]) -> Dict[str, Any]:
+    import controller
+    import logger
+
+    bench_logger = logger.Logger(name=f"bench-{mode}", log_dir=log_dir, async_options=options)
+    # keep stdout quiet, the file handlers are what we are measuring
+    bench_logger.handlers[0].setLevel(logging.CRITICAL + 1)
+    logger.set_global_logger(bench_logger)
+
+    handler = controller.get_routes()["/api/wcs/station/prepare"]["POST"]
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        body = json.dumps({"serial": f"robot-{i}", "robot_type": 1, "station_id": f"st-{i % 16}"}).encode()
+        t = time.perf_counter()
+        controller.dispatch(handler, body, "127.0.0.1")
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    stats = bench_logger.stats()
+    bench_logger.close()
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": requests,
+        "rps": requests / elapsed,
+        "p50_us": _percentile(latencies, 50) * 1e6,
+        "p99_us": _percentile(latencies, 99) * 1e6,
+        "logging": stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--overflow", default="block", choices=["block", "drop-debug", "drop-oldest"])
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    import logger
+    from config.rms import RMSConfig, set_rms_config
+
+    with open("config/service.yaml", "r") as yaml_file:
+        rms_conf = yaml.safe_load(yaml_file)["rms"]
+    # callbacks must not fire during the run, only their scheduling is part of the request
+    rms_conf["request"]["delay"] = 3600
+    rms_conf["journal"]["enabled"] = False
+    set_rms_config(RMSConfig(**rms_conf))
+
+    results = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        results.append(run("sync", args.requests, log_dir, None))
+        results.append(run("async", args.requests, log_dir, logger.AsyncOptions(overflow=args.overflow)))
+        for r in results:
+            with open(os.path.join(log_dir, f"bench-{r['mode']}.jsonl"), "rb") as f:
+                r["records_written"] = sum(1 for _ in f)
+
+    print(f"{'mode':<8}{'requests':>10}{'rps':>12}{'p50 us':>10}{'p99 us':>10}{'records':>10}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['requests']:>10}{r['rps']:>12.1f}{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}"
+              f"{r['records_written']:>10}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure what the compiled request schemas cost: the one-off compile of every payload schema at import, and the
+per-request validation of a valid and an invalid body, against the hand-written checks the handlers used to do
+and against validating with the pydantic model itself.
+
+    python -m bench.schema_validation --iterations 200000
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import payloads
+from schema import compile_schema
+
+SCHEMAS = [
+    payloads.StationFull, payloads.StationPrepare, payloads.InboundStart, payloads.RobotLeft, payloads.Putup,
+    payloads.OutboundStart, payloads.Station, payloads.DeadLetterReplay,
+]
+
+VALID = {"serial": "robot-1", "robot_type": 1, "station_id": "st-1"}
+INVALID = {"serial": "robot-1", "station_id": "st-1"}
+
+
+def _hand_written(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The checks station_prepare did inline before schemas."""
+    serial = data.get("serial")
+    robot_type = data.get("robot_type")
+    station_id = data.get("station_id")
+    if serial is None:
+        return {"code": 1, "msg": "参数错误: serial不能为空"}
+    if robot_type is None:
+        return {"code": 1, "msg": "参数错误: robot_type不能为空"}
+    if station_id is None:
+        return {"code": 1, "msg": "参数错误: station_id不能为空"}
+    return None
+
+
+def _pydantic(data: Dict[str, Any]) -> Any:
+    try:
+        return payloads.StationPrepare(**data)
+    except ValueError:
+        return None
+
+
+def _time(fn: Callable[[Dict[str, Any]], Any], data: Dict[str, Any], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(data)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    compile_ms: List[float] = []
+    for _ in range(20):
+        start = time.perf_counter()
+        compiled = [compile_schema(schema, lambda result: result) for schema in SCHEMAS]
+        compile_ms.append((time.perf_counter() - start) * 1000)
+    validate = compiled[SCHEMAS.index(payloads.StationPrepare)].validate
+
+    results = {
+        "schemas": len(SCHEMAS),
+        "compile_all_ms": min(compile_ms),
+        "validation_ns": {
+            name: {"valid": _time(fn, VALID, args.iterations), "invalid": _time(fn, INVALID, args.iterations)}
+            for name, fn in (("compiled", validate), ("hand-written", _hand_written), ("pydantic", _pydantic))
+        },
+    }
+    print(f"compiled {results['schemas']} schemas in {results['compile_all_ms']:.3f} ms")
+    print(f"{'validator':<14}{'valid ns':>10}{'invalid ns':>12}")
+    for name, r in results["validation_ns"].items():
+        print(f"{name:<14}{r['valid']:>10.1f}{r['invalid']:>12.1f}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
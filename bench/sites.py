@@ -0,0 +1,163 @@
+"""
+Serve N simulated sites from one process (server.sites) against N single-site processes: time until every port
+accepts, resident memory and threads once each site has handled a dock prepare and called back the stand-in RMS.
+
+    python -m bench.sites --sites 50 --engine gevent
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from bench.engines import PREPARE_PATH, ROOT, _free_port
+from bench.load import _process_usage
+from bench.stub import start_rms
+
+
+_callbacks_lock = Lock()
+_callbacks = 0
+
+
+def _count_callback(path: str, body: bytes, accepted: bool) -> None:
+    global _callbacks
+    with _callbacks_lock:
+        _callbacks += 1
+
+
+def _write_config(directory: str, name: str, engine: str, rms_port: int, port: Optional[int],
+                  stations: Dict[str, Any], sites: List[Dict[str, Any]]) -> str:
+    with open(os.path.join(ROOT, "config/service.yaml"), "r") as yaml_file:
+        conf = yaml.safe_load(yaml_file)
+    server = conf["server"]
+    server.update(engine=engine, port=port, sites=sites, scenario_file=None)
+    server["stations"].update(stations)
+    server["config_reload"]["watch"] = False
+    server["inventory"]["snapshot_path"] = None
+    rms = conf["rms"]
+    rms["port"] = rms_port
+    rms["request"]["delay"] = 0
+    rms["journal"]["enabled"] = False
+    path = os.path.join(directory, f"{name}.yaml")
+    with open(path, "w") as yaml_file:
+        yaml.safe_dump(conf, yaml_file)
+    return path
+
+
+def _serve(config_path: str) -> None:
+    os.chdir(ROOT)
+    import hot_reload
+    import logger
+
+    logger.set_level(logging.WARNING)
+    hot_reload.publish(hot_reload.load_snapshot(config_path))
+    from config.server import get_server_config
+    from controller import serve
+
+    conf = get_server_config()
+    serve(conf.port, conf.engine, conf.workers, conf.stations, conf.sites)
+
+
+def _wait_ready(ports: List[int], timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    pending = list(ports)
+    while pending:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{len(pending)} ports did not come up, first: {pending[0]}")
+        try:
+            with socket.create_connection(("127.0.0.1", pending[0]), timeout=0.2):
+                pending.pop(0)
+        except OSError:
+            time.sleep(0.02)
+
+
+def _prepare(port: int, station: str) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    body = json.dumps({"serial": f"robot-{port}", "robot_type": 1, "station_id": station})
+    conn.request("POST", PREPARE_PATH, body=body, headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    if resp.status != 200:
+        raise RuntimeError(f"unexpected status {resp.status} from port {port}")
+
+
+def run(mode: str, sites: int, engine: str, capacity: int, rms_port: int) -> Dict[str, Any]:
+    """mode "one": every site from one process, "many": one single-site process per site."""
+    ports = [_free_port() for _ in range(sites)]
+    stations = {"capacity": capacity, "stripes": min(16, capacity)}
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        if mode == "one":
+            site_confs = [{"name": f"site-{i}", "port": port, "stations": stations} for i, port in enumerate(ports)]
+            configs = [_write_config(tmp, "sites", engine, rms_port, None, stations, site_confs)]
+        else:
+            configs = [_write_config(tmp, f"site-{i}", engine, rms_port, port, stations, [])
+                       for i, port in enumerate(ports)]
+        start = time.perf_counter()
+        procs = [ctx.Process(target=_serve, args=(path,), daemon=True) for path in configs]
+        for proc in procs:
+            proc.start()
+        try:
+            _wait_ready(ports)
+            startup = time.perf_counter() - start
+            before = _callbacks
+            for i, port in enumerate(ports):
+                _prepare(port, f"st-{i}")
+            deadline = time.monotonic() + 30
+            while _callbacks - before < sites and time.monotonic() < deadline:
+                time.sleep(0.05)
+            callbacks = _callbacks - before
+            usage = [_process_usage(proc.pid) for proc in procs]
+        finally:
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+    rss_kb = sum(u["rss_kb"] for u in usage)
+    return {
+        "mode": mode,
+        "sites": sites,
+        "engine": engine,
+        "processes": len(procs),
+        "startup_s": startup,
+        "rss_mb": rss_kb / 1024,
+        "rss_mb_per_site": rss_kb / 1024 / sites,
+        "threads": sum(u["threads"] for u in usage),
+        "callbacks": callbacks,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=50)
+    parser.add_argument("--engine", choices=["gevent", "asyncio"], default="gevent")
+    parser.add_argument("--modes", nargs="+", choices=["one", "many"], default=["one", "many"])
+    parser.add_argument("--capacity", type=int, default=256, help="station table slots per site")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    rms_server = start_rms(_count_callback)
+    results = [run(mode, args.sites, args.engine, args.capacity, rms_server.server_port) for mode in args.modes]
+    rms_server.shutdown()
+
+    print(f"{'mode':<6}{'sites':>7}{'procs':>7}{'startup s':>11}{'rss MB':>10}{'MB/site':>9}{'threads':>9}"
+          f"{'callbacks':>11}")
+    for r in results:
+        print(f"{r['mode']:<6}{r['sites']:>7}{r['processes']:>7}{r['startup_s']:>11.2f}{r['rss_mb']:>10.1f}"
+              f"{r['rss_mb_per_site']:>9.2f}{r['threads']:>9}{r['callbacks']:>11}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
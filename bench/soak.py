@@ -0,0 +1,220 @@
+"""
+Soak run on a virtual clock. Drives a weighted mix of flows through the baffle in process, one simulated step at a
+time, while a stand-in RMS rejects a share of the dock callbacks. Callback delays, retry backoff, the retry budget,
+batch windows and station busy windows all run on simulated time, so an hour of traffic takes seconds.
+
+    python -m bench.soak --hours 1 --rate 2 --reject 0.05 --json soak.json
+
+Reports request failures, callbacks delivered, missing and dead-lettered, callback latency in simulated seconds,
+and a timeline of pending callbacks, memory and threads.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+from bench.engines import ROOT, _percentile
+from bench.load import CALLBACK_PATHS, DOCK_FINISH, DOCK_READY, FLOWS, _process_usage, parse_mix
+from bench.stub import start_rms
+
+
+class _VirtualCallbackLog:
+    """Simulated send time of every request that schedules a callback, and simulated arrival time at the RMS."""
+
+    def __init__(self, clock: Any):
+        self._clock = clock
+        self._lock = Lock()
+        self.expected: Dict[Tuple[str, str], float] = {}
+        self.arrived: Dict[Tuple[str, str], float] = {}
+        self.posts = 0
+        self.rejected = 0
+
+    def expect(self, path: str, serial: str) -> None:
+        with self._lock:
+            self.expected[(path, serial)] = self._clock.time()
+
+    def arrive(self, path: str, serial: str) -> None:
+        with self._lock:
+            self.arrived.setdefault((path, serial), self._clock.time())
+
+    def on_callback(self, path: str, body: bytes, accepted: bool) -> None:
+        with self._lock:
+            self.posts += 1
+            self.rejected += not accepted
+        if accepted:
+            try:
+                self.arrive(path, json.loads(body).get("serial"))
+            except ValueError:
+                pass
+
+    def latencies(self) -> List[float]:
+        with self._lock:
+            return sorted(self.arrived[key] - sent for key, sent in self.expected.items() if key in self.arrived)
+
+    def missing(self) -> int:
+        with self._lock:
+            return sum(1 for key in self.expected if key not in self.arrived)
+
+
+def _configure(rms_port: int, batch: bool) -> None:
+    import logger
+    from config.rms import RMSConfig, set_rms_config
+    from config.server import ServerConfig, set_server_config
+
+    logger.set_level(logging.WARNING)
+    with open(os.path.join(ROOT, "config/service.yaml"), "r") as yaml_file:
+        conf = yaml.safe_load(yaml_file)
+    rms_conf = conf["rms"]
+    rms_conf["port"] = rms_port
+    rms_conf["apis"] = {"dock_ready": DOCK_READY, "dock_finish": DOCK_FINISH}
+    rms_conf["journal"]["enabled"] = False
+    rms_conf["batch"]["enabled"] = batch
+    set_server_config(ServerConfig(**conf["server"]))
+    set_rms_config(RMSConfig(**rms_conf))
+
+
+def run(hours: float, rate: float, step: float, mix: Dict[str, float], stations: int, reject: float, batch: bool,
+        sample_every: float, seed: int) -> Dict[str, Any]:
+    import clock
+
+    virtual = clock.VirtualClock()
+    clock.set_clock(virtual)
+    callbacks = _VirtualCallbackLog(virtual)
+    server = start_rms(callbacks.on_callback, reject, seed, name="flaky-rms")
+    _configure(server.server_address[1], batch)
+
+    import controller
+    import rms
+
+    routes = controller.get_routes()
+    rng = random.Random(seed)
+    flows = list(mix)
+    weights = [mix[name] for name in flows]
+    failures: Dict[str, int] = defaultdict(int)
+    counts: Dict[str, int] = defaultdict(int)
+    timeline: List[Dict[str, Any]] = []
+    requests = 0
+    due = 0.0
+    n = 0
+    simulated = hours * 3600
+    steps = int(simulated / step)
+    next_sample = 0.0
+    start = time.perf_counter()
+
+    def sample() -> None:
+        timeline.append({
+            "simulated_s": virtual.monotonic(),
+            "wall_s": time.perf_counter() - start,
+            "pending_callbacks": len(rms.get_registry()),
+            "dead_letters": len(rms.get_dead_letters()),
+            **_process_usage(os.getpid()),
+        })
+
+    for _ in range(steps):
+        # a fractional rate carries over, so rate=0.5 runs one flow every other second
+        due += rate * step
+        while due >= 1:
+            due -= 1
+            flow = rng.choices(flows, weights)[0]
+            serial = f"soak-{n}"
+            station = f"st-{rng.randrange(stations)}"
+            n += 1
+            for method, path, body in FLOWS[flow](serial, station):
+                payload = json.dumps(body).encode() if body is not None else b""
+                reply = controller.dispatch(routes[path][method], payload, "127.0.0.1")
+                requests += 1
+                if reply.status != 200 or (reply.content_type.startswith("application/json")
+                                           and json.loads(reply.body).get("code") != 0):
+                    failures[path] += 1
+                elif path in CALLBACK_PATHS:
+                    callbacks.expect(CALLBACK_PATHS[path], serial)
+            counts[flow] += 1
+        if virtual.monotonic() >= next_sample:
+            sample()
+            next_sample += sample_every
+        virtual.advance(step)
+        rms.get_scheduler().wait_idle()
+    # let the retries still pending run out, on simulated time too
+    drained_for = 0.0
+    while len(rms.get_registry()) and drained_for < 3600:
+        virtual.advance(step)
+        drained_for += step
+        rms.get_scheduler().wait_idle()
+    sample()
+    wall = time.perf_counter() - start
+    server.shutdown()
+    latencies = callbacks.latencies()
+    return {
+        "simulated_seconds": virtual.monotonic(),
+        "drain_seconds": drained_for,
+        "wall_seconds": wall,
+        "speedup": virtual.monotonic() / wall if wall else None,
+        "flows": dict(counts),
+        "requests": requests,
+        "failures": dict(failures),
+        "callbacks": {
+            "expected": len(callbacks.expected),
+            "delivered": len(callbacks.arrived),
+            "missing": callbacks.missing(),
+            "posts": callbacks.posts,
+            "rejected": callbacks.rejected,
+            "dead_letters": len(rms.get_dead_letters()),
+            "still_pending": len(rms.get_registry()),
+            "latency_p50_s": _percentile(latencies, 50) if latencies else None,
+            "latency_p99_s": _percentile(latencies, 99) if latencies else None,
+            "latency_max_s": latencies[-1] if latencies else None,
+        },
+        "timeline": timeline,
+    }
+
+
+def _print(result: Dict[str, Any]) -> None:
+    cb = result["callbacks"]
+    print(f"simulated {result['simulated_seconds']:.0f}s ({result['drain_seconds']:.0f}s drain) in "
+          f"{result['wall_seconds']:.1f}s wall, {result['speedup']:.0f}x")
+    print(f"flows: {result['flows']}, requests: {result['requests']}, failures: {sum(result['failures'].values())}")
+    print(f"callbacks expected: {cb['expected']}, delivered: {cb['delivered']}, missing: {cb['missing']}, "
+          f"posts: {cb['posts']}, rejected: {cb['rejected']}, dead letters: {cb['dead_letters']}, "
+          f"still pending: {cb['still_pending']}")
+    if cb["latency_p50_s"] is not None:
+        print(f"callback latency (simulated): p50 {cb['latency_p50_s']:.1f}s, p99 {cb['latency_p99_s']:.1f}s, "
+              f"max {cb['latency_max_s']:.1f}s")
+    print(f"{'simulated':>10} {'wall':>8} {'pending':>8} {'dead':>6} {'rss_mb':>8} {'threads':>8}")
+    for point in result["timeline"]:
+        print(f"{point['simulated_s']:>9.0f}s {point['wall_s']:>7.1f}s {point['pending_callbacks']:>8} "
+              f"{point['dead_letters']:>6} {point['rss_kb'] / 1024:>8.1f} {point['threads']:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1, help="simulated duration")
+    parser.add_argument("--rate", type=float, default=2, help="flows started per simulated second")
+    parser.add_argument("--step", type=float, default=1, help="simulated seconds the clock advances at a time")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("inbound=1,outbound=1"),
+                        help="weighted flows, e.g. inbound=4,outbound=4,probe=1")
+    parser.add_argument("--stations", type=int, default=20)
+    parser.add_argument("--reject", type=float, default=0.05, help="share of callbacks the stand-in RMS rejects")
+    parser.add_argument("--batch", action="store_true", help="enable the callback batching stage")
+    parser.add_argument("--sample-every", type=float, default=600, help="simulated seconds between timeline points")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the result to this file")
+    args = parser.parse_args()
+    sys.path.insert(0, ROOT)
+    result = run(args.hours, args.rate, args.step, args.mix, args.stations, args.reject, args.batch,
+                 args.sample_every, args.seed)
+    _print(result)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(result, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Time `python main.py` from spawn until its port accepts, with the validated config read from YAML and from a warm
+CONFIG_CACHE, then break down one start's imports by top-level module with `-X importtime`.
+
+    python -m bench.startup --runs 10 --engine gevent
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from bench.engines import ROOT, _free_port
+
+
+def _write_config(directory: str, engine: str, port: int) -> str:
+    with open(os.path.join(ROOT, "config/service.yaml"), "r") as yaml_file:
+        conf = yaml.safe_load(yaml_file)
+    server = conf["server"]
+    server.update(engine=engine, port=port, workers=1)
+    server["config_reload"]["watch"] = False
+    server["trace"]["enabled"] = False
+    server["inventory"]["snapshot_path"] = None
+    # a log dir that doesn't exist: log to stderr only, like a fresh checkout
+    server["logger"]["log_dir"] = os.path.join(directory, "logs")
+    conf["rms"]["journal"]["enabled"] = False
+    path = os.path.join(directory, "service.yaml")
+    with open(path, "w") as yaml_file:
+        yaml.safe_dump(conf, yaml_file)
+    return path
+
+
+def _start(port: int, env: Dict[str, str], importtime: bool = False, timeout: float = 30) -> Dict[str, Any]:
+    """Spawn main.py, wait for port to accept, stop it. Returns the seconds it took and what it wrote to stderr."""
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["main.py"]
+    start = time.perf_counter()
+    proc = subprocess.Popen(args, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                    break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"main.py did not come up on port {port}: {proc.stderr.read()[-2000:]}")
+                time.sleep(0.002)
+        seconds = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        _, stderr = proc.communicate()
+    return {"seconds": seconds, "stderr": stderr}
+
+
+def _importtime(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Cumulative import time of each top-level module, from the lines `-X importtime` writes to stderr."""
+    totals: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            # nested under another import, already counted in its cumulative time; or the header line
+            continue
+        root = name.strip().split(".")[0]
+        totals[root] = totals.get(root, 0) + int(cumulative)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    return [{"module": name, "ms": us / 1000} for name, us in ranked[:top]]
+
+
+def run(engine: str, runs: int, top: int, cache: bool) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"engine": engine, "runs": runs}
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        env = dict(os.environ, CONFIG_PATH=_write_config(tmp, engine, port))
+        cache_path: Optional[str] = os.path.join(tmp, "service.cache") if cache else None
+        modes = {"yaml": env}
+        if cache_path is not None:
+            modes["cached"] = dict(env, CONFIG_CACHE=cache_path)
+            # the first start with the cache writes it
+            _start(port, modes["cached"])
+        for mode, mode_env in modes.items():
+            samples = sorted(_start(port, mode_env)["seconds"] for _ in range(runs))
+            result[mode] = {"median_ms": statistics.median(samples) * 1000, "min_ms": samples[0] * 1000,
+                            "max_ms": samples[-1] * 1000}
+        result["imports"] = _importtime(_start(port, modes.get("cached", env), importtime=True)["stderr"], top)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", choices=["gevent", "asyncio"], default="gevent")
+    parser.add_argument("--runs", type=int, default=10, help="starts timed per mode")
+    parser.add_argument("--top", type=int, default=15, help="top-level modules listed in the import breakdown")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="only time starts parsing the YAML")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+    result = run(args.engine, args.runs, args.top, args.cache)
+
+    print(f"engine: {result['engine']}, {result['runs']} starts per mode, spawn until the port accepts")
+    for mode in ("yaml", "cached"):
+        if mode in result:
+            r = result[mode]
+            print(f"  {mode:<7} median {r['median_ms']:7.1f}ms  min {r['min_ms']:7.1f}ms  max {r['max_ms']:7.1f}ms")
+    print("imports of one start, cumulative per top-level module:")
+    for entry in result["imports"]:
+        print(f"  {entry['module']:<28}{entry['ms']:>9.1f}ms")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
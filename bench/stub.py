@@ -0,0 +1,57 @@
+"""
+The stand-in RMS the benchmarks, the soak run and replay.py deliver callbacks to: answers every POST with the RMS
+success reply, or with a rejection for a --reject share of them.
+"""
+import random
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Callable, Optional
+
+ACCEPTED = b'{"code":0,"msg":""}'
+REJECTED = b'{"code":1,"msg":"rejected by stand-in RMS"}'
+
+# called with the path, the body and whether the POST was accepted, on the thread serving it
+OnCallback = Callable[[str, bytes, bool], None]
+
+
+def start_rms(on_callback: Optional[OnCallback] = None, reject: float = 0.0, seed: int = 1,
+              name: str = "stand-in-rms") -> ThreadingHTTPServer:
+    """Serve the stand-in RMS on a free localhost port from a daemon thread. server_port is where it listens."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(on_callback, reject, seed))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return server
+
+
+def _handler(on_callback: Optional[OnCallback], reject: float, seed: int) -> type:
+    rng = random.Random(seed)
+    rng_lock = Lock()
+
+    class _StandInRMS(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # headers and body go out as separate writes, don't let Nagle hold the body for the client's delayed ACK
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            accepted = True
+            if reject:
+                with rng_lock:
+                    accepted = rng.random() >= reject
+            if on_callback is not None:
+                on_callback(self.path, body, accepted)
+            reply = ACCEPTED if accepted else REJECTED
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return _StandInRMS
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import os
+import weakref
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from clock import get_clock
+from config.rms import RMSConfig
+
+
+class PendingCallback:
+    """
+    One RMS callback between submission and completion. token changes whenever the callback is rescheduled
+    (retry, fire now, shift), so a scheduler entry carrying an older token knows it has been superseded.
+    scheduled is the handle of the scheduler entry of the current token, if it went straight to the scheduler.
+    """
+
+    __slots__ = ("id", "url", "host", "params", "serial", "station_id", "attempt", "due", "token", "running",
+                 "conf", "scheduled", "due_seq")
+
+    def __init__(self, callback_id: str, url: str, params: Dict[str, Any], attempt: int, due: float,
+                 conf: RMSConfig):
+        self.id = callback_id
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.params = params
+        self.serial = params.get("serial")
+        self.station_id = params.get("station_id")
+        self.attempt = attempt
+        self.due = due
+        self.token = 0
+        self.running = False
+        self.conf = conf
+        self.scheduled: Any = None
+        # the sequence number of its live entry in the registry's due heap
+        self.due_seq = -1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "host": self.host,
+            "site": self.conf.site,
+            "params": self.params,
+            "attempt": self.attempt,
+            "due": self.due,
+            "due_in": self.due - get_clock().time(),
+            "running": self.running,
+        }
+
+
+class CallbackRegistry:
+    """
+    Every pending RMS callback by id, indexed by serial, station_id and target host, so looking up, cancelling or
+    rescheduling the callbacks of one robot, station or RMS instance only touches those callbacks. A heap of
+    (due, seq, id) pages through all of them, earliest due first, without sorting them per page. Rescheduling or
+    removing a callback leaves its heap entry behind, stale once seq no longer matches the callback's; stale
+    entries are skipped, and dropped once they make up half of the heap.
+    """
+
+    def __init__(self):
+        self._reset()
+        # callbacks pending at fork time are scheduled in the parent, a forked worker starts empty like its scheduler
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._reset())
+
+    def _reset(self) -> None:
+        self._lock = Lock()
+        self._entries: Dict[str, PendingCallback] = {}
+        self._indexes: Dict[str, Dict[Any, Set[str]]] = {"serial": {}, "station_id": {}, "host": {}}
+        self._by_due: List[Tuple[float, int, str]] = []
+        self._stale = 0
+        self._due_seq = itertools.count()
+        self._running = 0
+
+    def add(self, callback_id: str, url: str, params: Dict[str, Any], attempt: int, due: float,
+            conf: RMSConfig) -> PendingCallback:
+        entry = PendingCallback(callback_id, url, params, attempt, due, conf)
+        with self._lock:
+            replaced = self._entries.get(callback_id)
+            if replaced is not None:
+                self._unindex(replaced)
+            self._entries[callback_id] = entry
+            self._push_due(entry)
+            for field, index in self._indexes.items():
+                index.setdefault(_hashable(getattr(entry, field)), set()).add(callback_id)
+        return entry
+
+    def remove(self, callback_id: str) -> Optional[PendingCallback]:
+        with self._lock:
+            entry = self._entries.pop(callback_id, None)
+            if entry is None:
+                return None
+            self._unindex(entry)
+        return entry
+
+    def _unindex(self, entry: PendingCallback) -> None:
+        """Drop entry from the indexes and counters. Must hold self._lock."""
+        self._drop_due(entry)
+        if entry.running:
+            self._running -= 1
+        for field, index in self._indexes.items():
+            key = _hashable(getattr(entry, field))
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(entry.id)
+                if not ids:
+                    del index[key]
+
+    def _push_due(self, entry: PendingCallback) -> None:
+        entry.due_seq = next(self._due_seq)
+        heapq.heappush(self._by_due, (entry.due, entry.due_seq, entry.id))
+
+    def _drop_due(self, entry: PendingCallback) -> None:
+        """Make the heap entry of entry stale. Must hold self._lock."""
+        entry.due_seq = -1
+        self._stale += 1
+        while self._by_due and not self._live(self._by_due[0]):
+            heapq.heappop(self._by_due)
+            self._stale -= 1
+        if self._stale * 2 > len(self._by_due):
+            self._by_due = [item for item in self._by_due if self._live(item)]
+            heapq.heapify(self._by_due)
+            self._stale = 0
+
+    def _live(self, item: Tuple[float, int, str]) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is not None and entry.due_seq == item[1]
+
+    def claim(self, callback_id: str, token: int) -> Optional[PendingCallback]:
+        """Mark the callback running if token is still its current one, else return None: it was superseded."""
+        with self._lock:
+            entry = self._entries.get(callback_id)
+            if entry is None or entry.token != token:
+                return None
+            if not entry.running:
+                entry.running = True
+                self._running += 1
+            return entry
+
+    def reschedule(self, callback_id: str, due: float, attempt: Optional[int] = None) -> Optional[int]:
+        """Give the callback a new due time (and attempt), return the token its new scheduler entry must carry."""
+        with self._lock:
+            entry = self._entries.get(callback_id)
+            if entry is None:
+                return None
+            self._drop_due(entry)
+            entry.due = due
+            self._push_due(entry)
+            if attempt is not None:
+                entry.attempt = attempt
+            if entry.running:
+                entry.running = False
+                self._running -= 1
+            entry.token += 1
+            return entry.token
+
+    def set_scheduled(self, callback_id: str, token: int, handle: Any) -> Any:
+        """
+        Record handle as the scheduler entry of the callback's attempt under token. Returns the handle it
+        supersedes, or handle itself if token isn't current anymore: either one is dead and can be cancelled.
+        """
+        with self._lock:
+            entry = self._entries.get(callback_id)
+            if entry is None or entry.token != token:
+                return handle
+            previous, entry.scheduled = entry.scheduled, handle
+            return previous
+
+    def get(self, callback_id: str) -> Optional[PendingCallback]:
+        return self._entries.get(callback_id)
+
+    def select(self, ids: Optional[Iterable[str]] = None, serial: Any = None, station_id: Any = None,
+               host: Optional[str] = None) -> List[PendingCallback]:
+        """Callbacks matching every given filter, no filter selects everything."""
+        with self._lock:
+            candidates: Optional[Set[str]] = set(ids) if ids is not None else None
+            for field, value in (("serial", serial), ("station_id", station_id), ("host", host)):
+                if value is None:
+                    continue
+                matched = self._indexes[field].get(_hashable(value), set())
+                candidates = matched if candidates is None else candidates & matched
+            if candidates is None:
+                entries = list(self._entries.values())
+            else:
+                entries = [self._entries[i] for i in candidates if i in self._entries]
+        return entries
+
+    def page(self, offset: int, limit: int, **filters: Any) -> Tuple[int, List[PendingCallback]]:
+        """One page of the matching callbacks, earliest due first, and how many match in total."""
+        if not any(value is not None for value in filters.values()):
+            with self._lock:
+                return len(self._entries), list(itertools.islice(self._in_due_order(), offset, offset + limit))
+        entries = self.select(**filters)
+        return len(entries), heapq.nsmallest(offset + limit, entries, key=_due)[offset:]
+
+    def _in_due_order(self) -> Iterator[PendingCallback]:
+        """
+        The callbacks earliest due first, walking the heap from its root through a frontier heap of positions:
+        the first k cost O((k + stale entries among them) log k), not a sort of the whole heap. Must hold self._lock.
+        """
+        heap = self._by_due
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            item, i = heapq.heappop(frontier)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            if self._live(item):
+                yield self._entries[item[2]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def count(self, host: str) -> int:
+        """How many callbacks are pending against host, without copying them."""
+        ids = self._indexes["host"].get(host)
+        return len(ids) if ids is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._entries),
+                "running": self._running,
+                "serials": len(self._indexes["serial"]),
+                "stations": len(self._indexes["station_id"]),
+                "hosts": {str(host): len(ids) for host, ids in self._indexes["host"].items()},
+            }
+
+
+def _due(entry: PendingCallback) -> float:
+    return entry.due
+
+
+def _hashable(value: Any) -> Any:
+    """Index key for a param value, which comes from a JSON body and may be a list or an object."""
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
@@ -0,0 +1,124 @@
+import abc
+import threading
+import time
+import weakref
+from typing import Callable, List, Optional
+
+
+class Clock(abc.ABC):
+    """
+    Source of time for the time-driven parts of the baffle: callback due times, retry budget refill, batch windows,
+    station busy windows, scenario schedules and the timing report interval. Swapping in a VirtualClock lets
+    replays, tests and soak runs cover hours of simulated time in seconds.
+
+    Durations of actual work (request latency, RMS POST latency, timing spans) are always measured in real time.
+    """
+
+    @abc.abstractmethod
+    def time(self) -> float:
+        """Wall time, in seconds since the epoch."""
+
+    @abc.abstractmethod
+    def monotonic(self) -> float:
+        """Seconds from an arbitrary start that never go backwards."""
+
+    @abc.abstractmethod
+    def sleep(self, seconds: float) -> None:
+        """Block until seconds of clock time have passed."""
+
+    @abc.abstractmethod
+    def timeout(self, seconds: Optional[float]) -> Optional[float]:
+        """
+        How long, in real seconds, to block on a condition while waiting for seconds of clock time to pass. None
+        means until notified: the clock calls its subscribers whenever it moves.
+        """
+
+    @abc.abstractmethod
+    def subscribe(self, listener: Callable[[], None]) -> None:
+        """Call listener, held weakly, every time the clock moves other than by real time passing."""
+
+
+class RealClock(Clock):
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def timeout(self, seconds: Optional[float]) -> Optional[float]:
+        return seconds
+
+    def subscribe(self, listener: Callable[[], None]) -> None:
+        pass
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only moves when advance() or advance_to() is called, instantly. Threads sleeping on it, and
+    schedulers waiting for their next due callback, wake up once it has been advanced far enough.
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self._cond = threading.Condition()
+        self._now = time.time() if start is None else start
+        self._elapsed = 0.0
+        self._listeners: List[weakref.ReferenceType] = []
+
+    def time(self) -> float:
+        return self._now
+
+    def monotonic(self) -> float:
+        return self._elapsed
+
+    def sleep(self, seconds: float) -> None:
+        with self._cond:
+            until = self._elapsed + seconds
+            while self._elapsed < until:
+                self._cond.wait()
+
+    def timeout(self, seconds: Optional[float]) -> Optional[float]:
+        return None
+
+    def subscribe(self, listener: Callable[[], None]) -> None:
+        ref = weakref.WeakMethod(listener) if hasattr(listener, "__self__") else weakref.ref(listener)
+        with self._cond:
+            self._listeners = [r for r in self._listeners if r() is not None] + [ref]
+
+    def advance(self, seconds: float) -> None:
+        self._move(seconds)
+
+    def advance_to(self, wall_time: float) -> None:
+        """Move the clock to wall_time, a time in the past leaves it where it is."""
+        self._move(0.0, wall_time)
+
+    def _move(self, seconds: float, to: Optional[float] = None) -> None:
+        with self._cond:
+            if to is not None:
+                seconds = to - self._now
+            if seconds <= 0:
+                return
+            self._now += seconds
+            self._elapsed += seconds
+            self._cond.notify_all()
+            listeners = [r() for r in self._listeners]
+        # outside the clock's lock, listeners take their own
+        for listener in listeners:
+            if listener is not None:
+                listener()
+
+
+__clock: Clock = RealClock()
+
+
+def get_clock() -> Clock:
+    return __clock
+
+
+def set_clock(clock: Clock) -> Clock:
+    """Install clock for the whole process, return the one it replaces."""
+    global __clock
+    previous, __clock = __clock, clock
+    return previous
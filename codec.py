@@ -0,0 +1,99 @@
+import json
+from typing import Any, Callable, Optional
+
+import logger
+
+
+class JsonCodec:
+    """
+    Decodes request bodies and encodes JSON. dumps encodes compact UTF-8 JSON (trace records), dumps_response the
+    bytes Flask's jsonify answered every route with before the service had engines of its own: compact,
+    ASCII-escaped, keys sorted, a trailing newline.
+    """
+
+    def __init__(self, name: str, loads: Callable[[bytes], Any], dumps: Callable[[Any], bytes],
+                 dumps_response: Callable[[Any], bytes]):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.dumps_response = dumps_response
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _stdlib_dumps_response(obj: Any) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("ascii") + b"\n"
+
+
+STDLIB = JsonCodec("stdlib", json.loads, _stdlib_dumps, _stdlib_dumps_response)
+
+
+def _orjson_codec() -> Optional[JsonCodec]:
+    try:
+        import orjson
+    except ImportError:
+        return None
+
+    option = orjson.OPT_NON_STR_KEYS
+    # no OPT_NON_STR_KEYS: orjson sorts such keys as strings, the stdlib by value
+    response_option = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+
+    def dumps(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # values orjson refuses (ints beyond 64 bits, unknown types) still encode like they always did
+            return _stdlib_dumps(obj)
+
+    def dumps_response(obj: Any) -> bytes:
+        """
+        orjson can't escape non-ASCII, a body that has any is encoded by the stdlib again. Floats orjson writes in
+        exponent notation lack the "+" of the stdlib's ("1e16", not "1e+16"), NaN and infinities become null.
+        """
+        try:
+            data = orjson.dumps(obj, option=response_option)
+        except TypeError:
+            return _stdlib_dumps_response(obj)
+        return data if data.isascii() else _stdlib_dumps_response(obj)
+
+    # orjson.JSONDecodeError is a ValueError, callers catch it like the stdlib one
+    return JsonCodec("orjson", orjson.loads, dumps, dumps_response)
+
+
+CODECS = {"stdlib": lambda: STDLIB, "orjson": _orjson_codec}
+
+__codec: JsonCodec = _orjson_codec() or STDLIB
+
+
+def set_codec(name: str) -> JsonCodec:
+    """Select the codec by name, "auto" picks the fastest one installed."""
+    global __codec
+    if name == "auto":
+        codec = _orjson_codec() or STDLIB
+    elif name in CODECS:
+        codec = CODECS[name]()
+        if codec is None:
+            raise ValueError(f"json codec {name} is not installed")
+    else:
+        raise ValueError(f"unknown json codec: {name}, expected auto or one of {', '.join(CODECS)}")
+    logger.info("json codec: %s", codec.name)
+    __codec = codec
+    return codec
+
+
+def get_codec() -> JsonCodec:
+    return __codec
+
+
+def loads(data: bytes) -> Any:
+    return __codec.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    return __codec.dumps(obj)
+
+
+def dumps_response(obj: Any) -> bytes:
+    return __codec.dumps_response(obj)
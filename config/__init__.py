@@ -0,0 +1,32 @@
+from typing import Any
+
+from pydantic import BaseModel
+
+try:
+    from pydantic import ConfigDict
+except ImportError:  # pydantic 1
+    class FrozenModel(BaseModel):
+        """Config section that can't be modified once validated, a reload publishes new instances instead."""
+
+        class Config:
+            frozen = True
+else:
+    class FrozenModel(BaseModel):
+        """Config section that can't be modified once validated, a reload publishes new instances instead."""
+
+        model_config = ConfigDict(frozen=True)
+
+
+def load_yaml(path: str) -> Any:
+    """
+    Parse the YAML file at path, with libyaml when PyYAML was built with it. Raises OSError, or ValueError for a file
+    that isn't valid YAML. yaml is imported on first use: a config served from the snapshot cache never needs it.
+    """
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path, "r") as yaml_file:
+        try:
+            return yaml.load(yaml_file, Loader=loader)
+        except yaml.YAMLError as e:
+            raise ValueError(f"invalid YAML in {path}: {e}") from e
@@ -1,40 +1,95 @@
-from typing import Optional
-
-from pydantic import BaseModel
+from typing import Dict, Optional
 
 import logger
+from config import FrozenModel
 
 
-class RequestConfig(BaseModel):
-    timeout: int = 10
+class RequestConfig(FrozenModel):
+    connect_timeout: float = 3
+    read_timeout: float = 10
+    pool_size: int = 10
+    pool_hosts: int = 16
+    pool_block: bool = True
     delay: int = 3
+    workers: int = 4
+
+
+class RetryConfig(FrozenModel):
+    base_delay: float = 3
+    max_delay: float = 60
+    multiplier: float = 2
+    jitter: float = 0.5
+    max_attempts: int = 10
+    budget: float = 100
+    budget_per_second: float = 5
+    dead_letter_capacity: int = 10000
+
+
+class JournalConfig(FrozenModel):
+    enabled: bool = False
+    path: str = "rms-journal.db"
+    commit_interval: float = 0.05
+    batch_size: int = 512
+    compact_interval: float = 300
 
 
-class RMSApis(BaseModel):
+class BatchConfig(FrozenModel):
+    enabled: bool = False
+    window: float = 0.1
+    max_size: int = 64
+    dedupe: bool = True
+    concurrency: int = 8
+
+
+class AdmissionConfig(FrozenModel):
+    # 0 disables a limit
+    max_pending: int = 100000
+    max_pending_per_host: int = 20000
+    # once a pending limit is hit, requests are shed until the count falls back to this fraction of it
+    low_watermark: float = 0.9
+    max_in_flight: int = 256
+    # route name -> max_in_flight of that route
+    routes: Dict[str, int] = {}
+
+
+class RMSApis(FrozenModel):
     dock_ready: str
     dock_finish: str
 
 
-class RMSConfig(BaseModel):
+class RMSConfig(FrozenModel):
     request: RequestConfig
+    retry: RetryConfig = RetryConfig()
+    journal: JournalConfig = JournalConfig()
+    batch: BatchConfig = BatchConfig()
+    admission: AdmissionConfig = AdmissionConfig()
     host: str
     port: int
     apis: RMSApis
+    # the server.sites entry this config was merged for, None for the top-level rms section
+    site: Optional[str] = None
 
 
 __rms_config: Optional[RMSConfig] = None
+__site_configs: Dict[str, RMSConfig] = {}
 
 
-def set_rms_config(config: RMSConfig):
-    global __rms_config
-    logger.info(f"Setting RMS config: {config.dict()}")
+def set_rms_config(config: RMSConfig, sites: Optional[Dict[str, RMSConfig]] = None):
+    global __rms_config, __site_configs
+    logger.info("Setting RMS config: %s", logger.lazy(config.dict))
+    if sites:
+        logger.info("Setting RMS config of sites: %s", sorted(sites))
     __rms_config = config
+    __site_configs = dict(sites or {})
 
 
-def get_rms_config() -> RMSConfig:
+def get_rms_config(site: Optional[str] = None) -> RMSConfig:
+    """The config of site, the top-level one for no site or a site without a config of its own."""
     global __rms_config
     if __rms_config is None:
         raise ValueError("RMS config not set")
+    if site:
+        return __site_configs.get(site, __rms_config)
     return __rms_config
 
 
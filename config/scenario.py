@@ -0,0 +1,51 @@
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel
+
+
+class DistributionConfig(BaseModel):
+    """
+    Seconds drawn from a distribution. constant uses value, uniform low and high, normal mean and stddev (clipped
+    at 0), lognormal mean and stddev of the underlying normal, exponential mean.
+    """
+    kind: Literal["constant", "uniform", "normal", "lognormal", "exponential"] = "constant"
+    value: float = 0
+    low: float = 0
+    high: float = 0
+    mean: float = 0
+    stddev: float = 0
+
+
+class RouteRuleConfig(BaseModel):
+    latency: Optional[DistributionConfig] = None
+    error_rate: float = 0
+    error_status: int = 200
+    error_msg: str = "服务内部错误"
+
+
+class BusyWindowConfig(BaseModel):
+    """The station is busy for `duration` seconds every `every` seconds, starting `offset` seconds after activation."""
+    every: float
+    duration: float
+    offset: float = 0
+
+
+class StationRuleConfig(RouteRuleConfig):
+    busy: List[BusyWindowConfig] = []
+    full_rate: Optional[float] = None
+    callback_delay: Optional[DistributionConfig] = None
+
+
+class ScenarioConfig(BaseModel):
+    seed: int = 0
+    samples: int = 4096
+    default: RouteRuleConfig = RouteRuleConfig()
+    # keyed by route name, the handler name also used as the route label in /metrics
+    routes: Dict[str, RouteRuleConfig] = {}
+    stations: Dict[str, StationRuleConfig] = {}
+    callback_delay: Optional[DistributionConfig] = None
+
+
+class ScenariosConfig(BaseModel):
+    active: Optional[str] = None
+    scenarios: Dict[str, ScenarioConfig] = {}
@@ -1,19 +1,90 @@
-from typing import Optional
-
-from pydantic import BaseModel
+from typing import Any, Dict, List, Literal, Optional
 
 import logger
+from config import FrozenModel
+
+
+class AsyncLoggingConfig(FrozenModel):
+    enabled: bool = False
+    queue_size: int = 10000
+    batch_size: int = 256
+    flush_interval: float = 0.5
+    overflow: Literal["block", "drop-debug", "drop-oldest"] = "block"
+
+
+class TimingConfig(FrozenModel):
+    enabled: bool = True
+    report_interval: float = 60
+    max_samples: int = 10000
 
 
-class LoggerConfig(BaseModel):
+class RotationConfig(FrozenModel):
+    when: str = "midnight"
+    # 0 rotates on time only
+    max_bytes: int = 256 * 1024 * 1024
+    backups: int = 60
+    compress: bool = True
+
+
+class LoggerConfig(FrozenModel):
     name: str
     level: str = "INFO"
     log_dir: str = "rms-log"
+    async_logging: AsyncLoggingConfig = AsyncLoggingConfig()
+    timing: TimingConfig = TimingConfig()
+    rotation: RotationConfig = RotationConfig()
+
+
+class StationsConfig(FrozenModel):
+    capacity: int = 4096
+    stripes: int = 16
+    default_busy_seconds: float = 20
+    busy_seconds: Dict[str, float] = {}
+
+
+class ConfigReloadConfig(FrozenModel):
+    watch: bool = True
+    interval: float = 2
+
+
+class TraceConfig(FrozenModel):
+    enabled: bool = False
+    path: str = "wcs-trace.jsonl"
+    queue_size: int = 100000
+    batch_size: int = 512
+    flush_interval: float = 0.5
+
+
+class InventoryConfig(FrozenModel):
+    # None keeps the inventory in memory only
+    snapshot_path: Optional[str] = None
+    restore_on_start: bool = True
+    snapshot_on_exit: bool = True
+
+
+class SiteConfig(FrozenModel):
+    """One simulated warehouse served next to the others in the same process."""
+
+    name: str
+    port: int
+    stations: StationsConfig = StationsConfig()
+    # merged over the top-level rms section, e.g. {"port": 8102, "request": {"delay": 5}}
+    rms: Dict[str, Any] = {}
 
 
-class ServerConfig(BaseModel):
+class ServerConfig(FrozenModel):
     port: Optional[int] = 10001
+    engine: Literal["gevent", "asyncio"] = "gevent"
+    workers: int = 1
+    json_codec: Literal["auto", "orjson", "stdlib"] = "auto"
+    scenario_file: Optional[str] = "config/scenario.yaml"
+    config_reload: ConfigReloadConfig = ConfigReloadConfig()
+    trace: TraceConfig = TraceConfig()
     logger: LoggerConfig
+    stations: StationsConfig = StationsConfig()
+    inventory: InventoryConfig = InventoryConfig()
+    # when set, these are served instead of port and stations
+    sites: List[SiteConfig] = []
 
 
 __server_config: Optional[ServerConfig] = None
@@ -21,7 +92,7 @@ __server_config: Optional[ServerConfig] = None
 
 def set_server_config(config: ServerConfig):
     global __server_config
-    logger.info(f"Setting server config: {config.dict()}")
+    logger.info("Setting server config: %s", logger.lazy(config.dict))
     __server_config = config
 
 
@@ -1,205 +1,596 @@
-from datetime import datetime
-from threading import Lock
+import socket
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Type, Union
 
-from flask import Flask, request
-from gevent import pywsgi
+from pydantic import BaseModel
 
+import admission
+import clock
+import codec
+import hot_reload
+import inventory
 import logger
+import metrics
+import payloads
+import prefork
+import recorder
 import rms
-from config.rms import get_rms_config, RMSConfig
-
-_wcs = Flask(__name__)
-
-
-def serve(port: int):
-    _wcs_server = pywsgi.WSGIServer(("0.0.0.0", port), _wcs)
-    logger.info(f"wcs-baffle serve on port: {port}")
-    _wcs_server.serve_forever(stop_timeout=0)
-
-
-@_wcs.route("/api/wcs/station/full", methods=["GET"])
-def station_full():
-    req_data = request.json
-    logger.info(f"station is_full request: {req_data}.")
-    station_id = req_data.get("station_id")
-    if not station_id:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    return {"code": 0, "is_full": True}
-
-
-@_wcs.route("/api/wcs/station/prepare", methods=["POST"])
-def station_prepare():
-    req_data = request.json
-    logger.info(f"station prepare request: {req_data}.")
-    serial = req_data.get("serial")
-    robot_type = req_data.get("robot_type")
-    station_id = req_data.get("station_id")
-    if serial is None:
-        return {"code": 1, "msg": "参数错误: serial不能为空"}
-    if robot_type is None:
-        return {"code": 1, "msg": "参数错误: robot_type不能为空"}
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    __submit_dock_prepare_callback(serial, station_id, robot_type)
-    return {"code": 0, "msg": "站点准备中"}
-
-
-@_wcs.route("/api/wcs/inbound/order_materials/inboundstart", methods=["POST"])
-def inbound_start():
-    data = request.json
-    logger.info(f"The inbound start request: {data}.")
-    station_id = data.get("station_id")
-    serial = data.get("serial")
-    robot_type = data.get("robot_type")
-    if serial is None:
-        return {"code": 1, "msg": "参数错误: serial不能为空"}
-    if robot_type is None:
-        return {"code": 1, "msg": "参数错误: robot_type不能为空"}
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    __submit_dock_finish_callback(request.remote_addr, serial, station_id)
-    return {"code": 0, "msg": "机器人对接开始"}
-
-
-@_wcs.route("/api/wcs/inbound/order_materials/checkM1100", methods=["POST"])
-def inbound_robot_left():
-    data = request.json
-    logger.info(f"The inbound robot left request: {data}.")
-    station_id = data.get("station_id")
-    robot_type = data.get("robot_type")
-    if robot_type is None:
-        return {"code": 1, "msg": "参数错误: robot_type不能为空"}
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    return {"code": 0, "msg": "机器人离开接驳站处理成功"}
-
-
-@_wcs.route("/api/wcs/putup", methods=["POST"])
-def material_inbound_finished():
-    materials_data = request.json
-    logger.info(f"The material inbound finished request: {materials_data}.")
-    order_id = materials_data.get("order_id")
-    boxnumber = materials_data.get("boxnumber")
-    location = materials_data.get("location")
-    if order_id and boxnumber and location:
-        logger.info(f"The order_id: {order_id}, boxnumber: {boxnumber}, location: {location}")
-    return {"code": 0, "msg": "料箱入库完成!"}
-
-
-__lock = Lock()
-__is_outbound_ready = True
-__latest_outbound_time = datetime.now()
+import scenario
+import sites
+from config.rms import RMSConfig
+from config.server import SiteConfig, StationsConfig, get_server_config
+from schema import compile_schema
+from sites import Site
+from station_state import StationState
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+class WcsRequest:
+    """
+    Engine independent view of an incoming request, handed to every route handler.
+    """
+
+    __slots__ = ("json", "remote_addr", "data", "site")
+
+    def __init__(self, json_data: Dict[str, Any], remote_addr: Optional[str], data: Any = None,
+                 site: Optional[Site] = None):
+        self.json = json_data
+        self.remote_addr = remote_addr
+        # the body validated against the route's schema, a struct with one attribute per schema field
+        self.data = data
+        # the site whose port the request came in on: its stations and RMS config
+        self.site = site if site is not None else sites.get_default()
+
+
+class RawResponse(NamedTuple):
+    """A handler result sent as is instead of being encoded as JSON."""
+
+    body: bytes
+    content_type: str
+
+
+class StaticResponse(NamedTuple):
+    """A constant handler result, encoded once at import and sent as the same bytes on every request."""
+
+    body: bytes
+    result: Dict[str, Any]
+
+
+class Reply(NamedTuple):
+    status: int
+    body: bytes
+    content_type: str
+    # injected by the active scenario, the engine waits this long before sending the reply
+    delay: float = 0.0
+
+
+Handler = Callable[[WcsRequest], Union[Dict[str, Any], RawResponse, StaticResponse]]
+
+# path -> method -> handler, shared by every serving engine
+_routes: Dict[str, Dict[str, Handler]] = {}
+
+
+def route(path: str, methods: List[str], schema: Optional[Type[BaseModel]] = None,
+          admitted: bool = False) -> Callable[[Handler], Handler]:
+    """
+    Register handler for path. With a schema, the body is validated before the handler runs and handed to it as
+    req.data; a body failing validation is answered with the schema's error without calling the handler. An
+    admitted route submits an RMS callback and is answered busy while rms.admission limits are hit.
+    """
+
+    def decorator(handler: Handler) -> Handler:
+        # compiled once here, at import; functools.wraps carries it over to wrappers of the handler
+        handler.schema = compile_schema(schema, static) if schema is not None else None
+        handler.path = path
+        handler.admitted = admitted
+        # scenarios inject faults into and the trace records the WCS routes, never the admin ones used to control them
+        handler.wcs_route = not (path == "/metrics" or path.startswith("/api/admin/"))
+        for method in methods:
+            _routes.setdefault(path, {})[method] = handler
+        return handler
+
+    return decorator
+
+
+def get_routes() -> Dict[str, Dict[str, Handler]]:
+    return _routes
+
+
+def encode(result: Dict[str, Any]) -> bytes:
+    return codec.dumps_response(result)
+
+
+def static(result: Dict[str, Any]) -> StaticResponse:
+    return StaticResponse(encode(result), result)
+
+
+NOT_FOUND = encode({"code": 1, "msg": "接口不存在"})
+METHOD_NOT_ALLOWED = encode({"code": 1, "msg": "请求方法不支持"})
+INVALID_JSON = encode({"code": 1, "msg": "参数错误: 请求体不是合法的JSON"})
+NOT_AN_OBJECT = encode({"code": 1, "msg": "参数错误: 请求体必须为JSON对象"})
+INTERNAL_ERROR = encode({"code": 1, "msg": "服务内部错误"})
+
+STATION_FULL = static({"code": 0, "is_full": True})
+STATION_NOT_FULL = static({"code": 0, "is_full": False})
+PREPARING = static({"code": 0, "msg": "站点准备中"})
+INBOUND_STARTED = static({"code": 0, "msg": "机器人对接开始"})
+ROBOT_LEFT = static({"code": 0, "msg": "机器人离开接驳站处理成功"})
+PUTUP_FINISHED = static({"code": 0, "msg": "料箱入库完成!"})
+OUTBOUND_READY = static({"code": 0, "msg": "可执行出库"})
+OUTBOUND_BUSY = static({"code": 1, "msg": "出库接驳站忙碌，请稍后再试"})
+OUTBOUND_STARTED = static({"code": 0, "msg": "出库执行中"})
+INBOUND_MODE = static({"code": 0, "msg": "切换接驳站为入库模式成功"})
+OUTBOUND_MODE = static({"code": 0, "msg": "切换接驳站为出库模式成功"})
+STACK_NUM_SET = static({"code": 0, "msg": "设置接驳站码垛箱数成功"})
+RMS_OK = static({"code": 0, "msg": ""})
+SCENARIO_NAME_REQUIRED = static({"code": 1, "msg": "参数错误: name不能为空"})
+CALLBACK_SELECTOR_REQUIRED = static({"code": 1, "msg": "参数错误: 至少指定ids、serial、station_id或host之一"})
+CALLBACK_SECONDS_INVALID = static({"code": 1, "msg": "参数错误: seconds必须为数字"})
+PAGE_INVALID = static({"code": 1, "msg": "参数错误: offset和limit必须为非负整数"})
+TOTE_NOT_FOUND = static({"code": 1, "msg": "料箱不存在"})
+BOXNUMBER_INVALID = static({"code": 1, "msg": "参数错误: boxnumber必须为字符串或整数"})
+LOCATION_EMPTY = static({"code": 0, "data": None})
+INVENTORY_SNAPSHOT_DISABLED = static({"code": 1, "msg": "库存快照未配置: server.inventory.snapshot_path"})
+# admission limit -> its busy response
+BUSY = {
+    admission.IN_FLIGHT: static({"code": 1, "msg": "系统繁忙: 处理中的请求过多，请稍后再试"}),
+    admission.PENDING: static({"code": 1, "msg": "系统繁忙: 待回调RMS过多，请稍后再试"}),
+    admission.HOST: static({"code": 1, "msg": "系统繁忙: 待回调该RMS过多，请稍后再试"}),
+}
+
+# most entries one paged query returns
+PAGE_LIMIT = 1000
+
+
+def dispatch(handler: Handler, body: bytes, remote_addr: Optional[str], site: Optional[Site] = None) -> Reply:
+    """
+    Decode the JSON body, run the handler for site (the default one if None) and encode its result. Every engine
+    goes through here.
+    """
+    received = clock.get_clock().time()
+    start = time.perf_counter()
+    site = site if site is not None else sites.get_default()
+    token = logger.set_site(site.name)
+    try:
+        reply = _dispatch(handler, body, remote_addr, site)
+    finally:
+        logger.reset_site(token)
+    route_name = handler.__name__
+    metrics.request_duration.observe(time.perf_counter() - start, site.name, route_name)
+    metrics.requests_total.inc(site.name, route_name, str(reply.status))
+    if handler.wcs_route:
+        recorder.record_request(received, route_name, handler.path, remote_addr, body, reply.status, reply.body,
+                                reply.delay)
+    return reply
+
+
+def _dispatch(handler: Handler, body: bytes, remote_addr: Optional[str], site: Site) -> Reply:
+    with logger.timing(f"route {handler.__name__}"):
+        with logger.timing("parse"):
+            try:
+                data = codec.loads(body) if body else {}
+            except ValueError:
+                return Reply(400, INVALID_JSON, JSON_CONTENT_TYPE)
+        if not isinstance(data, dict):
+            return Reply(400, NOT_AN_OBJECT, JSON_CONTENT_TYPE)
+        struct = None
+        schema = handler.schema
+        if schema is not None:
+            with logger.timing("validate"):
+                struct, error = schema.validate(data)
+            if error is not None:
+                logger.info("%s request rejected: %s, %s", handler.__name__, data, error.result["msg"])
+                metrics.request_errors_total.inc(site.name, handler.__name__)
+                return Reply(200, error.body, JSON_CONTENT_TYPE)
+        if not handler.admitted:
+            return _handle(handler, data, struct, remote_addr, site)
+        rms_config = site.rms
+        # the host the callback goes to, as get_url builds it
+        shed = admission.get_admission().enter(handler.__name__, f"{remote_addr}:{rms_config.port}",
+                                               rms_config.admission)
+        if shed is not None:
+            metrics.admission_shed_total.inc(site.name, handler.__name__, shed)
+            metrics.request_errors_total.inc(site.name, handler.__name__)
+            return Reply(200, BUSY[shed].body, JSON_CONTENT_TYPE)
+        try:
+            return _handle(handler, data, struct, remote_addr, site)
+        finally:
+            admission.get_admission().leave(handler.__name__)
+
+
+def _handle(handler: Handler, data: Dict[str, Any], struct: Any, remote_addr: Optional[str], site: Site) -> Reply:
+    delay = 0.0
+    active = scenario.get_active()
+    if active is not None and handler.wcs_route:
+        delay, injected = active.apply(handler.__name__, data.get("station_id"))
+        if injected is not None:
+            metrics.request_errors_total.inc(site.name, handler.__name__)
+            return Reply(injected[0], injected[1], JSON_CONTENT_TYPE, delay)
+    try:
+        with logger.timing("handle"):
+            result = handler(WcsRequest(data, remote_addr, struct, site))
+    except Exception:
+        logger.exception("handle request error, handler: %s, data: %s", handler.__name__, data)
+        return Reply(500, INTERNAL_ERROR, JSON_CONTENT_TYPE, delay)
+    if isinstance(result, StaticResponse):
+        if result.result["code"] == 1:
+            metrics.request_errors_total.inc(site.name, handler.__name__)
+        return Reply(200, result.body, JSON_CONTENT_TYPE, delay)
+    if isinstance(result, RawResponse):
+        return Reply(200, result.body, result.content_type, delay)
+    if result.get("code") == 1:
+        metrics.request_errors_total.inc(site.name, handler.__name__)
+    with logger.timing("encode"):
+        return Reply(200, encode(result), JSON_CONTENT_TYPE, delay)
+
+
+def serve(port: Optional[int], engine: str = "gevent", workers: int = 1, stations: Optional[StationsConfig] = None,
+          site_confs: Sequence[SiteConfig] = ()):
+    """Serve port, or with site_confs every site on its own port, all of them from one event loop."""
+    if site_confs and workers > 1:
+        raise ValueError("server.sites are served by one process, set workers to 1")
+    # the station table has to be in shared memory before forking so that every worker sees the same docks
+    served = sites.configure(port, stations, site_confs, shared=workers > 1)
+    if workers > 1:
+        logger.info("wcs-baffle pre-forking %s workers on port: %s, engine: %s", workers, port, engine)
+        prefork.serve(port, workers, lambda sock: _serve_engine(engine, served, sock))
+        return
+    _serve_engine(engine, served)
+
+
+def _serve_engine(engine: str, served: List[Site], sock: Optional[socket.socket] = None):
+    # the engines are imported here, a process only loads the one it serves with
+    if engine == "asyncio":
+        import asgi
+
+        asgi.serve(served, sock)
+        return
+    import wsgi
+
+    wsgi.serve(served, sock)
+
+
+@route("/api/wcs/station/full", methods=["GET"], schema=payloads.StationFull)
+def station_full(req: WcsRequest):
+    logger.info("station is_full request: %s.", req.json)
+    active = scenario.get_active()
+    if active is not None and not active.station_full(req.data.station_id):
+        return STATION_NOT_FULL
+    return STATION_FULL
+
+
+@route("/api/wcs/station/prepare", methods=["POST"], schema=payloads.StationPrepare, admitted=True)
+def station_prepare(req: WcsRequest):
+    logger.info("station prepare request: %s.", req.json)
+    data: payloads.StationPrepare = req.data
+    req.site.stations.transition(data.station_id, StationState.PREPARING)
+    __submit_dock_prepare_callback(req.site.rms, req.remote_addr, data.serial, data.station_id, data.robot_type)
+    return PREPARING
+
+
+@route("/api/wcs/inbound/order_materials/inboundstart", methods=["POST"], schema=payloads.InboundStart, admitted=True)
+def inbound_start(req: WcsRequest):
+    logger.info("The inbound start request: %s.", req.json)
+    data: payloads.InboundStart = req.data
+    req.site.stations.transition(data.station_id, StationState.DOCKING)
+    __submit_dock_finish_callback(req.site.rms, req.remote_addr, data.serial, data.station_id)
+    return INBOUND_STARTED
+
+
+@route("/api/wcs/inbound/order_materials/checkM1100", methods=["POST"], schema=payloads.RobotLeft)
+def inbound_robot_left(req: WcsRequest):
+    logger.info("The inbound robot left request: %s.", req.json)
+    data: payloads.RobotLeft = req.data
+    req.site.stations.transition(data.station_id, StationState.ROBOT_LEFT)
+    return ROBOT_LEFT
+
+
+@route("/api/wcs/putup", methods=["POST"], schema=payloads.Putup)
+def material_inbound_finished(req: WcsRequest):
+    logger.info("The material inbound finished request: %s.", req.json)
+    data: payloads.Putup = req.data
+    if data.order_id and data.boxnumber and data.location:
+        if not inventory.valid_boxnumber(data.boxnumber):
+            return BOXNUMBER_INVALID
+        logger.info("The order_id: %s, boxnumber: %s, location: %s", data.order_id, data.boxnumber, data.location)
+        inventory.get_inventory().put_up(data.boxnumber, data.order_id, data.location)
+    return PUTUP_FINISHED
 
 
 # WCS-PLC出库
-@_wcs.route("/api/wcs/outbound/order_materials/outboundready", methods=["POST"])
-def outbound_workstation():
-    data = request.json
-    logger.info(f"The outbound workstation ready request: {data}.")
-    station_id = data.get("station_id")
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    with __lock:
-        global __is_outbound_ready
-        if not __is_outbound_ready:
-            global __latest_outbound_time
-            if (datetime.now() - __latest_outbound_time).total_seconds() < 20:
-                return {"code": 1, "msg": "出库接驳站忙碌，请稍后再试"}
-            __is_outbound_ready = True
-        return {"code": 0, "msg": "可执行出库"}
-
-
-@_wcs.route("/api/wcs/outbound/order_materials/outboundstart", methods=["POST"])
-def outbound_start():
-    data = request.json
-    order_id = data.get("order_id")
-    tote_ids = data.get("tote_ids", [])
-    station_id = data.get("station_id")
-    serial = data.get("serial")
-    robot_type = data.get("robot_type")
+@route("/api/wcs/outbound/order_materials/outboundready", methods=["POST"], schema=payloads.Station)
+def outbound_workstation(req: WcsRequest):
+    logger.info("The outbound workstation ready request: %s.", req.json)
+    data: payloads.Station = req.data
+    active = scenario.get_active()
+    if active is not None and active.station_busy(data.station_id):
+        return OUTBOUND_BUSY
+    if not req.site.stations.check_outbound_ready(data.station_id):
+        return OUTBOUND_BUSY
+    return OUTBOUND_READY
+
+
+@route("/api/wcs/outbound/order_materials/outboundstart", methods=["POST"], schema=payloads.OutboundStart,
+       admitted=True)
+def outbound_start(req: WcsRequest):
+    data: payloads.OutboundStart = req.data
     logger.info(
-        f"outbound_start, order_id: {order_id}, tote_ids: {tote_ids}, station_id: {station_id}, "
-        f"serial: {serial}, robot_type: {robot_type}"
+        "outbound_start, order_id: %s, tote_ids: %s, station_id: %s, serial: %s, robot_type: %s",
+        data.order_id, data.tote_ids, data.station_id, data.serial, data.robot_type,
     )
-    with __lock:
-        global __is_outbound_ready
-        global __latest_outbound_time
-        __is_outbound_ready = False
-        __latest_outbound_time = datetime.now()
-    __submit_dock_finish_callback(request.remote_addr, serial, station_id)
-    return {"code": 0, "msg": "出库执行中"}
-
-
-@_wcs.route("/api/wcs/outbound/order_materials/checkM1108", methods=["POST"])
-def outbound_robot_left():
-    data = request.json
-    logger.info(f"The outbound robot left request: {data}.")
-    station_id = data.get("station_id")
-    robot_type = data.get("robot_type")
-    if robot_type is None:
-        return {"code": 1, "msg": "参数错误: robot_type不能为空"}
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    logger.info(f"机器人离开接驳站处理成功，station_id: {station_id}")
-    return {"code": 0, "msg": "机器人离开接驳站处理成功"}
-
-
-@_wcs.route("/api/wcs/mode/inbound", methods=["POST"])
-def switch_to_inbound():
-    data = request.json
-    logger.info(f"switch to inbound mode request: {data}.")
-    station_id = data.get("station_id")
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    logger.info(f"切换接驳站为入库模式成功，station_id: {station_id}")
-    return {"code": 0, "msg": "切换接驳站为入库模式成功"}
-
-
-@_wcs.route("/api/wcs/mode/outbound", methods=["POST"])
-def switch_to_outbound():
-    data = request.json
-    logger.info(f"switch to outbound mode request: {data}.")
-    station_id = data.get("station_id")
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    logger.info(f"切换接驳站为出库模式成功，station_id: {station_id}")
-    return {"code": 0, "msg": "切换接驳站为出库模式成功"}
-
-
-@_wcs.route("/api/wcs/inbound/stack/num", methods=["POST"])
-def set_working_area_stack_num():
-    data = request.json
-    logger.info(f"set inbound working area stack num request: {data}.")
-    station_id = data.get("station_id")
-    if station_id is None:
-        return {"code": 1, "msg": "参数错误: station_id不能为空"}
-    return {"code": 0, "msg": "设置接驳站码垛箱数成功"}
-
-
-@_wcs.route("/api/rms/demo", methods=["POST"])
-def api_rms_demo():
-    data = request.json
-    logger.info(f"mock rms api received data: {data}.")
-    return {"code": 0, "msg": ""}
-
-
-def __submit_dock_prepare_callback(serial: str, station: str, robot_type: str):
+    if data.station_id is not None:
+        req.site.stations.transition(data.station_id, StationState.BUSY)
+    if isinstance(data.tote_ids, list) and data.tote_ids:
+        inventory.get_inventory().send_out(data.tote_ids, data.station_id)
+    __submit_dock_finish_callback(req.site.rms, req.remote_addr, data.serial, data.station_id)
+    return OUTBOUND_STARTED
+
+
+@route("/api/wcs/outbound/order_materials/checkM1108", methods=["POST"], schema=payloads.RobotLeft)
+def outbound_robot_left(req: WcsRequest):
+    logger.info("The outbound robot left request: %s.", req.json)
+    data: payloads.RobotLeft = req.data
+    req.site.stations.transition(data.station_id, StationState.ROBOT_LEFT)
+    logger.info("机器人离开接驳站处理成功，station_id: %s", data.station_id)
+    return ROBOT_LEFT
+
+
+@route("/api/wcs/mode/inbound", methods=["POST"], schema=payloads.Station)
+def switch_to_inbound(req: WcsRequest):
+    logger.info("switch to inbound mode request: %s.", req.json)
+    data: payloads.Station = req.data
+    req.site.stations.transition(data.station_id, StationState.IDLE)
+    logger.info("切换接驳站为入库模式成功，station_id: %s", data.station_id)
+    return INBOUND_MODE
+
+
+@route("/api/wcs/mode/outbound", methods=["POST"], schema=payloads.Station)
+def switch_to_outbound(req: WcsRequest):
+    logger.info("switch to outbound mode request: %s.", req.json)
+    data: payloads.Station = req.data
+    req.site.stations.transition(data.station_id, StationState.IDLE)
+    logger.info("切换接驳站为出库模式成功，station_id: %s", data.station_id)
+    return OUTBOUND_MODE
+
+
+@route("/api/wcs/inbound/stack/num", methods=["POST"], schema=payloads.Station)
+def set_working_area_stack_num(req: WcsRequest):
+    logger.info("set inbound working area stack num request: %s.", req.json)
+    return STACK_NUM_SET
+
+
+@route("/api/wcs/inventory/tote", methods=["GET"], schema=payloads.InventoryTote)
+def inventory_tote(req: WcsRequest):
+    tote = inventory.get_inventory().tote(req.data.boxnumber)
+    if tote is None:
+        return TOTE_NOT_FOUND
+    return {"code": 0, "data": tote.to_dict()}
+
+
+@route("/api/wcs/inventory/location", methods=["GET"], schema=payloads.InventoryLocation)
+def inventory_location(req: WcsRequest):
+    tote = inventory.get_inventory().at_location(req.data.location)
+    if tote is None:
+        return LOCATION_EMPTY
+    return {"code": 0, "data": tote.to_dict()}
+
+
+@route("/api/wcs/inventory/order", methods=["GET"], schema=payloads.InventoryOrder)
+def inventory_order(req: WcsRequest):
+    data: payloads.InventoryOrder = req.data
+    if not (_is_int(data.offset) and _is_int(data.limit)) or data.offset < 0 or data.limit < 0:
+        return PAGE_INVALID
+    total, totes = inventory.get_inventory().of_order(data.order_id, data.offset, min(data.limit, PAGE_LIMIT))
+    return {"code": 0, "data": {"total": total, "offset": data.offset, "totes": [tote.to_dict() for tote in totes]}}
+
+
+@route("/metrics", methods=["GET"])
+def prometheus_metrics(req: WcsRequest):
+    return RawResponse(metrics.REGISTRY.render().encode("utf-8"), metrics.CONTENT_TYPE)
+
+
+@route("/api/admin/scheduler", methods=["GET"])
+def scheduler_stats(req: WcsRequest):
+    return {"code": 0, "data": rms.scheduler_stats()}
+
+
+@route("/api/admin/stations", methods=["GET"])
+def stations_state(req: WcsRequest):
+    return {"code": 0, "data": req.site.stations.snapshot()}
+
+
+@route("/api/admin/http_pool", methods=["GET"])
+def http_pool_stats(req: WcsRequest):
+    return {"code": 0, "data": rms.client_stats()}
+
+
+@route("/api/admin/batcher", methods=["GET"])
+def batcher_stats(req: WcsRequest):
+    return {"code": 0, "data": rms.batcher_stats()}
+
+
+@route("/api/admin/logging", methods=["GET"])
+def logging_stats(req: WcsRequest):
+    return {"code": 0, "data": logger.stats()}
+
+
+@route("/api/admin/trace", methods=["GET"])
+def trace_stats(req: WcsRequest):
+    return {"code": 0, "data": recorder.stats()}
+
+
+@route("/api/admin/deadletter", methods=["GET"])
+def dead_letters(req: WcsRequest):
+    return {"code": 0, "data": rms.dead_letter_stats()}
+
+
+@route("/api/admin/deadletter/replay", methods=["POST"], schema=payloads.DeadLetterReplay)
+def replay_dead_letters(req: WcsRequest):
+    data: payloads.DeadLetterReplay = req.data
+    replayed = rms.replay_dead_letters(data.ids)
+    return {"code": 0, "data": {"replayed": len(replayed)}}
+
+
+@route("/api/admin/admission", methods=["GET"])
+def admission_stats(req: WcsRequest):
+    return {"code": 0, "data": {**admission.get_admission().stats(), "limits": req.site.rms.admission.dict()}}
+
+
+@route("/api/admin/callbacks", methods=["GET"])
+def callback_stats(req: WcsRequest):
+    return {"code": 0, "data": rms.get_registry().stats()}
+
+
+@route("/api/admin/callbacks", methods=["POST"], schema=payloads.CallbackQuery)
+def query_callbacks(req: WcsRequest):
+    data: payloads.CallbackQuery = req.data
+    if not (_is_int(data.offset) and _is_int(data.limit)) or data.offset < 0 or data.limit < 0:
+        return PAGE_INVALID
+    page = rms.list_callbacks(data.offset, min(data.limit, PAGE_LIMIT), **_callback_filters(data))
+    return {"code": 0, "data": page}
+
+
+@route("/api/admin/callbacks/cancel", methods=["POST"], schema=payloads.CallbackSelect)
+def cancel_callbacks(req: WcsRequest):
+    filters = _callback_filters(req.data)
+    if not filters:
+        return CALLBACK_SELECTOR_REQUIRED
+    return {"code": 0, "data": {"cancelled": rms.cancel_callbacks(**filters)}}
+
+
+@route("/api/admin/callbacks/fire", methods=["POST"], schema=payloads.CallbackSelect)
+def fire_callbacks(req: WcsRequest):
+    filters = _callback_filters(req.data)
+    if not filters:
+        return CALLBACK_SELECTOR_REQUIRED
+    return {"code": 0, "data": {"fired": rms.fire_callbacks(**filters)}}
+
+
+@route("/api/admin/callbacks/shift", methods=["POST"], schema=payloads.CallbackShift)
+def shift_callbacks(req: WcsRequest):
+    data: payloads.CallbackShift = req.data
+    filters = _callback_filters(data)
+    if not filters:
+        return CALLBACK_SELECTOR_REQUIRED
+    if isinstance(data.seconds, bool) or not isinstance(data.seconds, (int, float)):
+        return CALLBACK_SECONDS_INVALID
+    return {"code": 0, "data": {"shifted": rms.shift_callbacks(data.seconds, **filters)}}
+
+
+def _callback_filters(data: payloads.CallbackSelect) -> Dict[str, Any]:
+    filters = {"ids": data.ids, "serial": data.serial, "station_id": data.station_id, "host": data.host}
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@route("/api/admin/inventory", methods=["GET"])
+def inventory_stats(req: WcsRequest):
+    return {"code": 0, "data": inventory.get_inventory().stats()}
+
+
+@route("/api/admin/inventory/snapshot", methods=["POST"])
+def snapshot_inventory(req: WcsRequest):
+    path = get_server_config().inventory.snapshot_path
+    if path is None:
+        return INVENTORY_SNAPSHOT_DISABLED
+    try:
+        return {"code": 0, "data": inventory.get_inventory().snapshot(path)}
+    except (OSError, ValueError) as e:
+        return {"code": 1, "msg": f"库存快照失败: {e}"}
+
+
+@route("/api/admin/inventory/restore", methods=["POST"])
+def restore_inventory(req: WcsRequest):
+    path = get_server_config().inventory.snapshot_path
+    if path is None:
+        return INVENTORY_SNAPSHOT_DISABLED
+    try:
+        return {"code": 0, "data": inventory.get_inventory().restore(path)}
+    except (OSError, ValueError) as e:
+        return {"code": 1, "msg": f"库存恢复失败: {e}"}
+
+
+@route("/api/admin/scenario", methods=["GET"])
+def scenario_stats(req: WcsRequest):
+    return {"code": 0, "data": scenario.stats()}
+
+
+@route("/api/admin/scenario", methods=["POST"], schema=payloads.ScenarioSwitch)
+def switch_scenario(req: WcsRequest):
+    data: payloads.ScenarioSwitch = req.data
+    try:
+        if data.reload:
+            scenario.reload()
+        elif data.scenario is not None:
+            if not data.name:
+                return SCENARIO_NAME_REQUIRED
+            scenario.install(str(data.name), data.scenario)
+        else:
+            scenario.activate(data.name)
+    except KeyError:
+        return {"code": 1, "msg": f"参数错误: 场景不存在: {data.name}"}
+    except (ValueError, OSError) as e:
+        return {"code": 1, "msg": f"参数错误: 场景配置错误: {e}"}
+    logger.info("scenario switched, active: %s", scenario.stats()["active"])
+    return {"code": 0, "data": scenario.stats()}
+
+
+@route("/api/admin/config", methods=["GET"])
+def config_stats(req: WcsRequest):
+    snapshot = hot_reload.get_snapshot()
+    data = hot_reload.stats()
+    if snapshot is not None:
+        data["server"] = snapshot.server.dict()
+        data["rms"] = snapshot.rms.dict()
+    return {"code": 0, "data": data}
+
+
+@route("/api/admin/config/reload", methods=["POST"])
+def reload_config(req: WcsRequest):
+    try:
+        changed, snapshot = hot_reload.reload()
+    except (OSError, ValueError) as e:
+        return {"code": 1, "msg": f"配置重载失败: {e}"}
+    return {"code": 0, "data": {"changed": changed, "version": snapshot.version}}
+
+
+@route("/api/rms/demo", methods=["POST"])
+def api_rms_demo(req: WcsRequest):
+    data = req.json
+    logger.info("mock rms api received data: %s.", data)
+    return RMS_OK
+
+
+def __submit_dock_prepare_callback(rms_config: RMSConfig, ip: str, serial: str, station: str, robot_type: str):
     params = {
         "serial": serial,
         "station_id": station,
         "robot_type": robot_type,
     }
-    rms_config = get_rms_config()
-    rms.submit_delay_callback(rms_config.request.delay, get_url(rms_config, rms_config.apis.dock_ready), params)
+    with logger.timing("schedule_callback"):
+        url = get_url(ip, rms_config, rms_config.apis.dock_ready)
+        rms.submit_delay_callback(_callback_delay(station, rms_config), url, params, rms_config)
 
 
-def __submit_dock_finish_callback(ip: str, serial: str, station: str):
+def __submit_dock_finish_callback(rms_config: RMSConfig, ip: str, serial: str, station: str):
     params = {
         "serial": serial,
         "station_id": station,
     }
-    rms_config = get_rms_config()
-    rms.submit_delay_callback(rms_config.request.delay, get_url(ip, rms_config, rms_config.apis.dock_finish), params)
+    with logger.timing("schedule_callback"):
+        url = get_url(ip, rms_config, rms_config.apis.dock_finish)
+        rms.submit_delay_callback(_callback_delay(station, rms_config), url, params, rms_config)
+
+
+def _callback_delay(station: str, rms_config: RMSConfig) -> float:
+    active = scenario.get_active()
+    if active is not None:
+        return active.callback_delay(station, rms_config.request.delay)
+    return rms_config.request.delay
 
 
 def get_url(ip, rms_config: RMSConfig, url: str) -> str:
@@ -0,0 +1,257 @@
+import itertools
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import codec
+import logger
+import recorder
+import rms
+import scenario
+from config import FrozenModel, load_yaml
+from config.rms import RMSConfig, set_rms_config
+from config.server import ServerConfig, set_server_config
+
+
+class ConfigSnapshot(NamedTuple):
+    """One validated version of service.yaml. Published as a whole, readers never see a half-applied reload."""
+
+    version: int
+    path: str
+    mtime: float
+    loaded_at: float
+    server: ServerConfig
+    rms: RMSConfig
+    # server.sites name -> the rms section with that site's overrides merged in
+    sites: Dict[str, RMSConfig]
+    # where the validated configs are cached between runs, and whether these were read from there
+    cache_path: Optional[str] = None
+    cached: bool = False
+
+
+__versions = itertools.count(1)
+__snapshot: Optional[ConfigSnapshot] = None
+__publish_lock = threading.Lock()
+__reloads = 0
+__failures = 0
+__last_error: Optional[str] = None
+__watcher: Optional["ConfigWatcher"] = None
+
+# server settings only read at startup
+_RESTART_FIELDS = ("port", "engine", "workers", "stations", "inventory", "config_reload")
+# site settings only read at startup, the rms overrides of a site apply on reload
+_SITE_RESTART_FIELDS = ("name", "port", "stations")
+
+
+def load_snapshot(path: str, cache_path: Optional[str] = None) -> ConfigSnapshot:
+    """
+    Read and validate path. Raises OSError or ValueError (bad YAML, or pydantic) when it is unusable.
+
+    With cache_path, the validated configs are pickled there keyed on the file's mtime and size, and read back
+    instead of parsing and validating the file again for as long as it is unchanged.
+    """
+    st = os.stat(path)
+    key = _cache_key(path, st) if cache_path else None
+    if cache_path:
+        cached = _read_cache(cache_path, key)
+        if cached is not None:
+            logger.info("Loaded config from cache: %s", cache_path)
+            return ConfigSnapshot(next(__versions), path, st.st_mtime, time.time(), *cached, cache_path, True)
+    conf_data = load_yaml(path) or {}
+    logger.info("Loaded config: %s", conf_data)
+    server = ServerConfig(**conf_data.get("server", {}))
+    rms_data = conf_data.get("rms", {})
+    rms_conf = RMSConfig(**rms_data)
+    sites = {site.name: RMSConfig(**{**_merged(rms_data, site.rms), "site": site.name}) for site in server.sites}
+    if len(sites) != len(server.sites):
+        raise ValueError("server.sites names must be unique")
+    if cache_path:
+        _write_cache(cache_path, key, (server, rms_conf, sites))
+    return ConfigSnapshot(next(__versions), path, st.st_mtime, time.time(), server, rms_conf, sites, cache_path)
+
+
+def _cache_key(path: str, st: os.stat_result) -> Tuple[Any, ...]:
+    """Changes with the config file, with the modules defining the config models, and with the interpreter."""
+    import pydantic
+
+    models = tuple(os.stat(sys.modules[cls.__module__].__file__).st_mtime_ns
+                   for cls in (FrozenModel, ServerConfig, RMSConfig))
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size, models, pydantic.VERSION, sys.version_info[:2]
+
+
+def _read_cache(cache_path: str, key: Tuple[Any, ...]) -> Optional[Tuple[ServerConfig, RMSConfig,
+                                                                         Dict[str, RMSConfig]]]:
+    try:
+        with open(cache_path, "rb") as cache_file:
+            # the key is pickled first, configs of stale models aren't even unpickled
+            if pickle.load(cache_file) != key:
+                return None
+            return pickle.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # a cache that can't be read is only a slower start, never a failed one
+        logger.warning("config cache %s unreadable, validating the config file instead: %r", cache_path, e)
+        return None
+
+
+def _write_cache(cache_path: str, key: Tuple[Any, ...], configs: Tuple[Any, ...]) -> None:
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as cache_file:
+            pickle.dump(key, cache_file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(configs, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path)
+    except (OSError, pickle.PicklingError) as e:
+        logger.warning("config cache %s not written: %s", cache_path, e)
+
+
+def _merged(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """base with overrides applied on top, nested sections merged key by key instead of replaced."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = _merged(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def get_snapshot() -> Optional[ConfigSnapshot]:
+    return __snapshot
+
+
+def publish(snapshot: ConfigSnapshot) -> None:
+    """Make snapshot the current config and apply what can change at runtime."""
+    global __snapshot
+    with __publish_lock:
+        old = __snapshot
+        set_server_config(snapshot.server)
+        set_rms_config(snapshot.rms, snapshot.sites)
+        __snapshot = snapshot
+        if old is not None:
+            _apply(old, snapshot)
+
+
+def reload(path: Optional[str] = None) -> Tuple[bool, ConfigSnapshot]:
+    """
+    Re-read the config file and publish it if it differs from the current snapshot. Returns whether a new snapshot
+    was published. A file that doesn't validate raises and leaves the current snapshot in place.
+    """
+    global __reloads, __failures, __last_error
+    current = __snapshot
+    path = path or (current.path if current is not None else None)
+    if path is None:
+        raise ValueError("no config file loaded")
+    try:
+        snapshot = load_snapshot(path, current.cache_path if current is not None else None)
+    except (OSError, ValueError) as e:
+        __failures += 1
+        __last_error = str(e)
+        raise
+    if current is not None and (snapshot.server == current.server and snapshot.rms == current.rms
+                                and snapshot.sites == current.sites):
+        return False, current
+    publish(snapshot)
+    __reloads += 1
+    logger.info("config reloaded from %s, version: %s", path, snapshot.version)
+    return True, snapshot
+
+
+def _apply(old: ConfigSnapshot, new: ConfigSnapshot) -> None:
+    rms.apply_config(old.rms, new.rms)
+    old_server, server = old.server, new.server
+    if old_server.logger.level != server.logger.level:
+        logger.set_level(logging.getLevelName(server.logger.level.upper()))
+    if old_server.logger.timing != server.logger.timing:
+        logger.get_global_logger().configure_timing(**server.logger.timing.dict())
+    if old_server.json_codec != server.json_codec:
+        codec.set_codec(server.json_codec)
+    if old_server.scenario_file != server.scenario_file and server.scenario_file:
+        scenario.load(server.scenario_file)
+    if old_server.trace != server.trace:
+        recorder.configure(server.trace)
+    for field in _RESTART_FIELDS:
+        if getattr(old_server, field) != getattr(server, field):
+            logger.warning("server %s config change takes effect after restart", field)
+    if _site_layout(old_server) != _site_layout(server):
+        logger.warning("server sites config change takes effect after restart, except rms overrides")
+    if old_server.logger.dict(exclude={"level", "timing"}) != server.logger.dict(exclude={"level", "timing"}):
+        logger.warning("logger output config change takes effect after restart")
+
+
+def _site_layout(server: ServerConfig) -> List[Tuple[Any, ...]]:
+    return [tuple(getattr(site, f) for f in _SITE_RESTART_FIELDS) for site in server.sites]
+
+
+class ConfigWatcher:
+    """
+    Polls the config file and reloads it when it changes. Compares mtime, size and inode, so both in-place edits
+    and editors that save by renaming a new file over the old one are picked up.
+    """
+
+    def __init__(self, path: str, interval: float = 2):
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._start()
+        # the polling thread doesn't survive a fork, every pre-forked worker watches the file itself
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    def _start(self) -> None:
+        self._stopped = threading.Event()
+        self._signature = self._stat()
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self._path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self._interval):
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                reload(self._path)
+            except Exception:
+                snapshot = get_snapshot()
+                logger.exception("config reload from %s failed, keeping version %s", self._path,
+                                 snapshot.version if snapshot is not None else None)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+def watch(path: str, interval: float = 2) -> ConfigWatcher:
+    global __watcher
+    if __watcher is not None:
+        __watcher.stop()
+    __watcher = ConfigWatcher(path, interval)
+    return __watcher
+
+
+def stats() -> Dict[str, Any]:
+    snapshot = __snapshot
+    return {
+        "version": snapshot.version if snapshot is not None else None,
+        "path": snapshot.path if snapshot is not None else None,
+        "mtime": snapshot.mtime if snapshot is not None else None,
+        "loaded_at": snapshot.loaded_at if snapshot is not None else None,
+        "cache_path": snapshot.cache_path if snapshot is not None else None,
+        "cached": snapshot.cached if snapshot is not None else None,
+        "watching": __watcher is not None,
+        "reloads": __reloads,
+        "failures": __failures,
+        "last_error": __last_error,
+    }
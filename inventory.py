@@ -0,0 +1,333 @@
+import atexit
+import gc
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from enum import IntEnum
+from itertools import accumulate, chain
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import clock
+import logger
+from config.server import InventoryConfig
+
+# snapshot layout, little-endian: header, the length of every string in characters, every string concatenated as
+# UTF-8, then one column per tote field: boxnumber, order_id, location and station_id as string indexes (u32, index
+# 0 is None and isn't stored), state (u8), updated (f64)
+_MAGIC = b"WCSINV01"
+_HEADER = struct.Struct("<8sIII")  # magic, string count, UTF-8 bytes of all strings, tote count
+_TOTE_BYTES = 4 * 4 + 1 + 8
+
+
+class ToteState(IntEnum):
+    STORED = 1
+    OUTBOUND = 2
+    # its location was put up with another tote, where it went is unknown
+    DISPLACED = 3
+
+
+_STATES = {state.value: state for state in ToteState}
+
+
+class Tote:
+    """
+    One tote. Order ids, locations and station ids are interned, so the many totes of one order or one station
+    share one string object instead of each holding a copy.
+    """
+
+    __slots__ = ("boxnumber", "order_id", "location", "station_id", "state", "updated")
+
+    def __init__(self, boxnumber: str, order_id: Optional[str], location: Optional[str], station_id: Optional[str],
+                 state: ToteState, updated: float):
+        self.boxnumber = boxnumber
+        self.order_id = order_id
+        self.location = location
+        self.station_id = station_id
+        self.state = state
+        self.updated = updated
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "boxnumber": self.boxnumber,
+            "order_id": self.order_id,
+            "location": self.location,
+            "station_id": self.station_id,
+            "state": self.state.name.lower(),
+            "updated": self.updated,
+        }
+
+
+class Inventory:
+    """
+    Where every tote is, as told by putup (a tote stored at a location) and outboundstart (totes leaving for a
+    station). Totes are indexed by boxnumber, by order_id, and by the location currently holding them, so every
+    query is a hash lookup whatever the number of totes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totes: Dict[str, Tote] = {}
+        self._by_order: Dict[str, Set[str]] = {}
+        self._by_location: Dict[str, str] = {}
+        self.displaced = 0
+        self.unknown_outbound = 0
+        self._last_snapshot: Optional[Dict[str, Any]] = None
+
+    def put_up(self, boxnumber: Any, order_id: Any, location: Any) -> Tote:
+        """
+        Store the tote at location. A tote already there is displaced: the new one took its place. Raises
+        TypeError unless boxnumber is a string or an integer.
+        """
+        if not valid_boxnumber(boxnumber):
+            raise TypeError(f"boxnumber must be a string or an integer, got: {type(boxnumber).__name__}")
+        box, order, loc = str(boxnumber), _intern(order_id), _intern(location)
+        now = clock.get_clock().time()
+        with self._lock:
+            tote = self._totes.get(box)
+            if tote is None:
+                tote = self._totes[box] = Tote(box, order, loc, None, ToteState.STORED, now)
+            else:
+                self._unindex(tote)
+                tote.order_id, tote.location, tote.station_id = order, loc, None
+                tote.state, tote.updated = ToteState.STORED, now
+            previous = self._by_location.get(loc)
+            if previous is not None and previous != box:
+                displaced = self._totes[previous]
+                displaced.location, displaced.state, displaced.updated = None, ToteState.DISPLACED, now
+                self.displaced += 1
+            self._index(tote)
+            return tote
+
+    def send_out(self, tote_ids: List[Any], station_id: Any) -> int:
+        """Mark the totes as leaving their locations for station_id, return how many were known."""
+        station = _intern(station_id) if station_id is not None else None
+        now = clock.get_clock().time()
+        known = 0
+        with self._lock:
+            for tote_id in tote_ids:
+                tote = self._totes.get(str(tote_id))
+                if tote is None:
+                    self.unknown_outbound += 1
+                    continue
+                if tote.location is not None and self._by_location.get(tote.location) == tote.boxnumber:
+                    del self._by_location[tote.location]
+                tote.location, tote.station_id = None, station
+                tote.state, tote.updated = ToteState.OUTBOUND, now
+                known += 1
+        return known
+
+    def tote(self, boxnumber: Any) -> Optional[Tote]:
+        return self._totes.get(str(boxnumber))
+
+    def at_location(self, location: Any) -> Optional[Tote]:
+        box = self._by_location.get(str(location))
+        return self._totes.get(box) if box is not None else None
+
+    def of_order(self, order_id: Any, offset: int = 0, limit: int = 100) -> Tuple[int, List[Tote]]:
+        """One page of the totes of order_id, by boxnumber, and how many it has in total."""
+        with self._lock:
+            boxes = sorted(self._by_order.get(str(order_id), ()))
+        return len(boxes), [self._totes[box] for box in boxes[offset:offset + limit]]
+
+    def __len__(self) -> int:
+        return len(self._totes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "totes": len(self._totes),
+            "stored": len(self._by_location),
+            "orders": len(self._by_order),
+            "displaced": self.displaced,
+            "unknown_outbound": self.unknown_outbound,
+            "last_snapshot": self._last_snapshot,
+        }
+
+    def _index(self, tote: Tote) -> None:
+        if tote.order_id is not None:
+            self._by_order.setdefault(tote.order_id, set()).add(tote.boxnumber)
+        if tote.location is not None:
+            self._by_location[tote.location] = tote.boxnumber
+
+    def _unindex(self, tote: Tote) -> None:
+        if tote.order_id is not None:
+            boxes = self._by_order.get(tote.order_id)
+            if boxes is not None:
+                boxes.discard(tote.boxnumber)
+                if not boxes:
+                    del self._by_order[tote.order_id]
+        if tote.location is not None and self._by_location.get(tote.location) == tote.boxnumber:
+            del self._by_location[tote.location]
+
+    def snapshot(self, path: str) -> Dict[str, Any]:
+        """
+        Write every tote to path through a memory map, replacing the file atomically. Each distinct string is
+        written once and totes refer to it by index, one column per field, so the file stays about as compact as
+        the store and both directions move whole arrays instead of packing tote by tote.
+        """
+        start = time.perf_counter()
+        with _gc_paused():
+            with self._lock:
+                totes = list(self._totes.values())
+                boxes = [t.boxnumber for t in totes]
+                orders = [t.order_id for t in totes]
+                locations = [t.location for t in totes]
+                stations = [t.station_id for t in totes]
+                states = [t.state for t in totes]
+                updated = [t.updated for t in totes]
+            strings = list(dict.fromkeys(chain((None,), boxes, orders, locations, stations)))
+            index = {string: i for i, string in enumerate(strings)}.__getitem__
+            columns = [_array("I", map(index, column)) for column in (boxes, orders, locations, stations)]
+            columns += [_array("B", states), _array("d", updated)]
+        strings = strings[1:]
+        lengths = _array("I", map(len, strings))
+        # request bodies may carry lone surrogates (JSON "\ud800"), written and read back as they are
+        blob = "".join(strings).encode("utf-8", "surrogatepass")
+        size = _HEADER.size + len(lengths) + len(blob) + sum(map(len, columns))
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb+") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mm:
+                _HEADER.pack_into(mm, 0, _MAGIC, len(strings), len(blob), len(boxes))
+                offset = _HEADER.size
+                for chunk in [lengths, blob] + columns:
+                    mm[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+                mm.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        info = {"path": path, "totes": len(boxes), "strings": len(strings), "bytes": size,
+                "seconds": time.perf_counter() - start, "time": clock.get_clock().time()}
+        self._last_snapshot = info
+        logger.info("inventory snapshot written: %s", info)
+        return info
+
+    def restore(self, path: str) -> Dict[str, Any]:
+        """Replace the store with the snapshot at path. Raises OSError or ValueError if it can't be read."""
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise ValueError(f"inventory snapshot truncated: {path}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, string_count, blob_size, count = _HEADER.unpack_from(mm, 0)
+                if magic != _MAGIC or size != _HEADER.size + 4 * string_count + blob_size + _TOTE_BYTES * count:
+                    raise ValueError(f"not an inventory snapshot, or truncated: {path}")
+                offset = _HEADER.size
+                lengths, offset = _read_array(mm, offset, "I", string_count)
+                text = mm[offset:offset + blob_size].decode("utf-8", "surrogatepass")
+                offset += blob_size
+                columns = []
+                for typecode in "IIIIBd":
+                    column, offset = _read_array(mm, offset, typecode, count)
+                    columns.append(column)
+        with _gc_paused():
+            totes, by_order, by_location = _build(text, lengths, columns)
+        with self._lock:
+            self._totes, self._by_order, self._by_location = totes, by_order, by_location
+        info = {"path": path, "totes": len(totes), "seconds": time.perf_counter() - start}
+        logger.info("inventory restored: %s", info)
+        return info
+
+
+def _build(text: str, lengths: array, columns: List[array]) -> Tuple[Dict[str, Tote], Dict[str, Set[str]],
+                                                                      Dict[str, str]]:
+    """The totes and indexes of a snapshot, from its decoded strings and columns."""
+    bounds = list(accumulate(lengths, initial=0))
+    # not interned: every tote shares the one copy of each string decoded here
+    strings: List[Optional[str]] = [None]
+    strings += [text[a:b] for a, b in zip(bounds, bounds[1:])]
+    string = strings.__getitem__
+    boxes = list(map(string, columns[0]))
+    totes = dict(zip(boxes, map(Tote, boxes, map(string, columns[1]), map(string, columns[2]),
+                                map(string, columns[3]), map(_STATES.__getitem__, columns[4]), columns[5])))
+    by_order: Dict[str, Set[str]] = {}
+    by_location: Dict[str, str] = {}
+    for tote in totes.values():
+        if tote.order_id is not None:
+            by_order.setdefault(tote.order_id, set()).add(tote.boxnumber)
+        if tote.location is not None:
+            by_location[tote.location] = tote.boxnumber
+    return totes, by_order, by_location
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """
+    Hold off the cyclic GC while millions of containers are created: none of them are cyclic garbage, and each
+    collection triggered on the way would walk every tote again.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _array(typecode: str, values: Iterable[Any]) -> bytes:
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_array(mm: mmap.mmap, offset: int, typecode: str, count: int) -> Tuple[array, int]:
+    column = array(typecode)
+    end = offset + column.itemsize * count
+    column.frombytes(mm[offset:end])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column, end
+
+
+def valid_boxnumber(boxnumber: Any) -> bool:
+    return isinstance(boxnumber, (str, int)) and not isinstance(boxnumber, bool)
+
+
+def _intern(value: Any) -> Optional[str]:
+    return sys.intern(str(value)) if value is not None else None
+
+
+__inventory: Optional[Inventory] = None
+__inventory_lock = threading.Lock()
+
+
+def get_inventory() -> Inventory:
+    global __inventory
+    if __inventory is None:
+        with __inventory_lock:
+            if __inventory is None:
+                __inventory = Inventory()
+    return __inventory
+
+
+def load(conf: InventoryConfig, workers: int = 1) -> Inventory:
+    """Restore the inventory from its snapshot if there is one, and snapshot it again at exit if configured."""
+    inventory = get_inventory()
+    path = conf.snapshot_path
+    if path is None:
+        return inventory
+    if conf.restore_on_start and os.path.exists(path):
+        try:
+            inventory.restore(path)
+        except (OSError, ValueError):
+            logger.exception("inventory snapshot unreadable, starting empty: %s", path)
+    if workers > 1:
+        # pre-forked workers each update their own copy, none of them holds the whole inventory
+        logger.warning("inventory is kept per worker with %s workers, not snapshotted at exit", workers)
+    elif conf.snapshot_on_exit:
+        atexit.register(_snapshot_at_exit, inventory, path)
+    return inventory
+
+
+def _snapshot_at_exit(inventory: Inventory, path: str) -> None:
+    try:
+        inventory.snapshot(path)
+    except (OSError, ValueError):
+        logger.exception("inventory snapshot at exit failed: %s", path)
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple
+
+import logger
+from config.rms import JournalConfig
+
+if TYPE_CHECKING:
+    # imported once a journal connects, a process with the journal disabled doesn't load it
+    import sqlite3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS callbacks (
+    id TEXT PRIMARY KEY,
+    due REAL NOT NULL,
+    url TEXT NOT NULL,
+    params TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    site TEXT
+)
+"""
+
+_UPSERT = ("INSERT INTO callbacks (id, due, url, params, attempt, site) VALUES (?, ?, ?, ?, ?, ?) "
+           "ON CONFLICT(id) DO UPDATE SET due = excluded.due, attempt = excluded.attempt")
+_DONE = "UPDATE callbacks SET done = 1 WHERE id = ?"
+
+
+class CallbackJournal:
+    """
+    Append-only record of scheduled RMS callbacks and their completion in an SQLite WAL database, so pending
+    callbacks survive a restart.
+
+    Callers only append to an in-memory queue. A writer thread group-commits everything queued in one transaction
+    every commit_interval, paying one fsync per batch instead of one per request, and periodically compacts
+    completed callbacks away.
+    """
+
+    def __init__(self, conf: JournalConfig):
+        self._conf = conf
+        self._ops: Deque[Tuple[str, Tuple[Any, ...]]] = deque()
+        self._closed = False
+        self._commits = 0
+        self._written = 0
+        self._start()
+        # sqlite connections and the writer thread don't survive a fork, pre-forked workers need their own
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    def _start(self) -> None:
+        self._ops = deque()
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._write_forever, name="callback-journal", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> "sqlite3.Connection":
+        import sqlite3
+
+        conn = sqlite3.connect(self._conf.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL makes every commit durable; commits are batched so that's one fsync per batch
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(_SCHEMA)
+        if "site" not in {row[1] for row in conn.execute("PRAGMA table_info(callbacks)")}:
+            # a journal written before callbacks recorded their site, its callbacks replay with the top-level config
+            try:
+                conn.execute("ALTER TABLE callbacks ADD COLUMN site TEXT")
+            except sqlite3.OperationalError:
+                # added by the writer and a reader connecting at the same time
+                pass
+        return conn
+
+    def record_scheduled(self, callback_id: str, due: float, url: str, params: Dict[str, Any], attempt: int,
+                         site: Optional[str] = None) -> None:
+        """site is the server.sites entry whose rms config the callback runs with, None for the top-level one."""
+        self._append(_UPSERT, (callback_id, due, url, json.dumps(params), attempt, site))
+
+    def record_done(self, callback_id: str) -> None:
+        self._append(_DONE, (callback_id,))
+
+    def _append(self, sql: str, args: Tuple[Any, ...]) -> None:
+        self._ops.append((sql, args))
+        if len(self._ops) >= self._conf.batch_size:
+            with self._cond:
+                self._cond.notify()
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Callbacks scheduled but not completed, as committed on disk."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT id, due, url, params, attempt, site FROM callbacks WHERE done = 0 ORDER BY due")
+            return [
+                {"id": row[0], "due": row[1], "url": row[2], "params": json.loads(row[3]), "attempt": row[4],
+                 "site": row[5]}
+                for row in rows
+            ]
+        finally:
+            conn.close()
+
+    def _write_forever(self) -> None:
+        conn = self._connect()
+        last_compact = time.monotonic()
+        try:
+            while True:
+                with self._cond:
+                    if not self._ops and not self._closed:
+                        self._cond.wait(self._conf.commit_interval)
+                    closed = self._closed
+                self._commit(conn)
+                if closed:
+                    return
+                if time.monotonic() - last_compact >= self._conf.compact_interval:
+                    self._compact(conn)
+                    last_compact = time.monotonic()
+        finally:
+            conn.close()
+
+    def _commit(self, conn: "sqlite3.Connection") -> None:
+        import sqlite3
+
+        if not self._ops:
+            return
+        batch = []
+        while self._ops:
+            batch.append(self._ops.popleft())
+        try:
+            conn.execute("BEGIN")
+            for sql, args in batch:
+                conn.execute(sql, args)
+            conn.execute("COMMIT")
+            self._commits += 1
+            self._written += len(batch)
+        except sqlite3.Error:
+            logger.exception("callback journal commit failed, %s records lost", len(batch))
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def _compact(self, conn: "sqlite3.Connection") -> None:
+        import sqlite3
+
+        try:
+            deleted = conn.execute("DELETE FROM callbacks WHERE done = 1").rowcount
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            logger.debug("callback journal compacted, %s completed callbacks removed", deleted)
+        except sqlite3.Error:
+            logger.exception("callback journal compaction failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": len(self._ops), "commits": self._commits, "written": self._written}
+
+    def close(self) -> None:
+        """Commit everything still queued, then stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+
+
+def open_journal(conf: JournalConfig) -> Optional[CallbackJournal]:
+    if not conf.enabled:
+        return None
+    return CallbackJournal(conf)
@@ -1,6 +1,22 @@
-from typing import Any
+import functools
+from contextvars import Token
+from typing import Any, Callable, Dict, cast
 
-from logger.logger import DEFAULT_LOG_DIR, DEFAULT_LOG_FORMAT, DEFAULT_LOG_LEVEL, CallableT, Logger
+from logger.async_handler import AsyncOptions
+from logger.logger import (
+    DEFAULT_LOG_DIR,
+    DEFAULT_LOG_FORMAT,
+    DEFAULT_LOG_LEVEL,
+    CallableT,
+    LazyMessage,
+    Logger,
+    Msg,
+)
+from logger.rotation import RotationOptions
+
+
+def lazy(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> LazyMessage:
+    return LazyMessage(fn, *args, **kwargs)
 
 
 def get_global_logger() -> Logger:
@@ -11,11 +27,11 @@ def set_global_logger(logger: Logger) -> None:
     Logger.set_global_logger(logger)
 
 
-def info(msg: str, *args: Any, **kwargs: Any) -> None:
+def info(msg: Msg, *args: Any, **kwargs: Any) -> None:
     Logger.get_global_logger().info(msg, *args, **kwargs)
 
 
-def debug(msg: str, *args: Any, **kwargs: Any) -> None:
+def debug(msg: Msg, *args: Any, **kwargs: Any) -> None:
     Logger.get_global_logger().debug(msg, *args, **kwargs)
 
 
@@ -23,19 +39,49 @@ def set_level(level: int) -> None:
     Logger.get_global_logger().set_level(level)
 
 
-def warning(msg: str, *args: Any, **kwargs: Any) -> None:
+def stats() -> Dict[str, Any]:
+    return Logger.get_global_logger().stats()
+
+
+def set_site(site: str) -> Token:
+    return Logger.set_site(site)
+
+
+def reset_site(token: Token) -> None:
+    Logger.reset_site(token)
+
+
+def timing(name: str) -> Any:
+    return Logger.get_global_logger().timing(name)
+
+
+def timed(name: str) -> Callable[[CallableT], CallableT]:
+    """Decorator timing every call as a span of whichever logger is global at call time."""
+
+    def decorator(fn: CallableT) -> CallableT:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with Logger.get_global_logger().timing(name):
+                return fn(*args, **kwargs)
+
+        return cast(CallableT, wrapper)
+
+    return decorator
+
+
+def warning(msg: Msg, *args: Any, **kwargs: Any) -> None:
     Logger.get_global_logger().warning(msg, *args, **kwargs)
 
 
-def error(msg: str, *args: Any, **kwargs: Any) -> None:
+def error(msg: Msg, *args: Any, **kwargs: Any) -> None:
     Logger.get_global_logger().error(msg, *args, **kwargs)
 
 
-def exception(msg: str, *args: Any, exc_info: bool = True, **kwargs: Any) -> None:
+def exception(msg: Msg, *args: Any, exc_info: bool = True, **kwargs: Any) -> None:
     Logger.get_global_logger().exception(msg, *args, exc_info=exc_info, **kwargs)
 
 
-def user(msg: str, *args: Any, **kwargs: Any) -> None:
+def user(msg: Msg, *args: Any, **kwargs: Any) -> None:
     """Write external-facing message to log.
 
     This writes to both the process's configured log file as well as to user.log,
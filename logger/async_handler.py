@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import weakref
+from collections import deque
+from logging.handlers import BaseRotatingHandler
+from typing import Any, Deque, Dict, List
+
+import attr
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_DEBUG = "drop-debug"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_DEBUG, OVERFLOW_DROP_OLDEST)
+
+
+@attr.s(kw_only=True, frozen=True)
+class AsyncOptions:
+    queue_size: int = attr.ib(default=10000)
+    batch_size: int = attr.ib(default=256)
+    flush_interval: float = attr.ib(default=0.5)
+    overflow: str = attr.ib(default=OVERFLOW_BLOCK, validator=attr.validators.in_(OVERFLOW_POLICIES))
+
+
+class AsyncBatchHandler(logging.Handler):
+    """
+    Puts records on a bounded queue and lets a background writer format them and write them to the wrapped
+    handlers in batches, with one write and one flush per handler per batch.
+
+    When the queue is full the overflow policy decides what happens: "block" waits for the writer,
+    "drop-debug" drops records below INFO (and blocks for the others), "drop-oldest" evicts the oldest record.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], options: AsyncOptions):
+        super().__init__()
+        self._handlers = handlers
+        self._options = options
+        self._closed = False
+        self._enqueued = 0
+        self._written = 0
+        self._batches = 0
+        self._dropped: Dict[str, int] = {OVERFLOW_DROP_DEBUG: 0, OVERFLOW_DROP_OLDEST: 0}
+        self._start()
+        # the writer thread doesn't survive a fork, pre-forked workers need their own
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    @property
+    def handlers(self) -> List[logging.Handler]:
+        return self._handlers
+
+    def _start(self) -> None:
+        self._queue: Deque[logging.LogRecord] = deque()
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._drain, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        options = self._options
+        with self._cond:
+            if self._closed:
+                self._write([record])
+                return
+            while len(self._queue) >= options.queue_size:
+                if options.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped[OVERFLOW_DROP_OLDEST] += 1
+                    break
+                if options.overflow == OVERFLOW_DROP_DEBUG and record.levelno < logging.INFO:
+                    self._dropped[OVERFLOW_DROP_DEBUG] += 1
+                    return
+                self._cond.notify_all()
+                self._cond.wait()
+            self._queue.append(record)
+            self._enqueued += 1
+            if len(self._queue) >= options.batch_size:
+                self._cond.notify_all()
+
+    def _drain(self) -> None:
+        while True:
+            with self._cond:
+                if not self._queue and not self._closed:
+                    self._cond.wait(self._options.flush_interval)
+                if not self._queue and self._closed:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(len(self._queue), self._options.batch_size))]
+                # wake producers blocked on a full queue
+                self._cond.notify_all()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        for handler in self._handlers:
+            try:
+                if isinstance(handler, logging.StreamHandler):
+                    _write_stream_batch(handler, batch)
+                else:
+                    for record in batch:
+                        handler.handle(record)
+            except Exception:
+                self.handleError(batch[-1])
+        self._written += len(batch)
+        self._batches += 1
+
+    def flush(self) -> None:
+        with self._cond:
+            batch = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        if batch:
+            self._write(batch)
+
+    def close(self) -> None:
+        """Stop the writer after it flushed every queued record, then close the wrapped handlers."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+        self.flush()
+        for handler in self._handlers:
+            handler.close()
+        super().close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queue),
+            "enqueued": self._enqueued,
+            "written": self._written,
+            "batches": self._batches,
+            "dropped": dict(self._dropped),
+        }
+
+
+def _write_stream_batch(handler: logging.StreamHandler, batch: List[logging.LogRecord]) -> None:
+    handler.acquire()
+    try:
+        lines = []
+        for record in batch:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            if isinstance(handler, BaseRotatingHandler) and handler.shouldRollover(record):
+                _write_lines(handler, lines)
+                lines = []
+                handler.doRollover()
+            lines.append(handler.format(record) + handler.terminator)
+        _write_lines(handler, lines)
+    finally:
+        handler.release()
+
+
+def _write_lines(handler: logging.StreamHandler, lines: List[str]) -> None:
+    if not lines:
+        return
+    if isinstance(handler, logging.FileHandler) and handler.stream is None:
+        handler.stream = handler._open()
+    handler.stream.write("".join(lines))
+    handler.flush()
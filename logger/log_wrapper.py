@@ -1,6 +1,7 @@
 from typing import Any
 
 import logger
+from logger.logger import Msg
 
 
 class LogWrapper:
@@ -11,14 +12,19 @@ class LogWrapper:
     def __init__(self, prefix: str):
         self._prefix = f"[{prefix}] "
 
-    def info(self, msg: str, *args: Any, **kwargs: Any) -> None:
-        logger.info(f"{self._prefix}{msg}", *args, *kwargs)
+    def _prefixed(self, msg: Msg) -> Msg:
+        if callable(msg):
+            return lambda: f"{self._prefix}{msg()}"
+        return f"{self._prefix}{msg}"
 
-    def warning(self, msg: str, *args: Any, **kwargs: Any) -> None:
-        logger.warning(f"{self._prefix}{msg}", *args, *kwargs)
+    def info(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
+        logger.info(self._prefixed(msg), *args, **kwargs)
 
-    def error(self, msg: str, *args: Any, **kwargs: Any) -> None:
-        logger.error(f"{self._prefix}{msg}", *args, *kwargs)
+    def warning(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
+        logger.warning(self._prefixed(msg), *args, **kwargs)
 
-    def exception(self, msg: str, *args: Any, **kwargs: Any) -> None:
-        logger.exception(f"{self._prefix}{msg}", *args, *kwargs)
+    def error(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
+        logger.error(self._prefixed(msg), *args, **kwargs)
+
+    def exception(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
+        logger.exception(self._prefixed(msg), *args, **kwargs)
@@ -1,17 +1,24 @@
+import atexit
 import logging
 import os
+import random
 import threading
+import time
 import traceback
 from collections import OrderedDict
-from logging.handlers import TimedRotatingFileHandler
-from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+from contextlib import ContextDecorator
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
 import attr
-from pythonjsonlogger import jsonlogger
+
+import clock
+from logger.async_handler import AsyncBatchHandler, AsyncOptions
+from logger.rotation import RotationOptions, SizeTimedRotatingFileHandler, archiver_stats
 
 # Settings for normal text logs
 DEFAULT_LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
-DEFAULT_LOG_FORMAT = "[%(name)s] %(asctime)s - %(threadName)-8s - %(levelname)-4s %(message)s"
+DEFAULT_LOG_FORMAT = "[%(name)s] %(asctime)s - %(threadName)-8s - %(levelname)-4s %(site_tag)s%(message)s"
 DEFAULT_LOG_DIR = os.environ.get("LOG_DIR") or r"/home/gort/rms-log"  # "/home/henry/log/metabot-rms"
 
 # Settings for json logs
@@ -30,10 +37,6 @@ DEFAULT_JSON_FIELDS_TO_INCLUDE = {
     "threadName",
 }
 
-# Settings for log rotation (rotate logs once per day with 7 days of backups)
-LOG_ROTATION_TIME_UNITS = "W0"  # Rotate on Mondays at midnight
-LOG_ROTATION_NUM_BACKUPS = 12
-
 DEFAULT_USER_LOG_FORMAT = "%(asctime)s %(message)s"
 
 # custom logging levels
@@ -48,6 +51,40 @@ logging.addLevelName(LEVEL_USER, "USER")
 
 CallableT = TypeVar("CallableT", bound=Callable[..., Any])
 
+# A log message is either a %-style format string or a callable rendering it, called only if the level is enabled
+Msg = Union[str, Callable[[], Any]]
+
+
+class LazyMessage:
+    """
+    Defers an expensive rendering (repr of a large dict, json.dumps, ...) until a handler formats the record.
+    Usable both as a log argument, `logger.info("params: %s", lazy(json.dumps, params))`, and as the message.
+    The result is cached since every handler formats the same record.
+    """
+
+    __slots__ = ("_fn", "_args", "_kwargs", "_rendered")
+
+    def __init__(self, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._rendered: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._rendered is None:
+            self._rendered = str(self._fn(*self._args, **self._kwargs))
+        return self._rendered
+
+    __repr__ = __str__
+
+
+# Default settings for timing spans
+DEFAULT_TIMING_REPORT_INTERVAL = 60.0
+DEFAULT_TIMING_MAX_SAMPLES = 10000
+
+# Keys of the spans currently open in this thread / asyncio task, innermost last
+_timing_stack: ContextVar[Tuple[str, ...]] = ContextVar("timing_stack", default=())
+
 
 @attr.s(kw_only=True)
 class TimingsManager:
@@ -63,23 +100,132 @@ class TimingsManager:
         self.timing_child_to_parent.clear()
         self.timing_root_keys.clear()
 
+    def record(self, key: str, parent: Optional[str], elapsed: float, max_samples: int) -> None:
+        samples = self.timings.get(key)
+        if samples is None:
+            samples = self.timings[key] = []
+            if parent is None:
+                self.timing_root_keys.append(key)
+            else:
+                self.timing_child_to_parent[key] = parent
+                self.timing_parent_to_children.setdefault(parent, []).append(key)
+        if len(samples) < max_samples:
+            samples.append(elapsed)
+        else:
+            # past the cap, keep a uniform sample instead of growing without bound
+            samples[random.randrange(len(samples))] = elapsed
+
+    def summary(self) -> List[Tuple[int, str, Dict[str, float]]]:
+        """Per span (depth, key, stats in ms) in tree order, parents before their children."""
+        rows: List[Tuple[int, str, Dict[str, float]]] = []
+
+        def visit(key: str, depth: int) -> None:
+            samples = self.timings.get(key)
+            if samples:
+                rows.append((depth, key, _percentiles(samples)))
+            for child in self.timing_parent_to_children.get(key, []):
+                visit(child, depth + 1)
+
+        for root in self.timing_root_keys:
+            visit(root, 0)
+        return rows
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) * 1000,
+        "p50": ordered[last // 2] * 1000,
+        "p90": ordered[int(last * 0.9)] * 1000,
+        "p99": ordered[int(last * 0.99)] * 1000,
+        "max": ordered[last] * 1000,
+    }
+
+
+class _TimingSpan(ContextDecorator):
+    """
+    Times the enclosed block as a child of the innermost open span. Usable as context manager and decorator.
+    """
+
+    def __init__(self, owner: "Logger", name: str):
+        self._owner = owner
+        self._name = name
+        self._key = name
+        self._parent: Optional[str] = None
+        self._start = 0.0
+        self._token: Any = None
+
+    def _recreate_cm(self) -> "_TimingSpan":
+        # a decorated function may run concurrently, give every call its own span
+        return _TimingSpan(self._owner, self._name)
+
+    def __enter__(self) -> "_TimingSpan":
+        stack = _timing_stack.get()
+        if stack:
+            self._parent = stack[-1]
+            self._key = f"{self._parent}/{self._name}"
+        self._token = _timing_stack.set(stack + (self._key,))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        elapsed = time.perf_counter() - self._start
+        _timing_stack.reset(self._token)
+        self._owner._record_timing(self._key, self._parent, elapsed)
+
+
+class _NullSpan:
+    """Stand-in for _TimingSpan when timings are disabled."""
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+    def __call__(self, fn: CallableT) -> CallableT:
+        return fn
+
+
+_NULL_SPAN = _NullSpan()
+
+# Name of the site the request or callback being handled belongs to, when one process serves several sites
+_site: ContextVar[str] = ContextVar("site", default="")
+
+
+class _SiteFilter(logging.Filter):
+    """
+    Tags every record with its site: a "[name] " prefix in text logs and a site field in JSON logs. The first
+    handler a record reaches tags it in the logging thread or task, handlers behind an async queue keep that tag.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if "site_tag" not in record.__dict__:
+            site = _site.get()
+            record.site = site
+            record.site_tag = f"[{site}] " if site else ""
+        return True
+
+
+_SITE_FILTER = _SiteFilter()
+
 
 def _make_stream_handler(log_level: int, log_format: str) -> logging.Handler:
     handler = logging.StreamHandler()
     handler.setLevel(log_level)
     handler.setFormatter(logging.Formatter(log_format))
+    handler.addFilter(_SITE_FILTER)
     return handler
 
 
-def _make_timed_rotation_handler(log_path: str, log_level: int, formatter: logging.Formatter) -> logging.Handler:
-    handler = TimedRotatingFileHandler(
-        log_path,
-        encoding="utf-8",
-        when=LOG_ROTATION_TIME_UNITS,
-        backupCount=LOG_ROTATION_NUM_BACKUPS,
-    )
+def _make_rotation_handler(log_path: str, log_level: int, formatter: logging.Formatter, rotation: RotationOptions,
+                           indexed: bool = False) -> logging.Handler:
+    handler = SizeTimedRotatingFileHandler(log_path, rotation, indexed=indexed)
     handler.setLevel(log_level)
     handler.setFormatter(formatter)
+    handler.addFilter(_SITE_FILTER)
     return handler
 
 
@@ -93,18 +239,39 @@ class Logger:
         log_level: Union[str, int] = DEFAULT_LOG_LEVEL,
         log_format: str = DEFAULT_LOG_FORMAT,
         log_dir: str = DEFAULT_LOG_DIR,
+        async_options: Optional[AsyncOptions] = None,
+        rotation: Optional[RotationOptions] = None,
     ):
-        log_level = getattr(logging, log_level.upper()) if isinstance(log_level, str) else log_level
+        # getLevelName maps registered names, including the custom TIMING and USER levels, back to numbers
+        log_level = logging.getLevelName(log_level.upper()) if isinstance(log_level, str) else log_level
 
         self._logger = logging.getLogger(name)
         self._logger.handlers.clear()
         self._logger.setLevel(log_level)
         self._log_timing = True
         self._suppress_timing_msg = False
+        self._timings = TimingsManager()
+        self._timings_lock = threading.Lock()
+        self._timing_report_interval = DEFAULT_TIMING_REPORT_INTERVAL
+        self._timing_max_samples = DEFAULT_TIMING_MAX_SAMPLES
+        self._timing_reporter: Optional[threading.Thread] = None
+        self._timing_reporter_pid = 0
+        self._async_handler: Optional[AsyncBatchHandler] = None
 
         # Add a default handler for logging to stdout
         self._logger.addHandler(_make_stream_handler(log_level, log_format))
-
+        self._add_file_handlers(name, log_level, log_format, log_dir, rotation or RotationOptions())
+
+        if async_options is not None:
+            # Move every handler behind one queue so formatting and writing happen off the calling thread
+            self._async_handler = AsyncBatchHandler(list(self._logger.handlers), async_options)
+            self._async_handler.addFilter(_SITE_FILTER)
+            self._logger.handlers.clear()
+            self._logger.addHandler(self._async_handler)
+            atexit.register(self.close)
+
+    def _add_file_handlers(self, name: Optional[str], log_level: int, log_format: str, log_dir: str,
+                           rotation: RotationOptions) -> None:
         if name is None:
             # This mainly happens inside multiprocessing-launched processes, or else if there's an
             # entry point that failed to configure its logging name.
@@ -119,7 +286,9 @@ class Logger:
         text_log_path = os.path.join(log_dir, f"{name}.log")
         self._logger.info(f"Writing text logs to {text_log_path}")
 
-        self._logger.addHandler(_make_timed_rotation_handler(text_log_path, log_level, logging.Formatter(log_format)))
+        self._logger.addHandler(
+            _make_rotation_handler(text_log_path, log_level, logging.Formatter(log_format), rotation)
+        )
 
         # user.log will capture USER-level log lines
         # user.log can be used across different logger instances/Python instances/processes
@@ -128,39 +297,57 @@ class Logger:
         user_log_path = os.path.join(log_dir, "user.log")
         self._logger.info(f"Writing user logs to {user_log_path}")
         self._logger.addHandler(
-            _make_timed_rotation_handler(user_log_path, LEVEL_USER, logging.Formatter(DEFAULT_USER_LOG_FORMAT))
+            _make_rotation_handler(user_log_path, LEVEL_USER, logging.Formatter(DEFAULT_USER_LOG_FORMAT), rotation)
         )
 
-        # Add a handler for JSON logs as JSON lines (.jsonl)
+        # Add a handler for JSON logs as JSON lines (.jsonl), only imported when there is a log dir to write to
+        from pythonjsonlogger import jsonlogger
+
         json_log_path = os.path.join(log_dir, f"{name}.jsonl")
         self._logger.info(f"Writing json logs to {json_log_path}")
-        reserved_attrs = list(set(jsonlogger.RESERVED_ATTRS) - DEFAULT_JSON_FIELDS_TO_INCLUDE)
+        reserved_attrs = list(set(jsonlogger.RESERVED_ATTRS) - DEFAULT_JSON_FIELDS_TO_INCLUDE) + ["site_tag"]
         json_formatter = jsonlogger.JsonFormatter(
             timestamp=True, reserved_attrs=reserved_attrs, json_ensure_ascii=False
         )
-        self._logger.addHandler(_make_timed_rotation_handler(json_log_path, log_level, json_formatter))
+        # rolled-over segments get a sidecar index, searched by python -m logger.query
+        self._logger.addHandler(
+            _make_rotation_handler(json_log_path, log_level, json_formatter, rotation, indexed=True)
+        )
 
     @property
     def logger(self) -> logging.Logger:
         return self._logger
 
+    @property
+    def handlers(self) -> List[logging.Handler]:
+        """The handlers records end up in, behind the async queue if there is one."""
+        return self._async_handler.handlers if self._async_handler is not None else self._logger.handlers
+
     def set_level(self, level: int) -> None:
         self._logger.setLevel(level)
-        for handler in self._logger.handlers:
+        for handler in self.handlers:
             handler.setLevel(level)
 
+    def stats(self) -> Dict[str, Any]:
+        archiver = {"archiver": archiver_stats()}
+        if self._async_handler is None:
+            return {"async": False, **archiver}
+        return {"async": True, **self._async_handler.stats(), **archiver}
+
     def __del__(self) -> None:
         self.close()
 
     def close(self) -> None:
         for handler in self._logger.handlers:
-            if isinstance(handler, logging.FileHandler):
+            if isinstance(handler, (logging.FileHandler, AsyncBatchHandler)):
                 handler.close()
         self._logger.handlers.clear()
 
-    def log(self, level: int, msg: str, *args: Any, **kwargs: Any) -> None:
+    def log(self, level: int, msg: Msg, *args: Any, **kwargs: Any) -> None:
         try:
             if self._logger.isEnabledFor(level):
+                if callable(msg):
+                    msg = LazyMessage(msg)
                 self._logger.log(level, msg, *args, **kwargs)
         except Exception as e:
             if isinstance(e, NameError):
@@ -168,22 +355,22 @@ class Logger:
             else:
                 traceback.print_exc()
 
-    def debug(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def debug(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         self.log(logging.DEBUG, msg, *args, **kwargs)
 
-    def info(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def info(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         self.log(logging.INFO, msg, *args, **kwargs)
 
-    def warning(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def warning(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         self.log(logging.WARNING, msg, *args, **kwargs)
 
-    def error(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def error(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         self.log(logging.ERROR, msg, *args, **kwargs)
 
-    def exception(self, msg: str, *args: Any, exc_info: bool = True, **kwargs: Any) -> None:
+    def exception(self, msg: Msg, *args: Any, exc_info: bool = True, **kwargs: Any) -> None:
         self.log(logging.ERROR, msg, *args, exc_info=exc_info, **kwargs)
 
-    def user(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def user(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         """Write external-facing message to log.
 
         This writes to both the process's configured log file as well as to user.log,
@@ -193,9 +380,81 @@ class Logger:
         """
         self.log(LEVEL_USER, msg, *args, **kwargs)
 
-    def _timing_msg(self, msg: str, *args: Any, **kwargs: Any) -> None:
+    def _timing_msg(self, msg: Msg, *args: Any, **kwargs: Any) -> None:
         self._logger.log(LEVEL_TIMING, msg, *args, **kwargs)
 
+    def configure_timing(
+        self,
+        enabled: bool = True,
+        report_interval: float = DEFAULT_TIMING_REPORT_INTERVAL,
+        max_samples: int = DEFAULT_TIMING_MAX_SAMPLES,
+    ) -> None:
+        """Turn timing spans on or off. Disabled spans are a shared no-op object, so they cost next to nothing."""
+        self._log_timing = enabled
+        self._timing_report_interval = report_interval
+        self._timing_max_samples = max_samples
+
+    def timing(self, name: str) -> Union[_TimingSpan, _NullSpan]:
+        """Time a block as a span nested in the innermost open span, e.g. `with logger.timing("parse"): ...`."""
+        if not self._log_timing:
+            return _NULL_SPAN
+        return _TimingSpan(self, name)
+
+    def timed(self, name: str) -> Callable[[CallableT], CallableT]:
+        """Decorator timing every call of the function as a span."""
+        return self.timing(name)
+
+    def _record_timing(self, key: str, parent: Optional[str], elapsed: float) -> None:
+        with self._timings_lock:
+            self._timings.record(key, parent, elapsed, self._timing_max_samples)
+        if self._timing_reporter_pid != os.getpid():
+            self._start_timing_reporter()
+
+    def _start_timing_reporter(self) -> None:
+        with self._timings_lock:
+            # a forked worker inherits the pid of its parent's reporter but not the thread
+            if self._timing_reporter_pid == os.getpid():
+                return
+            self._timing_reporter_pid = os.getpid()
+            self._timing_reporter = threading.Thread(target=self._report_timings_forever, name="timing-reporter",
+                                                     daemon=True)
+            self._timing_reporter.start()
+
+    def _report_timings_forever(self) -> None:
+        while True:
+            with self._timings_lock:
+                if not self._log_timing:
+                    # the next span recorded once timing is enabled again starts a new reporter
+                    if self._timing_reporter is threading.current_thread():
+                        self._timing_reporter, self._timing_reporter_pid = None, 0
+                    return
+            # simulated time under a virtual clock, so a soak run reports once per simulated interval
+            clock.get_clock().sleep(self._timing_report_interval)
+            self.report_timings()
+
+    def report_timings(self) -> List[Tuple[int, str, Dict[str, float]]]:
+        """Emit the percentiles of every span recorded since the last report at TIMING level and reset them."""
+        with self._timings_lock:
+            rows = self._timings.summary()
+            self._timings.clear()
+        if not self._suppress_timing_msg:
+            for depth, key, stats in rows:
+                self._timing_msg(
+                    "%s%s: count=%d mean=%.3fms p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms",
+                    "  " * depth, key.rsplit("/", 1)[-1], stats["count"], stats["mean"], stats["p50"],
+                    stats["p90"], stats["p99"], stats["max"],
+                )
+        return rows
+
+    @staticmethod
+    def set_site(site: str) -> Token:
+        """Tag what is logged in this thread or task with site until reset_site(token)."""
+        return _site.set(site)
+
+    @staticmethod
+    def reset_site(token: Token) -> None:
+        _site.reset(token)
+
     @staticmethod
     def get_global_logger() -> "Logger":
         if Logger._global_logger is None:
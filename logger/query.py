@@ -0,0 +1,57 @@
+"""
+Find the records of one robot, station or order in a JSONL log: its rolled-over segments are searched through
+their sidecar indexes, decompressing only the blocks that hold the value, then the live file is scanned.
+
+    python -m logger.query /home/gort/rms-log/wcs-baffle.jsonl --serial robot-7
+    python -m logger.query /home/gort/rms-log/wcs-baffle.jsonl --station-id st-3 --since 2026-10-17T08:00 --limit 50
+
+--since and --until take ISO 8601 times, local time unless they carry an offset.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from logger.rotation import query
+
+
+def _time(value: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(value).timestamp() if value is not None else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="the live .jsonl file, its segments are found next to it")
+    parser.add_argument("--serial")
+    parser.add_argument("--station-id")
+    parser.add_argument("--order-id")
+    parser.add_argument("--since", help="only records logged at or after this time")
+    parser.add_argument("--until", help="only records logged at or before this time")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many records, 0 for all")
+    parser.add_argument("--stats", action="store_true", help="print segments and blocks read to stderr")
+    args = parser.parse_args()
+    filters = {field: value for field, value in (("serial", args.serial), ("station_id", args.station_id),
+                                                 ("order_id", args.order_id)) if value is not None}
+    try:
+        since, until = _time(args.since), _time(args.until)
+    except ValueError as e:
+        parser.error(str(e))
+
+    counters: Dict[str, int] = {}
+    start = time.perf_counter()
+    found = 0
+    out = sys.stdout.buffer
+    for line in query(args.path, filters, since, until, counters):
+        out.write(line)
+        out.write(b"\n")
+        found += 1
+        if found == args.limit:
+            break
+    out.flush()
+    if args.stats:
+        print(f"{found} records in {time.perf_counter() - start:.3f}s, {counters}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
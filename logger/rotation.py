@@ -0,0 +1,398 @@
+import gzip
+import json
+import mmap
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import weakref
+import zlib
+from contextlib import nullcontext
+from datetime import datetime
+from logging.handlers import TimedRotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import attr
+
+# Settings for log rotation: a new segment every midnight or every 256 MiB, whichever comes first, 60 kept
+LOG_ROTATION_TIME_UNITS = "midnight"
+LOG_ROTATION_MAX_BYTES = 256 * 1024 * 1024
+LOG_ROTATION_NUM_BACKUPS = 60
+
+# fields of JSONL records whose values the sidecar index of a segment lists the blocks of
+INDEXED_FIELDS = ("serial", "station_id", "order_id")
+# uncompressed bytes of whole lines per block; a block is one gzip member, the unit a query decompresses
+BLOCK_BYTES = 64 * 1024
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+# <base>.<YYYYmmdd-HHMMSS>[.<n>][.gz], n tells apart segments rolled over within the same second
+_SEGMENT_NAME = re.compile(r"^\.(\d{8}-\d{6})(?:\.(\d+))?(\.gz)?$")
+# serial / station_id / order_id followed by its value, whether logged as a dict repr ('serial': 'r1'), as JSON
+# ("serial": "r1", escaped inside a JSON message), as a JSON field of the record or as text (serial: r1)
+_KEY_PATTERN = re.compile(rb"""\b(serial|station_id|order_id)\\?['"]?\s*[:=]\s*\\?['"]?([^\s'",;)}\]\\]+)""")
+_TIMESTAMP_PATTERN = re.compile(rb'"timestamp":\s*"([^"]+)"')
+
+
+@attr.s(kw_only=True, frozen=True)
+class RotationOptions:
+    when: str = attr.ib(default=LOG_ROTATION_TIME_UNITS)
+    # 0 rotates on time only
+    max_bytes: int = attr.ib(default=LOG_ROTATION_MAX_BYTES)
+    backups: int = attr.ib(default=LOG_ROTATION_NUM_BACKUPS)
+    compress: bool = attr.ib(default=True)
+
+
+class SizeTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """
+    Rolls the file over at the time boundary of options.when or once it holds options.max_bytes, whichever comes
+    first. Rolling over only renames the file to a segment; compressing it, writing its sidecar index (indexed=True,
+    for JSONL logs) and removing the segments past options.backups happen on the archiver thread, so the thread
+    logging never waits for them.
+    """
+
+    def __init__(self, filename: str, options: RotationOptions, indexed: bool = False):
+        super().__init__(filename, when=options.when, backupCount=options.backups, encoding="utf-8")
+        self._options = options
+        self._indexed = indexed
+        # segments rolled over by a previous run that exited before archiving them
+        for segment in list_segments(self.baseFilename):
+            if _unarchived(segment, options.compress, indexed):
+                get_archiver().submit(segment, self.baseFilename, options, indexed)
+
+    def shouldRollover(self, record: Any) -> bool:
+        # the position of the stream, not the size of the file: no stat per record
+        if self._options.max_bytes and self.stream is not None and self.stream.tell() >= self._options.max_bytes:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        now = int(time.time())
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            segment = _segment_name(self.baseFilename, time.gmtime(now) if self.utc else time.localtime(now))
+            os.rename(self.baseFilename, segment)
+            get_archiver().submit(segment, self.baseFilename, self._options, self._indexed)
+        self.stream = self._open()
+        self.rolloverAt = self.computeRollover(now)
+
+
+def _segment_name(base: str, rolled_over: time.struct_time) -> str:
+    segment = f"{base}.{time.strftime('%Y%m%d-%H%M%S', rolled_over)}"
+    name, n = segment, 0
+    while os.path.exists(name) or os.path.exists(f"{name}.gz"):
+        n += 1
+        name = f"{segment}.{n}"
+    return name
+
+
+def list_segments(base: str) -> List[str]:
+    """The rolled-over segments of base, oldest first: the compressed file of a segment if it has one."""
+    directory, prefix = os.path.split(os.path.abspath(base))
+    segments: Dict[Tuple[str, int], str] = {}
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        match = _SEGMENT_NAME.match(name[len(prefix):])
+        if match is None:
+            continue
+        key = (match.group(1), int(match.group(2) or 0))
+        # while a segment is being compressed both files exist, the compressed one is complete once renamed
+        if match.group(3) or key not in segments:
+            segments[key] = os.path.join(directory, name)
+    return [segments[key] for key in sorted(segments)]
+
+
+def _unarchived(segment: str, compress: bool, indexed: bool) -> bool:
+    if segment.endswith(".gz"):
+        return False
+    return compress or (indexed and not os.path.exists(segment + INDEX_SUFFIX))
+
+
+def archive_segment(segment: str, compress: bool, indexed: bool) -> str:
+    """
+    Rewrite segment as blocks of whole lines, each compressed as its own gzip member when compress (the file stays
+    a valid gzip file), and write its sidecar index when indexed. Returns the path of the archived segment.
+    """
+    target = f"{segment}.gz" if compress else segment
+    blocks: List[List[Any]] = []
+    postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in INDEXED_FIELDS}
+    with open(segment, "rb") as src, (open(f"{target}.tmp", "wb") if compress else nullcontext()) as out:
+        size = os.fstat(src.fileno()).st_size
+        # an empty file can't be mapped, and has no blocks
+        with (mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) if size else nullcontext(b"")) as mm:
+            start = offset = 0
+            while start < size:
+                newline = mm.find(b"\n", min(start + BLOCK_BYTES, size) - 1)
+                end = size if newline < 0 else newline + 1
+                data = mm[start:end]
+                if indexed:
+                    for field, value in {(f.decode(), v.decode("utf-8", "replace"))
+                                         for f, v in _KEY_PATTERN.findall(data)}:
+                        postings[field].setdefault(value, []).append(len(blocks))
+                first, last = _time_range(data) if indexed else (None, None)
+                if compress:
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                    member = compressor.compress(data) + compressor.flush()
+                    out.write(member)
+                    blocks.append([offset, len(member), first, last, data.count(b"\n")])
+                    offset += len(member)
+                else:
+                    blocks.append([start, end - start, first, last, data.count(b"\n")])
+                start = end
+    if compress:
+        os.replace(f"{target}.tmp", target)
+    if indexed:
+        times = [t for block in blocks for t in block[2:4] if t is not None]
+        index = {
+            "version": INDEX_VERSION,
+            "codec": "gzip" if compress else "raw",
+            "records": sum(block[4] for block in blocks),
+            "first": min(times, default=None),
+            "last": max(times, default=None),
+            # offset, length, first and last timestamp, records
+            "blocks": blocks,
+            "fields": list(INDEXED_FIELDS),
+        }
+        # the header line, then per field one line of value -> ids of the blocks holding it: a query parses the
+        # header and only the ids of the values it looks up
+        with open(f"{target}{INDEX_SUFFIX}.tmp", "w", encoding="utf-8") as index_file:
+            for part in [index] + [postings[field] for field in INDEXED_FIELDS]:
+                index_file.write(json.dumps(part, separators=(",", ":"), ensure_ascii=False))
+                index_file.write("\n")
+        os.replace(f"{target}{INDEX_SUFFIX}.tmp", target + INDEX_SUFFIX)
+    if compress:
+        os.remove(segment)
+    return target
+
+
+def prune(base: str, backups: int) -> List[str]:
+    """Remove the oldest segments of base and their indexes, keeping the newest backups of them."""
+    if backups <= 0:
+        return []
+    removed = list_segments(base)[:-backups]
+    for segment in removed:
+        stem = segment[:-3] if segment.endswith(".gz") else segment
+        for path in (stem, f"{stem}.gz", f"{stem}{INDEX_SUFFIX}", f"{stem}.gz{INDEX_SUFFIX}"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class LogArchiver:
+    """
+    Compresses, indexes and prunes rolled-over segments on one background thread, in the order they were rolled
+    over. Segments still queued when the process exits are archived by the next run's handler.
+    """
+
+    def __init__(self):
+        self.archived = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self._start()
+        # the thread doesn't survive a fork, pre-forked workers archive what they roll over themselves
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    def _start(self) -> None:
+        self._queue: "queue.Queue[Tuple[str, str, RotationOptions, bool]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="log-archiver", daemon=True)
+        self._thread.start()
+
+    def submit(self, segment: str, base: str, options: RotationOptions, indexed: bool) -> None:
+        self._queue.put((segment, base, options, indexed))
+
+    def _run(self) -> None:
+        while True:
+            segment, base, options, indexed = self._queue.get()
+            try:
+                if _unarchived(segment, options.compress, indexed):
+                    archive_segment(segment, options.compress, indexed)
+                prune(base, options.backups)
+                self.archived += 1
+            except Exception as e:
+                # logging it could roll over again and queue more work behind the failing segment
+                self.failures += 1
+                self.last_error = repr(e)
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def join(self) -> None:
+        """Wait until every segment queued so far is archived."""
+        self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "archived": self.archived,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+__archiver: Optional[LogArchiver] = None
+__archiver_lock = threading.Lock()
+
+
+def get_archiver() -> LogArchiver:
+    global __archiver
+    if __archiver is None:
+        with __archiver_lock:
+            if __archiver is None:
+                __archiver = LogArchiver()
+    return __archiver
+
+
+def archiver_stats() -> Optional[Dict[str, Any]]:
+    """None until something was rolled over."""
+    return __archiver.stats() if __archiver is not None else None
+
+
+def read_index(segment: str) -> Optional[Dict[str, Any]]:
+    """The header of segment's index, with the postings of each field left as JSON text under "postings"."""
+    try:
+        with open(segment + INDEX_SUFFIX, "rb") as index_file:
+            index = json.loads(index_file.readline())
+            if index.get("version") != INDEX_VERSION:
+                return None
+            index["postings"] = dict(zip(index["fields"], index_file.read().split(b"\n")))
+    except (OSError, ValueError):
+        return None
+    return index
+
+
+def blocks_holding(index: Dict[str, Any], field: str, value: str) -> List[int]:
+    """Ids of the blocks of an index holding value in field, found in the JSON text without parsing all of it."""
+    postings = index["postings"].get(field, b"")
+    key = json.dumps(value, ensure_ascii=False).encode("utf-8") + b":["
+    at = postings.find(key)
+    # a key starts the object or follows another entry, anything else is the tail of a longer key
+    while at > 0 and postings[at - 1:at] not in (b"{", b","):
+        at = postings.find(key, at + 1)
+    if at < 0:
+        return []
+    start = at + len(key) - 1
+    return json.loads(postings[start:postings.index(b"]", start) + 1])
+
+
+def query(base: str, filters: Dict[str, str], since: Optional[float] = None, until: Optional[float] = None,
+          counters: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    Lines of the JSONL log base matching every field -> value of filters and logged within [since, until], oldest
+    first: the indexed segments through their indexes, reading only the blocks that can match, then whatever has
+    no index (segments not archived yet, the live file) by scanning it. counters, if given, is filled with the
+    segments and blocks read and skipped.
+    """
+    counters = counters if counters is not None else {}
+    for key in ("segments_read", "segments_skipped", "segments_scanned", "blocks_read", "blocks_skipped"):
+        counters.setdefault(key, 0)
+    wanted = [(field.encode(), value.encode()) for field, value in filters.items()]
+    for segment in list_segments(base) + [base]:
+        index = read_index(segment) if segment != base else None
+        if index is None:
+            if os.path.exists(segment):
+                counters["segments_scanned"] += 1
+                yield from _scan(segment, wanted, since, until)
+            continue
+        if not _overlaps(index["first"], index["last"], since, until):
+            counters["segments_skipped"] += 1
+            continue
+        candidates: Optional[Set[int]] = None
+        for field, value in filters.items():
+            ids = set(blocks_holding(index, field, value))
+            candidates = ids if candidates is None else candidates & ids
+        block_ids = sorted(candidates) if candidates is not None else range(len(index["blocks"]))
+        counters["blocks_skipped"] += len(index["blocks"]) - len(block_ids)
+        if not block_ids:
+            counters["segments_skipped"] += 1
+            continue
+        counters["segments_read"] += 1
+        with open(segment, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for block_id in block_ids:
+                offset, length, first, last, _ = index["blocks"][block_id]
+                if not _overlaps(first, last, since, until):
+                    counters["blocks_skipped"] += 1
+                    continue
+                counters["blocks_read"] += 1
+                data = mm[offset:offset + length]
+                if index["codec"] == "gzip":
+                    data = zlib.decompress(data, 31)
+                yield from _matching_lines(data, wanted, since, until)
+
+
+def _scan(path: str, wanted: List[Tuple[bytes, bytes]], since: Optional[float],
+          until: Optional[float]) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if path.endswith(".gz"):
+                # several gzip members, zlib.decompress would stop after the first one
+                yield from _matching_lines(gzip.decompress(mm), wanted, since, until)
+            else:
+                yield from _matching_lines(mm, wanted, since, until)
+
+
+def _matching_lines(data: Any, wanted: List[Tuple[bytes, bytes]], since: Optional[float],
+                    until: Optional[float]) -> Iterator[bytes]:
+    """Lines of data (bytes or an mmap) matching wanted and the time range; jumps between lines holding a value."""
+    size = len(data)
+    pos = 0
+    while pos < size:
+        if wanted:
+            hit = data.find(wanted[0][1], pos)
+            if hit < 0:
+                return
+            start = data.rfind(b"\n", 0, hit) + 1
+        else:
+            start = pos
+        end = data.find(b"\n", start)
+        end = size if end < 0 else end
+        line = data[start:end]
+        pos = end + 1
+        if wanted:
+            keys = set(_KEY_PATTERN.findall(line))
+            if not all(pair in keys for pair in wanted):
+                continue
+        if since is not None or until is not None:
+            t = _timestamp(line)
+            if t is not None and not _overlaps(t, t, since, until):
+                continue
+        yield line
+
+
+def _timestamp(line: bytes) -> Optional[float]:
+    match = _TIMESTAMP_PATTERN.search(line)
+    return _parse_time(match.group(1)) if match is not None else None
+
+
+def _time_range(data: bytes) -> Tuple[Optional[float], Optional[float]]:
+    # ISO timestamps of one format and zone sort as text, only the earliest and the latest are parsed
+    stamps = _TIMESTAMP_PATTERN.findall(data)
+    if not stamps:
+        return None, None
+    return _parse_time(min(stamps)), _parse_time(max(stamps))
+
+
+def _parse_time(stamp: bytes) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(stamp.decode()).timestamp()
+    except ValueError:
+        return None
+
+
+def _overlaps(first: Optional[float], last: Optional[float], since: Optional[float], until: Optional[float]) -> bool:
+    if first is None or last is None:
+        return True
+    return (since is None or last >= since) and (until is None or first <= until)
@@ -1,29 +1,46 @@
+import atexit
 import os
 
-import yaml
-
+import codec
+import hot_reload
+import inventory
 import logger
-from config.rms import RMSConfig, set_rms_config
-from config.server import ServerConfig, set_server_config, get_server_config
+import recorder
+from config.server import get_server_config
+import rms
+import scenario
 from controller import serve
 
+CONFIG_PATH = os.environ.get("CONFIG_PATH") or 'config/service.yaml'
+# where the validated config is cached between runs, keyed on the mtime of CONFIG_PATH; unset to always validate
+CONFIG_CACHE = os.environ.get("CONFIG_CACHE") or None
+
 
 def __load_config():
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    with open('config/service.yaml', 'r') as yaml_file:
-        conf_data = yaml.safe_load(yaml_file)
-        logger.info(f"Loaded config: {conf_data}")
-        server_conf = ServerConfig(**conf_data.get('server', {}))
-        rms_conf = RMSConfig(**conf_data.get('rms', {}))
-        set_server_config(server_conf)
-        set_rms_config(rms_conf)
+    hot_reload.publish(hot_reload.load_snapshot(CONFIG_PATH, CONFIG_CACHE))
 
 
 if __name__ == '__main__':
     __load_config()
     server_conf = get_server_config()
     logger_conf = server_conf.logger
-    logger = logger.Logger(name=logger_conf.name, log_level=logger_conf.level, log_dir=logger_conf.log_dir)
+    async_conf = logger_conf.async_logging
+    async_options = logger.AsyncOptions(**async_conf.dict(exclude={"enabled"})) if async_conf.enabled else None
+    rotation = logger.RotationOptions(**logger_conf.rotation.dict())
+    logger = logger.Logger(name=logger_conf.name, log_level=logger_conf.level, log_dir=logger_conf.log_dir,
+                           async_options=async_options, rotation=rotation)
+    logger.configure_timing(**logger_conf.timing.dict())
     logger.set_global_logger(logger)
-    serve(server_conf.port)
+    codec.set_codec(server_conf.json_codec)
+    if server_conf.scenario_file:
+        scenario.load(server_conf.scenario_file)
+    if server_conf.trace.enabled:
+        recorder.configure(server_conf.trace)
+        atexit.register(recorder.close)
+    if server_conf.config_reload.watch:
+        hot_reload.watch(CONFIG_PATH, server_conf.config_reload.interval)
+    rms.replay_journal()
+    inventory.load(server_conf.inventory, server_conf.workers)
+    serve(server_conf.port, server_conf.engine, server_conf.workers, server_conf.stations, server_conf.sites)
 
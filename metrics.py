@@ -0,0 +1,187 @@
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+class _Shard:
+    """
+    Values written by one thread. Only the owning thread mutates it, so recording never takes a lock; the
+    collector sums every shard when /metrics is scraped.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self):
+        self.values: Dict[Tuple[str, LabelValues], List[float]] = {}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._gauges: List[Tuple[str, str, Callable[[], Dict[LabelValues, float]], Sequence[str]]] = []
+        self._shards: List[_Shard] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> "Counter":
+        metric = Counter(self, name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> "Histogram":
+        metric = Histogram(self, name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Dict[LabelValues, float]],
+              labelnames: Sequence[str] = ()) -> None:
+        """Register a gauge whose values are read from collect() at scrape time."""
+        self._gauges.append((name, help_text, collect, labelnames))
+
+    def _merged(self) -> Dict[Tuple[str, LabelValues], List[float]]:
+        with self._lock:
+            shards = list(self._shards)
+        merged: Dict[Tuple[str, LabelValues], List[float]] = {}
+        for shard in shards:
+            for key, values in list(shard.values.items()):
+                total = merged.get(key)
+                if total is None:
+                    merged[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return merged
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        merged = self._merged()
+        lines: List[str] = []
+        for metric in self._metrics:
+            metric.render(lines, {k[1]: v for k, v in merged.items() if k[0] == metric.name})
+        for name, help_text, collect, labelnames in self._gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for labelvalues, value in values.items():
+                lines.append(f"{name}{_labels(labelnames, labelvalues)} {_number(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, registry: Registry, name: str, help_text: str, labelnames: Sequence[str]):
+        self._registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+    def render(self, lines: List[str], values: Dict[LabelValues, List[float]]) -> None:
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.type_name}")
+        for labelvalues in sorted(values):
+            self._render_values(lines, labelvalues, values[labelvalues])
+
+    def _render_values(self, lines: List[str], labelvalues: LabelValues, values: List[float]) -> None:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        values = self._registry.shard().values
+        key = (self.name, labelvalues)
+        slot = values.get(key)
+        if slot is None:
+            values[key] = [amount]
+        else:
+            slot[0] += amount
+
+    def _render_values(self, lines: List[str], labelvalues: LabelValues, values: List[float]) -> None:
+        lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(values[0])}")
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, registry: Registry, name: str, help_text: str, labelnames: Sequence[str],
+                 buckets: Sequence[float]):
+        super().__init__(registry, name, help_text, labelnames)
+        self._buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        values = self._registry.shard().values
+        key = (self.name, labelvalues)
+        slot = values.get(key)
+        if slot is None:
+            # one slot per bucket plus +Inf, then sum and count
+            slot = values[key] = [0.0] * (len(self._buckets) + 3)
+        slot[bisect.bisect_left(self._buckets, value)] += 1
+        slot[-2] += value
+        slot[-1] += 1
+
+    def _render_values(self, lines: List[str], labelvalues: LabelValues, values: List[float]) -> None:
+        cumulative = 0.0
+        bounds = [_number(b) for b in self._buckets] + ["+Inf"]
+        for bound, count in zip(bounds, values):
+            cumulative += count
+            labels = _labels(self.labelnames + ("le",), labelvalues + (bound,))
+            lines.append(f"{self.name}_bucket{labels} {_number(cumulative)}")
+        labels = _labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_number(values[-2])}")
+        lines.append(f"{self.name}_count{labels} {_number(values[-1])}")
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = Registry()
+
+requests_total = REGISTRY.counter("wcs_requests_total", "Requests handled, by site, route and HTTP status.",
+                                  ("site", "route", "status"))
+request_errors_total = REGISTRY.counter("wcs_request_errors_total", "Requests answered with code 1, by site and route.",
+                                        ("site", "route"))
+request_duration = REGISTRY.histogram("wcs_request_duration_seconds", "Request handling latency, by site and route.",
+                                      ("site", "route"))
+admission_shed_total = REGISTRY.counter("wcs_admission_shed_total",
+                                        "Requests answered busy by admission control, by site, route and limit "
+                                        "(in_flight, pending, host).", ("site", "route", "limit"))
+rms_posts_total = REGISTRY.counter("rms_posts_total", "RMS callback POSTs, by site and outcome (ok, rejected, error).",
+                                   ("site", "outcome"))
+rms_post_duration = REGISTRY.histogram("rms_post_duration_seconds", "RMS callback POST latency, by site and outcome.",
+                                       ("site", "outcome"))
+rms_retries_total = REGISTRY.counter("rms_callback_retries_total", "RMS callbacks rescheduled after a failure.")
+rms_dead_letters_total = REGISTRY.counter("rms_callback_dead_letters_total",
+                                          "RMS callbacks that exhausted their retries.")
@@ -0,0 +1,88 @@
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from schema import EMPTY_FALSY
+
+# Request bodies of the WCS routes. Fields are validated in declaration order, so the order below decides which
+# error a request missing several fields gets. Only the declaration is pydantic, requests are checked by the
+# validators schema.compile_schema generates from it.
+
+
+class StationFull(BaseModel):
+    station_id: Any = Field(..., json_schema_extra=EMPTY_FALSY)
+
+
+class StationPrepare(BaseModel):
+    serial: Any = ...
+    robot_type: Any = ...
+    station_id: Any = ...
+
+
+class InboundStart(BaseModel):
+    serial: Any = ...
+    robot_type: Any = ...
+    station_id: Any = ...
+
+
+class RobotLeft(BaseModel):
+    robot_type: Any = ...
+    station_id: Any = ...
+
+
+class Putup(BaseModel):
+    order_id: Any = None
+    boxnumber: Any = None
+    location: Any = None
+
+
+class OutboundStart(BaseModel):
+    order_id: Any = None
+    tote_ids: Any = []
+    station_id: Any = None
+    serial: Any = None
+    robot_type: Any = None
+
+
+class Station(BaseModel):
+    station_id: Any = ...
+
+
+class InventoryTote(BaseModel):
+    boxnumber: Any = Field(..., json_schema_extra=EMPTY_FALSY)
+
+
+class InventoryLocation(BaseModel):
+    location: Any = Field(..., json_schema_extra=EMPTY_FALSY)
+
+
+class InventoryOrder(BaseModel):
+    order_id: Any = Field(..., json_schema_extra=EMPTY_FALSY)
+    offset: Any = 0
+    limit: Any = 100
+
+
+class DeadLetterReplay(BaseModel):
+    ids: Optional[List[Any]] = None
+
+
+class ScenarioSwitch(BaseModel):
+    name: Any = None
+    reload: Any = None
+    scenario: Optional[Dict[str, Any]] = None
+
+
+class CallbackSelect(BaseModel):
+    ids: Optional[List[Any]] = None
+    serial: Any = None
+    station_id: Any = None
+    host: Optional[str] = None
+
+
+class CallbackQuery(CallbackSelect):
+    offset: Any = 0
+    limit: Any = 100
+
+
+class CallbackShift(CallbackSelect):
+    seconds: Any = ...
@@ -0,0 +1,72 @@
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict
+
+import logger
+
+
+def reuseport_socket(port: int, backlog: int = 1024) -> socket.socket:
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform, set workers to 1")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def serve(port: int, workers: int, run_worker: Callable[[socket.socket], None]) -> None:
+    """
+    Pre-fork `workers` processes that each bind `port` with SO_REUSEPORT and serve it with run_worker, letting the
+    kernel spread connections between them. The master only supervises: it respawns workers that die and stops
+    them all on SIGINT/SIGTERM.
+    """
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(reuseport_socket(port))
+            except BaseException:
+                logger.exception("wcs-baffle worker %s crashed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+        logger.info("wcs-baffle worker %s started, pid: %s", index, pid)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for i in range(workers):
+        spawn(i)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.error("wcs-baffle worker %s exited with status %s, respawning", index, status)
+        time.sleep(1)
+        spawn(index)
@@ -0,0 +1,168 @@
+import os
+import threading
+import weakref
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import codec
+import logger
+from config.server import TraceConfig
+
+
+class TraceRecorder:
+    """
+    Streams every WCS request with its reply, and every RMS callback POST, to a JSONL trace file that replay.py can
+    feed back into a build.
+
+    Recording only appends a dict to an in-memory queue. A writer thread encodes and appends everything queued with
+    one write every flush_interval, so the request thread never touches the file. When the queue is full records
+    are dropped and counted rather than blocking requests.
+    """
+
+    def __init__(self, conf: TraceConfig):
+        self._conf = conf
+        self._closed = False
+        self._recorded = 0
+        self._written = 0
+        self._dropped = 0
+        self._start()
+        # the writer thread doesn't survive a fork; the file is opened O_APPEND so every worker can share it
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+
+    @property
+    def path(self) -> str:
+        return self._conf.path
+
+    def _start(self) -> None:
+        self._records: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._write_forever, name="trace-writer", daemon=True)
+        self._writer.start()
+
+    def record(self, record: Dict[str, Any]) -> None:
+        if len(self._records) >= self._conf.queue_size:
+            self._dropped += 1
+            return
+        self._records.append(record)
+        self._recorded += 1
+        if len(self._records) >= self._conf.batch_size:
+            with self._cond:
+                self._cond.notify()
+
+    def _write_forever(self) -> None:
+        fd = os.open(self._conf.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            while True:
+                with self._cond:
+                    if not self._records and not self._closed:
+                        self._cond.wait(self._conf.flush_interval)
+                    closed = self._closed
+                self._write(fd)
+                if closed:
+                    return
+        finally:
+            os.close(fd)
+
+    def _write(self, fd: int) -> None:
+        if not self._records:
+            return
+        lines = []
+        while self._records:
+            record = self._records.popleft()
+            try:
+                lines.append(codec.dumps(record))
+            except (TypeError, ValueError):
+                logger.exception("trace record not encodable, dropped: %r", record)
+                self._dropped += 1
+        if not lines:
+            return
+        lines.append(b"")
+        try:
+            # one write per batch, so lines from pre-forked workers sharing the file don't interleave
+            os.write(fd, b"\n".join(lines))
+            self._written += len(lines) - 1
+        except OSError:
+            logger.exception("trace write failed, %s records lost", len(lines) - 1)
+            self._dropped += len(lines) - 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self._conf.path,
+            "queued": len(self._records),
+            "recorded": self._recorded,
+            "written": self._written,
+            "dropped": self._dropped,
+        }
+
+    def close(self) -> None:
+        """Write everything still queued, then stop the writer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer.join()
+
+
+__recorder: Optional[TraceRecorder] = None
+__lock = threading.Lock()
+
+
+def get_recorder() -> Optional[TraceRecorder]:
+    return __recorder
+
+
+def configure(conf: TraceConfig) -> Optional[TraceRecorder]:
+    """Start recording to conf.path, or stop when trace is disabled. A running recorder is flushed and closed."""
+    global __recorder
+    with __lock:
+        old, __recorder = __recorder, (TraceRecorder(conf) if conf.enabled else None)
+    if old is not None:
+        old.close()
+    if __recorder is not None:
+        logger.info("recording WCS trace to %s", conf.path)
+    return __recorder
+
+
+def close() -> None:
+    global __recorder
+    with __lock:
+        old, __recorder = __recorder, None
+    if old is not None:
+        old.close()
+
+
+def record_request(t: float, route: str, path: str, remote_addr: Optional[str], body: bytes, status: int,
+                   reply: bytes, delay: float) -> None:
+    recorder = __recorder
+    if recorder is None:
+        return
+    recorder.record({
+        "t": t,
+        "type": "request",
+        "route": route,
+        "path": path,
+        "remote": remote_addr,
+        "body": body.decode("utf-8", "replace"),
+        "status": status,
+        "reply": reply.decode("utf-8", "replace"),
+        "delay": delay,
+    })
+
+
+def record_callback(t: float, url: str, params: Dict[str, Any], outcome: str, duration: float) -> None:
+    recorder = __recorder
+    if recorder is None:
+        return
+    recorder.record({
+        "t": t,
+        "type": "callback",
+        "url": url,
+        "params": params,
+        "outcome": outcome,
+        "duration": duration,
+    })
+
+
+def stats() -> Dict[str, Any]:
+    recorder = __recorder
+    return recorder.stats() if recorder is not None else {"enabled": False}
@@ -0,0 +1,242 @@
+"""
+Feeds a WCS trace recorded with server.trace back into this build, in process, and reports every reply that
+differs from the recorded one and every RMS callback that was recorded but not sent again, or the other way round.
+
+    python replay.py wcs-trace.jsonl --speed max
+    python replay.py wcs-trace.jsonl --speed 10 --out replay-trace.jsonl --json report.json
+
+Requests run one at a time in the order they were received, on a virtual clock set to each request's recorded
+time: the gaps between requests are slept divided by --speed (not at all with max), while callback delays, retry
+backoff and the outbound busy window run on the virtual clock, and scenario reply delays are reported instead of
+waited out. Callbacks are delivered to a stand-in RMS on localhost, whatever host the recorded requests came from.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import yaml
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = "config/service.yaml"
+# how many differing replies the report shows in full
+MAX_SHOWN = 20
+
+
+def read_trace(path: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """The request and callback records of a trace, each in time order. Pre-forked workers interleave batches."""
+    requests, callbacks = [], []
+    with open(path, "r", encoding="utf-8") as trace_file:
+        for line_no, line in enumerate(trace_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("skipping unreadable trace line %s", line_no)
+                continue
+            if record.get("type") == "request":
+                requests.append(record)
+            elif record.get("type") == "callback":
+                callbacks.append(record)
+    requests.sort(key=lambda r: r["t"])
+    callbacks.sort(key=lambda r: r["t"])
+    return requests, callbacks
+
+
+class _Arrivals:
+    """Callbacks received by the stand-in RMS."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.received: List[Tuple[str, Any]] = []
+
+    def add(self, path: str, params: Any) -> None:
+        with self._lock:
+            self.received.append((path, params))
+
+    def on_callback(self, path: str, body: bytes, accepted: bool) -> None:
+        try:
+            self.add(path, json.loads(body))
+        except ValueError:
+            self.add(path, body.decode("utf-8", "replace"))
+
+
+def _configure(rms_port: int, out: Optional[str], scenario_name: Optional[str]) -> None:
+    import codec
+    import logger
+    import recorder
+    import scenario
+    from config.rms import RMSConfig, set_rms_config
+    from config.server import ServerConfig, set_server_config
+
+    logger.set_level(logging.WARNING)
+    with open(CONFIG_PATH, "r") as yaml_file:
+        conf = yaml.safe_load(yaml_file)
+    rms_conf = conf["rms"]
+    rms_conf["port"] = rms_port
+    # a replay must not add the recorded callbacks to the journal of the instance that recorded them
+    rms_conf["journal"]["enabled"] = False
+    server_conf = conf["server"]
+    server_conf["trace"] = {**server_conf.get("trace", {}), "enabled": out is not None, "path": out or ""}
+    server = ServerConfig(**server_conf)
+    set_server_config(server)
+    set_rms_config(RMSConfig(**rms_conf))
+    codec.set_codec(server.json_codec)
+    if scenario_name:
+        scenario.load(server.scenario_file)
+        scenario.activate(scenario_name)
+    if out is not None:
+        recorder.configure(server.trace)
+
+
+def _same(recorded: str, replayed: str) -> bool:
+    """Replies are compared as JSON, so builds with a different json_codec still match."""
+    if recorded == replayed:
+        return True
+    try:
+        return json.loads(recorded) == json.loads(replayed)
+    except ValueError:
+        return False
+
+
+def _callback_key(path: str, params: Any) -> str:
+    return path + " " + json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+def replay(requests: List[Dict[str, Any]], speed: Optional[float]) -> Iterator[Dict[str, Any]]:
+    """Dispatch every request on a virtual clock, yield a diff for each reply that isn't the recorded one."""
+    import clock
+    import controller
+    import rms
+
+    handlers = {handler.__name__: handler for methods in controller.get_routes().values()
+                for handler in methods.values()}
+    virtual = clock.VirtualClock(requests[0]["t"])
+    clock.set_clock(virtual)
+    for record in requests:
+        gap = record["t"] - virtual.time()
+        if speed is not None and gap > 0:
+            time.sleep(gap / speed)
+        virtual.advance_to(record["t"])
+        # callbacks that came due in the meantime run before the request, as they did when it was recorded
+        rms.get_scheduler().wait_idle()
+        handler = handlers.get(record["route"])
+        if handler is None:
+            yield {"route": record["route"], "t": record["t"], "error": "route not in this build"}
+            continue
+        reply = controller.dispatch(handler, record["body"].encode("utf-8"), "127.0.0.1")
+        body = reply.body.decode("utf-8", "replace")
+        if reply.status != record["status"] or not _same(record["reply"], body):
+            yield {
+                "route": record["route"],
+                "t": record["t"],
+                "body": record["body"],
+                "recorded": {"status": record["status"], "reply": record["reply"]},
+                "replayed": {"status": reply.status, "reply": body},
+            }
+
+
+def _drain_callbacks(timeout: float) -> bool:
+    """Advance the virtual clock until no callback is pending, for at most timeout simulated seconds."""
+    import clock
+    import rms
+
+    virtual = clock.get_clock()
+    waited = 0.0
+    while len(rms.get_registry()) and waited < timeout:
+        virtual.advance(1)
+        waited += 1
+        rms.get_scheduler().wait_idle()
+    return not len(rms.get_registry())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="trace file recorded with server.trace")
+    parser.add_argument("--speed", default="max",
+                        help="replay speed relative to the recording, a factor such as 1 or 10, or max (default)")
+    parser.add_argument("--out", help="record the replay itself to this trace file")
+    parser.add_argument("--scenario", help="activate this scenario from server.scenario_file while replaying")
+    parser.add_argument("--callback-timeout", type=float, default=3600,
+                        help="simulated seconds to run the callbacks still pending after the last request")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+    speed = None if args.speed == "max" else float(args.speed)
+    if speed is not None and speed <= 0:
+        parser.error("--speed must be positive or max")
+
+    trace_path = os.path.abspath(args.trace)
+    out = os.path.abspath(args.out) if args.out else None
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    requests, recorded_callbacks = read_trace(trace_path)
+    if not requests:
+        print(f"no requests in {trace_path}")
+        return
+    arrivals = _Arrivals()
+    from bench.stub import start_rms
+
+    server = start_rms(arrivals.on_callback)
+    _configure(server.server_address[1], out, args.scenario)
+
+    start = time.perf_counter()
+    diffs = list(replay(requests, speed))
+    replayed_seconds = time.perf_counter() - start
+    drained = _drain_callbacks(args.callback_timeout)
+    server.shutdown()
+    if out is not None:
+        import recorder
+
+        recorder.close()
+
+    # every callback the recording instance delivered, against what reached the stand-in during the replay
+    expected = Counter(_callback_key(urlsplit(c["url"]).path, c["params"])
+                       for c in recorded_callbacks if c["outcome"] == "ok")
+    received = Counter(_callback_key(path, params) for path, params in arrivals.received)
+    by_route: Dict[str, int] = defaultdict(int)
+    for diff in diffs:
+        by_route[diff["route"]] += 1
+    span = requests[-1]["t"] - requests[0]["t"]
+    report = {
+        "requests": len(requests),
+        "mismatched": len(diffs),
+        "mismatched_by_route": dict(by_route),
+        "recorded_seconds": span,
+        "replay_seconds": replayed_seconds,
+        "speedup": span / replayed_seconds if replayed_seconds else None,
+        "callbacks_recorded": sum(expected.values()),
+        "callbacks_replayed": sum(received.values()),
+        "callbacks_missing": sorted((expected - received).elements()),
+        "callbacks_unexpected": sorted((received - expected).elements()),
+        "callbacks_drained": drained,
+        "diffs": diffs[:MAX_SHOWN],
+    }
+    print(f"requests: {report['requests']}, mismatched: {report['mismatched']}, recorded: {span:.1f}s, "
+          f"replayed in: {replayed_seconds:.2f}s")
+    for route, count in sorted(by_route.items()):
+        print(f"  {route}: {count} mismatched")
+    for diff in diffs[:MAX_SHOWN]:
+        print(f"  {json.dumps(diff, ensure_ascii=False)}")
+    print(f"callbacks recorded: {report['callbacks_recorded']}, replayed: {report['callbacks_replayed']}, "
+          f"missing: {len(report['callbacks_missing'])}, unexpected: {len(report['callbacks_unexpected'])}")
+    if not drained:
+        print(f"callbacks still pending after {args.callback_timeout}s")
+    if json_path:
+        with open(json_path, "w") as json_file:
+            json.dump(report, json_file, indent=2, ensure_ascii=False)
+    if diffs or report["callbacks_missing"] or report["callbacks_unexpected"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
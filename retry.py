@@ -0,0 +1,120 @@
+import itertools
+import random
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional
+
+from clock import get_clock
+from config.rms import RetryConfig
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter, bounded by a max number of attempts and a global retry token budget.
+    """
+
+    def __init__(self, conf: RetryConfig):
+        self._conf = conf
+        self._budget = RetryBudget(conf.budget, conf.budget_per_second)
+
+    @property
+    def budget(self) -> "RetryBudget":
+        return self._budget
+
+    def backoff(self, attempt: int, conf: Optional[RetryConfig] = None) -> float:
+        conf = conf or self._conf
+        delay = min(conf.max_delay, conf.base_delay * conf.multiplier ** (attempt - 1))
+        # jitter 0 keeps the plain exponential delay, jitter 1 spreads retries over [0, delay]
+        return delay * (1 - conf.jitter * random.random())
+
+    def next_delay(self, attempt: int, conf: Optional[RetryConfig] = None) -> Optional[float]:
+        """
+        Return the delay before retrying the given failed attempt, or None if the callback is exhausted. conf
+        overrides the backoff and attempt limits, the budget is always this policy's.
+        """
+        conf = conf or self._conf
+        if attempt >= conf.max_attempts:
+            return None
+        if not self._budget.acquire():
+            return None
+        return self.backoff(attempt, conf)
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every callback, so an RMS outage can't turn into an unbounded retry storm.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self._capacity = capacity
+        self._refill = refill_per_second
+        self._tokens = capacity
+        # refills on the clock current at creation, so a budget created under a virtual clock refills in virtual time
+        self._clock = get_clock()
+        self._updated = self._clock.monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            now = self._clock.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._refill)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def tokens(self) -> float:
+        with self._lock:
+            elapsed = self._clock.monotonic() - self._updated
+            return min(self._capacity, self._tokens + elapsed * self._refill)
+
+
+class DeadLetterStore:
+    """
+    Bounded store of callbacks that exhausted their retries, kept until they are replayed.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self._capacity = capacity
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._dropped = 0
+        self._lock = Lock()
+
+    def add(self, url: str, params: Dict[str, str], attempts: int, reason: str, site: Optional[str] = None) -> int:
+        """site is the server.sites entry whose rms config the callback ran with, None for the top-level one."""
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "url": url,
+                "params": params,
+                "attempts": attempts,
+                "reason": reason,
+                "site": site,
+                "time": get_clock().time(),
+            }
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+                self._dropped += 1
+            return entry_id
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def pop(self, ids: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            if ids is None:
+                entries = list(self._entries.values())
+                self._entries.clear()
+                return entries
+            return [self._entries.pop(i) for i in ids if i in self._entries]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
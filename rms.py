@@ -1,39 +1,399 @@
+import atexit
 import json
 import time
-from threading import Thread
-from typing import Dict
-
-import requests
+import uuid
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
 
+import clock
 import logger
-from config.rms import get_rms_config
-
-
-def submit_delay_callback(delay: int, callback_url: str, callback_params: Dict[str, str]):
-    th = Thread(target=__delay_callback, args=(delay, callback_url, callback_params), daemon=True)
-    th.start()
-
-
-def __delay_callback(delay: int, callback_url: str, callback_params: Dict[str, str]):
-    while True:
-        try:
-            time.sleep(delay)
-            if __request_rms(callback_url, callback_params):
-                return
-        except Exception:
-            logger.exception(f"delay callback error, delay: {delay}, callback_url: {callback_url}, "
-                             f"callback_params: {callback_params}")
-
-
-def __request_rms(url: str, params: Dict[str, str]) -> bool:
-    logger.info(f"request RMS, url: {url}, params: {params}")
-    conf = get_rms_config()
-    resp = requests.post(url=url, data=json.dumps(params), headers={"Content-Type": "application/json"},
-                         timeout=conf.request.timeout)
-    if resp.ok:
-        logger.info(f"request RMS succeed, url: {url}, params: {params}, resp: {resp.text}")
-        resp_content = json.loads(resp.text)
-        if resp_content.get("code") == 0:
-            return True
-    logger.error(f"request RMS error, url: {url}, params: {json.dumps(params)}, resp: {resp.text}")
-    return False
+import metrics
+import recorder
+from batcher import CallbackBatcher, open_batcher
+from callback_registry import CallbackRegistry, PendingCallback
+from config.rms import RMSConfig, get_rms_config
+from journal import CallbackJournal, open_journal
+from retry import DeadLetterStore, RetryPolicy
+from scheduler import CallbackScheduler
+
+if TYPE_CHECKING:
+    # imported with requests on the first callback, starting up doesn't need them
+    from rms_client import RMSClient
+
+__scheduler: Optional[CallbackScheduler] = None
+__scheduler_lock = Lock()
+__client: Optional["RMSClient"] = None
+__client_lock = Lock()
+__retry_policy: Optional[RetryPolicy] = None
+__dead_letters: Optional[DeadLetterStore] = None
+__retry_lock = Lock()
+__journal: Optional[CallbackJournal] = None
+__journal_opened = False
+__journal_lock = Lock()
+__batcher: Optional[CallbackBatcher] = None
+__batcher_opened = False
+__batcher_lock = Lock()
+__registry: Optional[CallbackRegistry] = None
+__registry_lock = Lock()
+
+
+def get_scheduler() -> CallbackScheduler:
+    global __scheduler
+    if __scheduler is None:
+        with __scheduler_lock:
+            if __scheduler is None:
+                scheduler = CallbackScheduler(workers=get_rms_config().request.workers, name="rms-callback")
+                scheduler.start()
+                __scheduler = scheduler
+    return __scheduler
+
+
+def set_scheduler(scheduler: CallbackScheduler) -> None:
+    global __scheduler
+    with __scheduler_lock:
+        if __scheduler is not None:
+            __scheduler.stop()
+            scheduler.adopt(__scheduler)
+        scheduler.start()
+        __scheduler = scheduler
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    return get_scheduler().stats()
+
+
+def get_client() -> "RMSClient":
+    global __client
+    if __client is None:
+        with __client_lock:
+            if __client is None:
+                from rms_client import RMSClient
+
+                __client = RMSClient(get_rms_config().request)
+    return __client
+
+
+def client_stats() -> Dict[str, Any]:
+    return get_client().stats()
+
+
+def get_retry_policy() -> RetryPolicy:
+    global __retry_policy
+    if __retry_policy is None:
+        with __retry_lock:
+            if __retry_policy is None:
+                __retry_policy = RetryPolicy(get_rms_config().retry)
+    return __retry_policy
+
+
+def get_dead_letters() -> DeadLetterStore:
+    global __dead_letters
+    if __dead_letters is None:
+        with __retry_lock:
+            if __dead_letters is None:
+                __dead_letters = DeadLetterStore(get_rms_config().retry.dead_letter_capacity)
+    return __dead_letters
+
+
+def dead_letter_stats() -> Dict[str, Any]:
+    dead_letters = get_dead_letters()
+    return {
+        "entries": dead_letters.list(),
+        "dropped": dead_letters.dropped,
+        "retry_tokens": get_retry_policy().budget.tokens(),
+    }
+
+
+def replay_dead_letters(ids: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+    """Submit the dead letters again, each with the current config of the site it was submitted for."""
+    entries = get_dead_letters().pop(ids)
+    for entry in entries:
+        logger.info("replay dead letter callback: %s", entry)
+        submit_delay_callback(0, entry["url"], entry["params"], get_rms_config(entry["site"]))
+    return entries
+
+
+def get_journal() -> Optional[CallbackJournal]:
+    global __journal, __journal_opened
+    if not __journal_opened:
+        with __journal_lock:
+            if not __journal_opened:
+                __journal = open_journal(get_rms_config().journal)
+                if __journal is not None:
+                    atexit.register(__journal.close)
+                __journal_opened = True
+    return __journal
+
+
+def get_batcher() -> Optional[CallbackBatcher]:
+    global __batcher, __batcher_opened
+    if not __batcher_opened:
+        with __batcher_lock:
+            if not __batcher_opened:
+                __batcher = open_batcher(get_rms_config().batch, get_scheduler, __delay_callback)
+                __batcher_opened = True
+    return __batcher
+
+
+def batcher_stats() -> Dict[str, Any]:
+    batcher = get_batcher()
+    return batcher.stats() if batcher is not None else {"enabled": False}
+
+
+def get_registry() -> CallbackRegistry:
+    global __registry
+    if __registry is None:
+        with __registry_lock:
+            if __registry is None:
+                __registry = CallbackRegistry()
+    return __registry
+
+
+def list_callbacks(offset: int = 0, limit: int = 100, **filters: Any) -> Dict[str, Any]:
+    total, entries = get_registry().page(offset, limit, **filters)
+    return {"total": total, "offset": offset, "entries": [entry.to_dict() for entry in entries]}
+
+
+def cancel_callbacks(**filters: Any) -> List[str]:
+    """Drop the matching callbacks. One already posting finishes that attempt but isn't retried."""
+    registry = get_registry()
+    journal = get_journal()
+    cancelled = []
+    for entry in registry.select(**filters):
+        if registry.remove(entry.id) is None:
+            continue
+        get_scheduler().cancel(entry.scheduled)
+        if journal is not None:
+            journal.record_done(entry.id)
+        cancelled.append(entry.id)
+    logger.info("cancelled %s pending callbacks, filters: %s", len(cancelled), filters)
+    return cancelled
+
+
+def fire_callbacks(**filters: Any) -> List[str]:
+    """Run the matching callbacks now instead of at their due time."""
+    return __reschedule(lambda entry, now: now, filters)
+
+
+def shift_callbacks(seconds: float, **filters: Any) -> List[str]:
+    """Move the due time of the matching callbacks by seconds, earlier for negative seconds, but not into the past."""
+    return __reschedule(lambda entry, now: max(entry.due + seconds, now), filters)
+
+
+def __reschedule(new_due: Callable[[PendingCallback, float], float], filters: Dict[str, Any]) -> List[str]:
+    registry = get_registry()
+    scheduler = get_scheduler()
+    journal = get_journal()
+    rescheduled = []
+    for entry in registry.select(**filters):
+        if entry.running:
+            continue
+        now = clock.get_clock().time()
+        due = new_due(entry, now)
+        token = registry.reschedule(entry.id, due)
+        if token is None:
+            continue
+        # straight to the scheduler, a batch still holding the callback now carries a superseded token
+        __submit(scheduler, due - now, entry.url, entry.params, entry.attempt, entry.id, entry.conf, token)
+        if journal is not None:
+            journal.record_scheduled(entry.id, due, entry.url, entry.params, entry.attempt, entry.conf.site)
+        rescheduled.append(entry.id)
+    return rescheduled
+
+
+def replay_journal(journal: Optional[CallbackJournal] = None) -> int:
+    """
+    Reschedule every callback journal (the configured one by default) has pending from a previous run, keeping its
+    due time. Each runs with the current config of the site it was submitted for, the top-level one for a site
+    that isn't configured anymore.
+    """
+    journal = journal or get_journal()
+    if journal is None:
+        return 0
+    now = clock.get_clock().time()
+    entries = journal.pending()
+    for entry in entries:
+        __schedule(max(entry["due"] - now, 0), entry["url"], entry["params"], entry["attempt"], entry["id"],
+                   get_rms_config(entry["site"]))
+    logger.info("replayed %s pending callbacks from the journal", len(entries))
+    return len(entries)
+
+
+def submit_delay_callback(delay: float, callback_url: str, callback_params: Dict[str, str],
+                          conf: Optional[RMSConfig] = None):
+    """
+    Post callback_params to callback_url after delay seconds, retrying on failure. Every attempt runs with conf, the
+    config snapshot current when it was submitted, even if the config is reloaded in between.
+    """
+    callback_id = uuid.uuid4().hex
+    conf = conf or get_rms_config()
+    if not __schedule(delay, callback_url, callback_params, 1, callback_id, conf):
+        return
+    journal = get_journal()
+    if journal is not None:
+        journal.record_scheduled(callback_id, clock.get_clock().time() + delay, callback_url, callback_params, 1,
+                                 conf.site)
+
+
+def __schedule(delay: float, callback_url: str, callback_params: Dict[str, str], attempt: int,
+               callback_id: str, conf: RMSConfig) -> bool:
+    """Schedule a callback attempt, through the batching stage if enabled. False if it was a duplicate."""
+    registry = get_registry()
+    due = clock.get_clock().time() + delay
+    token = registry.reschedule(callback_id, due, attempt)
+    if token is None:
+        token = registry.add(callback_id, callback_url, callback_params, attempt, due, conf).token
+    batcher = get_batcher()
+    if batcher is not None:
+        if not batcher.submit(delay, callback_url, callback_params, attempt, callback_id, conf, token):
+            registry.remove(callback_id)
+            return False
+        return True
+    __submit(get_scheduler(), delay, callback_url, callback_params, attempt, callback_id, conf, token)
+    return True
+
+
+def __submit(scheduler: CallbackScheduler, delay: float, callback_url: str, callback_params: Dict[str, str],
+             attempt: int, callback_id: str, conf: RMSConfig, token: int) -> None:
+    handle = scheduler.submit(delay, __delay_callback, callback_url, callback_params, attempt, callback_id, conf,
+                              token)
+    # the entry of the attempt this one supersedes would only find its token stale, drop it from the scheduler
+    scheduler.cancel(get_registry().set_scheduled(callback_id, token, handle))
+
+
+@logger.timed("rms_callback")
+def __delay_callback(callback_url: str, callback_params: Dict[str, str], attempt: int, callback_id: str,
+                     conf: RMSConfig, token: int):
+    if get_registry().claim(callback_id, token) is None:
+        # cancelled, or fired/shifted through the admin API and scheduled again under a new token
+        return
+    site_token = logger.set_site(conf.site or "")
+    try:
+        __run_callback(callback_url, callback_params, attempt, callback_id, conf)
+    finally:
+        logger.reset_site(site_token)
+
+
+def __run_callback(callback_url: str, callback_params: Dict[str, str], attempt: int, callback_id: str,
+                   conf: RMSConfig) -> None:
+    reason = "rms rejected"
+    try:
+        if __request_rms(callback_url, callback_params, conf):
+            __complete(callback_id)
+            return
+    except Exception as e:
+        reason = repr(e)
+        logger.exception("delay callback error, attempt: %s, callback_url: %s, callback_params: %s",
+                         attempt, callback_url, callback_params)
+    if get_registry().get(callback_id) is None:
+        logger.info("delay callback cancelled while running, callback_url: %s, callback_params: %s",
+                    callback_url, callback_params)
+        return
+    delay = get_retry_policy().next_delay(attempt, conf.retry)
+    if delay is None:
+        metrics.rms_dead_letters_total.inc()
+        entry_id = get_dead_letters().add(callback_url, callback_params, attempt, reason, conf.site)
+        __complete(callback_id)
+        logger.error("delay callback exhausted, dead letter id: %s, attempts: %s, callback_url: %s, "
+                     "callback_params: %s", entry_id, attempt, callback_url, callback_params)
+        return
+    metrics.rms_retries_total.inc()
+    if not __schedule(delay, callback_url, callback_params, attempt + 1, callback_id, conf):
+        # an identical callback is already pending, it delivers the same notification
+        __complete(callback_id)
+        return
+    journal = get_journal()
+    if journal is not None:
+        journal.record_scheduled(callback_id, clock.get_clock().time() + delay, callback_url, callback_params,
+                                 attempt + 1, conf.site)
+
+
+def __complete(callback_id: str) -> None:
+    get_registry().remove(callback_id)
+    journal = get_journal()
+    if journal is not None:
+        journal.record_done(callback_id)
+
+
+def __request_rms(url: str, params: Dict[str, str], conf: RMSConfig) -> bool:
+    logger.info("request RMS, url: %s, params: %s", url, params)
+    sent = clock.get_clock().time()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with logger.timing("rms_post"):
+            timeout = (conf.request.connect_timeout, conf.request.read_timeout)
+            resp = get_client().post(url, json.dumps(params), timeout)
+        outcome = "rejected"
+        if resp.ok:
+            text = resp.text
+            logger.info("request RMS succeed, url: %s, params: %s, resp: %s", url, params, text)
+            resp_content = json.loads(text)
+            if resp_content.get("code") == 0:
+                outcome = "ok"
+                return True
+        logger.error("request RMS error, url: %s, params: %s, resp: %s", url, logger.lazy(json.dumps, params),
+                     logger.lazy(getattr, resp, "text"))
+        return False
+    finally:
+        duration = time.perf_counter() - start
+        metrics.rms_post_duration.observe(duration, conf.site or "", outcome)
+        metrics.rms_posts_total.inc(conf.site or "", outcome)
+        recorder.record_callback(sent, url, params, outcome, duration)
+
+
+def apply_config(old: RMSConfig, new: RMSConfig) -> None:
+    """
+    Bring the shared RMS machinery in line with a reloaded config. Callbacks already scheduled keep the snapshot
+    they were submitted with; only the connection pool, the scheduler workers and the retry budget are shared.
+    """
+    global __client, __retry_policy
+    pool_fields = ("pool_size", "pool_hosts", "pool_block")
+    # a pool not created yet is created from the config current by then
+    if __client is not None and any(getattr(old.request, f) != getattr(new.request, f) for f in pool_fields):
+        from rms_client import RMSClient
+
+        with __client_lock:
+            # in-flight posts finish on the old pool, it is closed once they drop their references
+            __client = RMSClient(new.request)
+        logger.info("rms http pool rebuilt: %s", {f: getattr(new.request, f) for f in pool_fields})
+    if old.request.workers != new.request.workers and __scheduler is not None:
+        if type(__scheduler) is CallbackScheduler:
+            set_scheduler(CallbackScheduler(workers=new.request.workers, name="rms-callback"))
+            logger.info("rms callback scheduler resized to %s workers", new.request.workers)
+        else:
+            logger.warning("rms callback scheduler workers change takes effect after restart")
+    if (old.retry.budget, old.retry.budget_per_second) != (new.retry.budget, new.retry.budget_per_second):
+        with __retry_lock:
+            __retry_policy = RetryPolicy(new.retry)
+    for section in ("journal", "batch"):
+        if getattr(old, section) != getattr(new, section):
+            logger.warning("rms %s config change takes effect after restart", section)
+    if old.retry.dead_letter_capacity != new.retry.dead_letter_capacity:
+        logger.warning("rms dead letter capacity change takes effect after restart")
+
+
+def __collect_scheduler_gauges() -> Dict[Any, float]:
+    if __scheduler is None:
+        return {}
+    stats = __scheduler.stats()
+    return {(key,): stats[key] for key in ("pending", "running", "overdue", "last_lag", "max_lag")}
+
+
+def __collect_pool_gauges() -> Dict[Any, float]:
+    if __client is None:
+        return {}
+    stats = __client.stats()
+    return {("hits",): stats["hits"], ("misses",): stats["misses"]}
+
+
+metrics.REGISTRY.gauge("rms_callback_scheduler", "Delayed RMS callback scheduler state (pending callbacks, lag).",
+                       __collect_scheduler_gauges, ("stat",))
+metrics.REGISTRY.gauge("rms_http_pool_requests", "RMS HTTP pool hits and misses.", __collect_pool_gauges, ("result",))
+metrics.REGISTRY.gauge("rms_callback_batches", "RMS callback batching (batches sent, callbacks batched, POSTs saved).",
+                       lambda: {(key,): __batcher.stats()[key] for key in ("batches", "batched", "posts_saved")}
+                       if __batcher is not None else {}, ("stat",))
+metrics.REGISTRY.gauge("rms_pending_callbacks", "RMS callbacks submitted and not yet completed.",
+                       lambda: {(): len(__registry)} if __registry is not None else {})
+metrics.REGISTRY.gauge("rms_dead_letters", "RMS callbacks waiting in the dead-letter store.",
+                       lambda: {(): len(__dead_letters)} if __dead_letters is not None else {})
@@ -0,0 +1,68 @@
+import os
+import weakref
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.rms import RequestConfig
+
+
+class RMSClient:
+    """
+    Shared HTTP client for RMS callbacks, keeping a pool of keep-alive connections per RMS host.
+    """
+
+    def __init__(self, conf: RequestConfig):
+        self._conf = conf
+        self._timeout = (conf.connect_timeout, conf.read_timeout)
+        self._lock = Lock()
+        self._connect()
+        # pooled sockets must not be shared with a forked worker, give it fresh pools
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._connect())
+
+    def _connect(self) -> None:
+        conf = self._conf
+        # pool_connections is the number of per-host pools kept alive, pool_maxsize caps connections per host
+        self._adapter = HTTPAdapter(
+            pool_connections=conf.pool_hosts,
+            pool_maxsize=conf.pool_size,
+            pool_block=conf.pool_block,
+            max_retries=0,
+        )
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+
+    def post(self, url: str, data: str, timeout: Optional[Tuple[float, float]] = None) -> requests.Response:
+        return self._session.post(url=url, data=data, headers={"Content-Type": "application/json"},
+                                  timeout=timeout or self._timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        hosts = {}
+        requests_total = 0
+        connections_total = 0
+        with self._lock:
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_total += pool.num_requests
+                connections_total += pool.num_connections
+                hosts[f"{pool.host}:{pool.port}"] = {
+                    "requests": pool.num_requests,
+                    "connections": pool.num_connections,
+                }
+        return {
+            "hosts": hosts,
+            "requests": requests_total,
+            # every new connection is a pool miss, every other request reused a pooled connection
+            "hits": requests_total - connections_total,
+            "misses": connections_total,
+        }
+
+    def close(self) -> None:
+        self._session.close()
@@ -0,0 +1,236 @@
+import itertools
+import math
+import os
+import random
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import codec
+import logger
+from clock import get_clock
+from config import load_yaml
+from config.scenario import (
+    BusyWindowConfig,
+    DistributionConfig,
+    RouteRuleConfig,
+    ScenarioConfig,
+    ScenariosConfig,
+    StationRuleConfig,
+)
+
+# (status, body) answered instead of running the handler
+InjectedError = Tuple[int, bytes]
+# most outcomes of one Chance drawn up front
+MAX_CHANCE_DRAWS = 65536
+
+
+class Sampler:
+    """Pre-drawn samples of a distribution, handed out in a cycle."""
+
+    __slots__ = ("_next",)
+
+    def __init__(self, conf: DistributionConfig, count: int, rng: random.Random):
+        if conf.kind == "constant":
+            self._next = itertools.repeat(max(conf.value, 0.0)).__next__
+            return
+        draw = {
+            "uniform": lambda: rng.uniform(conf.low, conf.high),
+            "normal": lambda: rng.gauss(conf.mean, conf.stddev),
+            "lognormal": lambda: rng.lognormvariate(conf.mean, conf.stddev),
+            "exponential": lambda: rng.expovariate(1 / conf.mean) if conf.mean > 0 else 0.0,
+        }[conf.kind]
+        self._next = itertools.cycle([max(draw(), 0.0) for _ in range(count)]).__next__
+
+    def __call__(self) -> float:
+        return self._next()
+
+
+class Chance:
+    """
+    Pre-drawn outcomes of an event happening with probability rate. An event too rare for its outcomes to fit in
+    MAX_CHANCE_DRAWS is pre-drawn as the gaps between its occurrences instead.
+    """
+
+    __slots__ = ("_next",)
+
+    def __init__(self, rate: float, count: int, rng: random.Random):
+        if rate <= 0 or rate >= 1:
+            self._next = itertools.repeat(rate >= 1).__next__
+            return
+        # enough draws that the realised rate is close to the configured one even for small rates
+        draws = max(count, math.ceil(100 / rate))
+        if draws <= max(count, MAX_CHANCE_DRAWS):
+            self._next = itertools.cycle([rng.random() < rate for _ in range(draws)]).__next__
+            return
+        # misses before each hit follow a geometric distribution
+        gaps = [int(math.log(1 - rng.random()) / math.log1p(-rate)) for _ in range(min(count, MAX_CHANCE_DRAWS))]
+        self._next = _occurrences(gaps).__next__
+
+    def __call__(self) -> bool:
+        return self._next()
+
+
+def _occurrences(gaps: List[int]) -> Iterator[bool]:
+    for gap in itertools.cycle(gaps):
+        yield from itertools.repeat(False, gap)
+        yield True
+
+
+class _Rule:
+    __slots__ = ("latency", "error", "error_reply")
+
+    def __init__(self, conf: RouteRuleConfig, count: int, rng: random.Random):
+        self.latency = Sampler(conf.latency, count, rng) if conf.latency is not None else None
+        self.error = Chance(conf.error_rate, count, rng) if conf.error_rate > 0 else None
+        self.error_reply: InjectedError = (conf.error_status, codec.dumps_response({"code": 1, "msg": conf.error_msg}))
+
+
+class _StationRule(_Rule):
+    __slots__ = ("busy", "full", "callback_delay")
+
+    def __init__(self, conf: StationRuleConfig, count: int, rng: random.Random):
+        super().__init__(conf, count, rng)
+        self.busy: List[BusyWindowConfig] = list(conf.busy)
+        self.full = Chance(conf.full_rate, count, rng) if conf.full_rate is not None else None
+        self.callback_delay = Sampler(conf.callback_delay, count, rng) if conf.callback_delay is not None else None
+
+
+class Scenario:
+    """
+    Per-route and per-station injected latency, errors, busy windows and callback delays, so slow PLC and flaky
+    station conditions can be reproduced against RMS.
+
+    Every random quantity is drawn up front into a fixed array when the scenario is built and then read in a
+    cycle, so injecting faults costs an index increment per request instead of an RNG call. Swapping scenarios
+    replaces one module reference; requests already running finish with the scenario they started with. With
+    pre-forked workers a swap only reaches the worker that received it.
+    """
+
+    def __init__(self, name: str, conf: ScenarioConfig):
+        rng = random.Random(conf.seed)
+        count = max(conf.samples, 1)
+        self.name = name
+        self.conf = conf
+        self._clock = get_clock()
+        self._started = self._clock.monotonic()
+        self._default = _Rule(conf.default, count, rng)
+        self._routes = {route: _Rule(rule, count, rng) for route, rule in conf.routes.items()}
+        self._stations = {station: _StationRule(rule, count, rng) for station, rule in conf.stations.items()}
+        self._callback_delay = Sampler(conf.callback_delay, count, rng) if conf.callback_delay is not None else None
+        self.injected_errors = 0
+        self.injected_latency = 0.0
+
+    def apply(self, route: str, station_id: Any) -> Tuple[float, Optional[InjectedError]]:
+        """Latency to add to the response and the error to answer instead of running the route, if any."""
+        rule = self._routes.get(route, self._default)
+        station = self._stations.get(station_id) if station_id is not None else None
+        delay = rule.latency() if rule.latency is not None else 0.0
+        if station is not None and station.latency is not None:
+            delay += station.latency()
+        self.injected_latency += delay
+        if station is not None and station.error is not None and station.error():
+            self.injected_errors += 1
+            return delay, station.error_reply
+        if rule.error is not None and rule.error():
+            self.injected_errors += 1
+            return delay, rule.error_reply
+        return delay, None
+
+    def station_busy(self, station_id: Any) -> bool:
+        station = self._stations.get(station_id)
+        if station is None or not station.busy:
+            return False
+        elapsed = self._clock.monotonic() - self._started
+        for window in station.busy:
+            since = elapsed - window.offset
+            if since >= 0 and since % window.every < window.duration:
+                return True
+        return False
+
+    def station_full(self, station_id: Any) -> bool:
+        station = self._stations.get(station_id)
+        if station is not None and self.station_busy(station_id):
+            return True
+        if station is None or station.full is None:
+            return True
+        return station.full()
+
+    def callback_delay(self, station_id: Any, default: float) -> float:
+        station = self._stations.get(station_id)
+        if station is not None and station.callback_delay is not None:
+            return station.callback_delay()
+        if self._callback_delay is not None:
+            return self._callback_delay()
+        return default
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "active_seconds": self._clock.monotonic() - self._started,
+            "injected_errors": self.injected_errors,
+            "injected_latency": self.injected_latency,
+        }
+
+
+__scenarios: Dict[str, ScenarioConfig] = {}
+__path: Optional[str] = None
+__active: Optional[Scenario] = None
+__lock = Lock()
+
+
+def get_active() -> Optional[Scenario]:
+    return __active
+
+
+def load(path: str) -> Optional[Scenario]:
+    """Read the scenarios defined in path and activate the one it marks active. A missing file defines none."""
+    global __path, __scenarios
+    if not os.path.exists(path):
+        logger.info("no scenario file at %s, serving without injected faults", path)
+        with __lock:
+            __path, __scenarios = path, {}
+        return None
+    conf = ScenariosConfig(**(load_yaml(path) or {}))
+    with __lock:
+        __path, __scenarios = path, dict(conf.scenarios)
+    return activate(conf.active)
+
+
+def reload() -> Optional[Scenario]:
+    """Re-read the scenario file and re-activate the active scenario from it, if it's still defined."""
+    if __path is None:
+        raise ValueError("no scenario file loaded")
+    name = __active.name if __active is not None else None
+    load(__path)
+    return activate(name if name in __scenarios else None)
+
+
+def activate(name: Optional[str]) -> Optional[Scenario]:
+    """Switch to the scenario called name, None turns injection off."""
+    global __active
+    if name is None:
+        scenario = None
+    else:
+        conf = __scenarios.get(name)
+        if conf is None:
+            raise KeyError(name)
+        scenario = Scenario(name, conf)
+    __active = scenario
+    logger.info("scenario activated: %s", name)
+    return scenario
+
+
+def install(name: str, conf: Dict[str, Any]) -> Scenario:
+    """Define (or redefine) a scenario from its config and activate it."""
+    with __lock:
+        __scenarios[name] = ScenarioConfig(**conf)
+    return activate(name)
+
+
+def stats() -> Dict[str, Any]:
+    scenario = __active
+    return {
+        "file": __path,
+        "available": sorted(__scenarios),
+        "active": scenario.stats() if scenario is not None else None,
+    }
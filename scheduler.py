@@ -0,0 +1,272 @@
+import heapq
+import itertools
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+
+import logger
+from clock import Clock, get_clock
+
+if TYPE_CHECKING:
+    # imported by the asyncio engine, a gevent process doesn't load it
+    import asyncio
+
+
+class CallbackScheduler:
+    """
+    Holds every pending delayed callback in a heap keyed by due time and drains it with a fixed pool of workers,
+    so the number of threads stays flat no matter how many callbacks are queued. A cancelled callback is only
+    marked in the heap and dropped once it reaches the top, or when cancelled ones make up half of the heap.
+    """
+
+    def __init__(self, workers: int = 4, name: str = "callback", clock: Optional[Clock] = None):
+        if workers < 1:
+            raise ValueError(f"scheduler needs at least one worker, got: {workers}")
+        self._name = name
+        # due times are on this clock; a virtual one wakes the workers whenever it is advanced
+        self._clock = clock or get_clock()
+        self._workers = workers
+        # [due, seq, fn, args], fn set to None once the entry is cancelled or popped
+        self._heap: List[List[Any]] = []
+        self._cancelled = 0
+        self._cond = Condition()
+        self._seq = itertools.count()
+        self._threads: List[Thread] = []
+        self._running = 0
+        self._stopped = False
+        self._dispatched = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        # worker threads don't survive a fork; callbacks pending at fork time stay with the parent
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork())
+        self._clock.subscribe(self._on_clock_moved)
+
+    def _after_fork(self) -> None:
+        started = bool(self._threads)
+        self._cond = Condition()
+        self._heap = []
+        self._cancelled = 0
+        self._threads = []
+        self._running = 0
+        if started:
+            self.start()
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self._workers):
+                th = Thread(target=self._work, name=f"{self._name}-{i}", daemon=True)
+                self._threads.append(th)
+                th.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for th in threads:
+            th.join(timeout)
+
+    def submit(self, delay: float, fn: Callable[..., Any], *args: Any) -> List[Any]:
+        """Run fn(*args) after delay seconds. Returns the handle cancel() takes."""
+        return self._push(self._clock.monotonic() + max(delay, 0), fn, args)
+
+    def _push(self, due: float, fn: Callable[..., Any], args: Tuple[Any, ...]) -> List[Any]:
+        entry = [due, next(self._seq), fn, args]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        self._wakeup()
+        return entry
+
+    def cancel(self, handle: Optional[List[Any]]) -> bool:
+        """Drop a callback submitted earlier, False if it already ran, is running or was cancelled."""
+        if handle is None:
+            return False
+        with self._cond:
+            if handle[2] is None:
+                return False
+            handle[2] = handle[3] = None
+            self._cancelled += 1
+            if self._cancelled * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if entry[2] is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+            # a cancelled entry may have been what wait_idle() is waiting for
+            self._cond.notify_all()
+        return True
+
+    def take_pending(self) -> List[Tuple[float, Callable[..., Any], Tuple[Any, ...]]]:
+        """Remove and return every pending callback as (monotonic due time, fn, args)."""
+        with self._cond:
+            pending = [(due, fn, args) for due, _, fn, args in sorted(self._heap) if fn is not None]
+            for entry in self._heap:
+                entry[2] = entry[3] = None
+            self._heap.clear()
+            self._cancelled = 0
+        return pending
+
+    def adopt(self, other: "CallbackScheduler") -> None:
+        """Move every callback pending in other into this scheduler, keeping their due times."""
+        offset = self._clock.monotonic() - other._clock.monotonic()
+        for due, fn, args in other.take_pending():
+            self._push(due + offset, fn, args)
+
+    def pending(self) -> int:
+        return len(self._heap) - self._cancelled
+
+    def wait_idle(self, timeout: float = 10) -> bool:
+        """
+        Block until no callback is due on the scheduler's clock and none is running, for at most timeout real
+        seconds. Returns whether it got idle. Lets a driver advancing a virtual clock wait for the callbacks it
+        made due.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._running or (self._drop_cancelled() and self._heap[0][0] <= self._clock.monotonic()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock.monotonic()
+        with self._cond:
+            overdue = now - self._heap[0][0] if self._drop_cancelled() else 0.0
+            return {
+                "workers": self._workers,
+                "pending": len(self._heap) - self._cancelled,
+                "running": self._running,
+                "dispatched": self._dispatched,
+                "overdue": max(overdue, 0.0),
+                "last_lag": self._last_lag,
+                "max_lag": self._max_lag,
+            }
+
+    def _wakeup(self) -> None:
+        pass
+
+    def _on_clock_moved(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+        self._wakeup()
+
+    def _drop_cancelled(self) -> bool:
+        """Pop cancelled entries off the top of the heap, return whether a live one is left. Must hold self._cond."""
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+            self._cancelled -= 1
+        return bool(self._heap)
+
+    def _pop_due(self) -> Tuple[Optional[Tuple[Callable[..., Any], Tuple[Any, ...]]], Optional[float]]:
+        """Pop the earliest due callback, or return how long to wait for it. Must hold self._cond."""
+        if not self._drop_cancelled():
+            return None, None
+        wait = self._heap[0][0] - self._clock.monotonic()
+        if wait > 0:
+            return None, wait
+        entry = heapq.heappop(self._heap)
+        fn, args = entry[2], entry[3]
+        entry[2] = entry[3] = None
+        lag = -wait
+        self._running += 1
+        self._dispatched += 1
+        self._last_lag = lag
+        if lag > self._max_lag:
+            self._max_lag = lag
+        return (fn, args), None
+
+    def _done(self) -> None:
+        with self._cond:
+            self._running -= 1
+            if not self._running:
+                # wakes wait_idle()
+                self._cond.notify_all()
+
+    def _run(self, fn: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("scheduled callback error, fn: %s, args: %s", fn.__name__, args)
+        finally:
+            self._done()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                entry, wait = self._pop_due()
+                if entry is None:
+                    self._cond.wait(self._clock.timeout(wait))
+                    continue
+            self._run(*entry)
+
+
+class AsyncCallbackScheduler(CallbackScheduler):
+    """
+    CallbackScheduler drained by a dispatcher task on an asyncio loop instead of worker threads. Each due callback
+    runs as a task; the blocking RMS POST inside it is handed to a small executor of `workers` threads.
+    """
+
+    def __init__(self, loop: "asyncio.AbstractEventLoop", workers: int = 4, name: str = "callback",
+                 clock: Optional[Clock] = None):
+        super().__init__(workers=workers, name=name, clock=clock)
+        self._loop = loop
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._event: Optional["asyncio.Event"] = None
+        self._dispatcher: Optional["asyncio.Task"] = None
+        self._tasks: Set["asyncio.Task"] = set()
+
+    def start(self) -> None:
+        import asyncio
+
+        if self._dispatcher is not None:
+            return
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix=self._name)
+        self._event = asyncio.Event()
+        self._dispatcher = self._loop.create_task(self._dispatch())
+
+    def stop(self, timeout: float = 5) -> None:
+        with self._cond:
+            self._stopped = True
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _wakeup(self) -> None:
+        if self._event is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def _dispatch(self) -> None:
+        import asyncio
+
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                entry, wait = self._pop_due()
+            if entry is not None:
+                task = self._loop.create_task(self._run_async(*entry))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+                continue
+            try:
+                await asyncio.wait_for(self._event.wait(), self._clock.timeout(wait))
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+
+    async def _run_async(self, fn: Callable[..., Any], args: Tuple[Any, ...]) -> None:
+        await self._loop.run_in_executor(self._executor, self._run, fn, args)
@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional, Sequence
+
+import logger
+from config.rms import RMSConfig, get_rms_config
+from config.server import SiteConfig, StationsConfig
+from station_state import StationTable
+
+
+class Site:
+    """
+    One simulated warehouse: the port it is served on, its own station table and its own RMS config. Several sites
+    share one process, and with it the serving loop, the callback scheduler and the RMS connection pool.
+    """
+
+    __slots__ = ("name", "port", "stations")
+
+    def __init__(self, name: str, port: Optional[int], stations: StationTable):
+        # "" for the single unnamed site served when server.sites is empty
+        self.name = name
+        self.port = port
+        self.stations = stations
+
+    @property
+    def rms(self) -> RMSConfig:
+        """Read on every use, so the site follows config reloads like the top-level rms section does."""
+        return get_rms_config(self.name)
+
+
+__default = Site("", None, StationTable())
+__by_port: Dict[int, Site] = {}
+__sites: List[Site] = [__default]
+
+
+def configure(port: Optional[int], stations: Optional[StationsConfig] = None, site_confs: Sequence[SiteConfig] = (),
+              shared: bool = False) -> List[Site]:
+    """
+    Build the sites to serve: one per entry of site_confs, or a single unnamed one on port with stations. With
+    shared=True the station tables live in shared memory, for pre-forked workers.
+    """
+    global __default, __by_port, __sites
+    if not site_confs:
+        served = [Site("", port, StationTable(stations, shared=shared))]
+    else:
+        ports = [conf.port for conf in site_confs]
+        if len(set(ports)) != len(ports):
+            raise ValueError(f"server.sites ports must be unique: {ports}")
+        served = [Site(conf.name, conf.port, StationTable(conf.stations, shared=shared)) for conf in site_confs]
+        _check_pool(served)
+    __default = served[0]
+    __by_port = {site.port: site for site in served if site.port is not None}
+    __sites = served
+    return served
+
+
+def _check_pool(served: List[Site]) -> None:
+    pool_hosts = get_rms_config().request.pool_hosts
+    rms_ports = {site.rms.port for site in served}
+    if len(rms_ports) > pool_hosts:
+        # callbacks go to the host that sent the request on the site's RMS port, one pool per host and port
+        logger.warning("%s sites call back on %s RMS ports but rms.request.pool_hosts is %s, pooled connections "
+                       "will be evicted", len(served), len(rms_ports), pool_hosts)
+
+
+def get_default() -> Site:
+    return __default
+
+
+def get_sites() -> List[Site]:
+    return __sites
+
+
+def by_port(port: Optional[int]) -> Site:
+    """The site served on port, the default site for a port no site is configured on."""
+    return __by_port.get(port, __default) if port is not None else __default
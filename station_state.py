@@ -0,0 +1,168 @@
+import ctypes
+import hashlib
+import multiprocessing
+import threading
+import zlib
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Tuple
+
+import clock
+import logger
+from config.server import StationsConfig
+
+STATION_ID_MAX_BYTES = 47
+# a longer station_id is stored as a prefix of it, "#" and this many hex digits of its hash
+_FINGERPRINT_BYTES = 8
+
+
+class StationState(IntEnum):
+    IDLE = 0
+    PREPARING = 1
+    DOCKING = 2
+    BUSY = 3
+    ROBOT_LEFT = 4
+
+
+# the states a station may move to from each state, besides staying in it and going back to IDLE (a mode switch, or
+# the busy window of an outbound passing); an outbound starts from IDLE, an inbound robot leaves while DOCKING
+_NEXT = {
+    StationState.IDLE: frozenset({StationState.PREPARING, StationState.BUSY}),
+    StationState.PREPARING: frozenset({StationState.DOCKING}),
+    StationState.DOCKING: frozenset({StationState.BUSY, StationState.ROBOT_LEFT}),
+    StationState.BUSY: frozenset({StationState.ROBOT_LEFT}),
+    StationState.ROBOT_LEFT: frozenset({StationState.PREPARING, StationState.BUSY}),
+}
+
+
+class _Slot(ctypes.Structure):
+    _fields_ = [
+        ("used", ctypes.c_bool),
+        ("key_len", ctypes.c_uint8),
+        ("key", ctypes.c_char * STATION_ID_MAX_BYTES),
+        ("state", ctypes.c_uint8),
+        ("since", ctypes.c_double),
+        ("busy_seconds", ctypes.c_double),
+    ]
+
+
+class StationTable:
+    """
+    Per station dock state machine (idle -> preparing -> docking -> busy -> robot left), kept in a fixed size
+    open addressing table of ctypes slots. The table is split into stripes with one lock each, a station always
+    hashes to the same stripe so lookups are O(1) and stations in different stripes never contend.
+
+    With shared=True the slots live in shared memory guarded by process locks, so every pre-forked worker created
+    after the table agrees on the state of each station. Stations that don't fit in their full stripe are kept in
+    a per-process overflow of that stripe instead, which pre-forked workers don't share.
+    """
+
+    def __init__(self, conf: Optional[StationsConfig] = None, shared: bool = False):
+        conf = conf or StationsConfig()
+        self._conf = conf
+        self._stripes = conf.stripes
+        self._stripe_size = max(1, conf.capacity // conf.stripes)
+        size = self._stripes * self._stripe_size
+        if shared:
+            ctx = multiprocessing.get_context("fork")
+            self._slots = ctx.RawArray(_Slot, size)
+            self._locks = [ctx.Lock() for _ in range(self._stripes)]
+        else:
+            self._slots = (_Slot * size)()
+            self._locks = [threading.Lock() for _ in range(self._stripes)]
+        # guarded by the lock of their stripe
+        self._overflow: List[Dict[bytes, _Slot]] = [{} for _ in range(self._stripes)]
+
+    def transition(self, station_id: str, state: StationState) -> bool:
+        """
+        Move the station to state, return False and leave it where it is if the dock state machine doesn't allow
+        that from its current state.
+        """
+        key = _key(station_id)
+        stripe, slot = self._locate(key)
+        with self._locks[stripe]:
+            entry = self._slot(stripe, slot, key, station_id)
+            current = StationState(entry.state)
+            if state == current or state == StationState.IDLE or state in _NEXT[current]:
+                entry.state = state
+                entry.since = clock.get_clock().time()
+                return True
+        logger.info("station %s can't go from %s to %s, left %s", station_id, current.name.lower(),
+                    state.name.lower(), current.name.lower())
+        return False
+
+    def check_outbound_ready(self, station_id: str) -> bool:
+        """Return whether the station can start an outbound, freeing it once its busy window has passed."""
+        key = _key(station_id)
+        stripe, slot = self._locate(key)
+        with self._locks[stripe]:
+            entry = self._slot(stripe, slot, key, station_id)
+            if entry.state == StationState.BUSY:
+                now = clock.get_clock().time()
+                if now - entry.since < entry.busy_seconds:
+                    return False
+                entry.state = StationState.IDLE
+                entry.since = now
+            return True
+
+    def get(self, station_id: str) -> Tuple[StationState, float]:
+        key = _key(station_id)
+        stripe, slot = self._locate(key)
+        with self._locks[stripe]:
+            entry = self._slot(stripe, slot, key, station_id)
+            return StationState(entry.state), entry.since
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        stations = []
+        for stripe in range(self._stripes):
+            with self._locks[stripe]:
+                base = stripe * self._stripe_size
+                for entry in self._slots[base:base + self._stripe_size] + list(self._overflow[stripe].values()):
+                    if entry.used:
+                        stations.append({
+                            "station_id": entry.key[:entry.key_len].decode("utf-8"),
+                            "state": StationState(entry.state).name.lower(),
+                            "since": entry.since,
+                            "busy_seconds": entry.busy_seconds,
+                        })
+        return stations
+
+    def _locate(self, key: bytes) -> Tuple[int, int]:
+        h = zlib.crc32(key)
+        return h % self._stripes, (h // self._stripes) % self._stripe_size
+
+    def _slot(self, stripe: int, start: int, key: bytes, station_id: Any) -> _Slot:
+        """Find or claim the slot for key by linear probing inside its stripe. Must hold the stripe lock."""
+        base = stripe * self._stripe_size
+        for i in range(self._stripe_size):
+            entry = self._slots[base + (start + i) % self._stripe_size]
+            if not entry.used:
+                self._claim(entry, key, station_id)
+                return entry
+            if entry.key_len == len(key) and entry.key[:entry.key_len] == key:
+                return entry
+        overflow = self._overflow[stripe]
+        entry = overflow.get(key)
+        if entry is None:
+            if not overflow:
+                logger.warning("station table stripe %s is full, stations past it aren't shared between workers, "
+                               "raise server.stations.capacity", stripe)
+            entry = overflow[key] = _Slot()
+            self._claim(entry, key, station_id)
+        return entry
+
+    def _claim(self, entry: _Slot, key: bytes, station_id: Any) -> None:
+        entry.used = True
+        entry.key = key
+        entry.key_len = len(key)
+        entry.state = StationState.IDLE
+        entry.since = clock.get_clock().time()
+        entry.busy_seconds = self._conf.busy_seconds.get(str(station_id), self._conf.default_busy_seconds)
+
+
+def _key(station_id: Any) -> bytes:
+    key = str(station_id).encode("utf-8")
+    if len(key) <= STATION_ID_MAX_BYTES:
+        return key
+    # cut on a character boundary so the prefix still decodes
+    prefix = key[:STATION_ID_MAX_BYTES - 2 * _FINGERPRINT_BYTES - 1].decode("utf-8", "ignore").encode("utf-8")
+    return prefix + b"#" + hashlib.blake2b(key, digest_size=_FINGERPRINT_BYTES).hexdigest().encode("ascii")
@@ -0,0 +1,69 @@
+import sqlite3
+
+import clock
+import rms
+from config.rms import JournalConfig, RequestConfig, RMSApis, RMSConfig, set_rms_config
+from journal import CallbackJournal
+from scheduler import CallbackScheduler
+
+
+def _journal(path) -> CallbackJournal:
+    return CallbackJournal(JournalConfig(enabled=True, path=str(path), commit_interval=0.01))
+
+
+def test_pending_callbacks_keep_their_site(tmp_path):
+    journal = _journal(tmp_path / "journal.db")
+    journal.record_scheduled("a", 20, "http://rms-b/ready", {"serial": "a"}, 1, "site-b")
+    journal.record_scheduled("b", 10, "http://rms/ready", {"serial": "b"}, 2)
+    journal.record_scheduled("c", 5, "http://rms/ready", {"serial": "c"}, 1, "site-b")
+    journal.record_done("c")
+    journal.close()
+    assert [(entry["id"], entry["attempt"], entry["site"]) for entry in journal.pending()] == [
+        ("b", 2, None), ("a", 1, "site-b"),
+    ]
+
+
+def test_journal_without_sites_is_upgraded(tmp_path):
+    path = tmp_path / "journal.db"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE callbacks (id TEXT PRIMARY KEY, due REAL NOT NULL, url TEXT NOT NULL, "
+                 "params TEXT NOT NULL, attempt INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("INSERT INTO callbacks (id, due, url, params, attempt) VALUES ('old', 1, 'http://rms/ready', '{}', 3)")
+    conn.commit()
+    conn.close()
+
+    journal = _journal(path)
+    journal.record_scheduled("new", 2, "http://rms-b/ready", {}, 1, "site-b")
+    journal.close()
+    assert [(entry["id"], entry["site"]) for entry in journal.pending()] == [("old", None), ("new", "site-b")]
+
+
+def test_replay_resolves_the_site_config(tmp_path):
+    apis = RMSApis(dock_ready="/dock_ready", dock_finish="/dock_finish")
+    top = RMSConfig(host="http://127.0.0.1", port=9, request=RequestConfig(workers=1), apis=apis)
+    site = RMSConfig(host="http://127.0.0.1", port=10, request=RequestConfig(workers=1), apis=apis, site="site-b")
+    previous = clock.set_clock(clock.VirtualClock())
+    set_rms_config(top, {"site-b": site})
+    rms.set_scheduler(CallbackScheduler(workers=1, name="rms-callback"))
+    try:
+        now = clock.get_clock().time()
+        journal = _journal(tmp_path / "journal.db")
+        journal.record_scheduled("site-b-callback", now + 60, "http://127.0.0.1:10/ready", {"serial": "j-1"}, 2,
+                                 "site-b")
+        journal.record_scheduled("top-callback", now + 60, "http://127.0.0.1:9/ready", {"serial": "j-2"}, 1)
+        journal.record_scheduled("gone-callback", now + 60, "http://127.0.0.1:11/ready", {"serial": "j-3"}, 1,
+                                 "site-gone")
+        journal.close()
+
+        assert rms.replay_journal(journal) == 3
+        registry = rms.get_registry()
+        assert registry.get("site-b-callback").conf is site
+        assert registry.get("site-b-callback").attempt == 2
+        assert registry.get("top-callback").conf is top
+        # a site no longer configured falls back to the top-level config
+        assert registry.get("gone-callback").conf is top
+    finally:
+        for serial in ("j-1", "j-2", "j-3"):
+            rms.cancel_callbacks(serial=serial)
+        rms.set_scheduler(CallbackScheduler(workers=1, name="rms-callback", clock=previous))
+        clock.set_clock(previous)
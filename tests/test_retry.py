@@ -0,0 +1,148 @@
+import json
+
+import pytest
+
+import clock
+import rms
+from bench.stub import start_rms
+from config.rms import RequestConfig, RetryConfig, RMSApis, RMSConfig, set_rms_config
+from retry import RetryBudget, RetryPolicy
+from scheduler import CallbackScheduler
+
+
+def test_budget_runs_out_and_refills_on_the_clock():
+    previous = clock.set_clock(clock.VirtualClock())
+    try:
+        policy = RetryPolicy(RetryConfig(max_attempts=10, budget=2, budget_per_second=0.5, jitter=0))
+        assert policy.next_delay(1) == 3
+        assert policy.next_delay(2) == 6
+        # attempts are left, retry tokens aren't
+        assert policy.next_delay(3) is None
+        assert policy.budget.tokens() == 0
+
+        clock.get_clock().advance(1)
+        assert policy.budget.tokens() == 0.5
+        assert policy.next_delay(3) is None
+        clock.get_clock().advance(1)
+        assert policy.next_delay(3) == 12
+        # the budget never holds more than its capacity
+        clock.get_clock().advance(3600)
+        assert policy.budget.tokens() == 2
+    finally:
+        clock.set_clock(previous)
+
+
+def test_no_retry_after_the_last_attempt():
+    policy = RetryPolicy(RetryConfig(max_attempts=3, jitter=0))
+    tokens = policy.budget.tokens()
+    assert policy.next_delay(2) is not None
+    assert policy.next_delay(3) is None
+    # an exhausted callback doesn't take a token
+    assert policy.budget.tokens() == pytest.approx(tokens - 1, abs=0.01)
+    budget = RetryBudget(1, 0)
+    assert budget.acquire()
+    assert not budget.acquire()
+
+
+@pytest.fixture
+def rejecting_rms():
+    """rms set up on a virtual clock against a stand-in RMS rejecting every callback, returns what it received."""
+    previous = clock.set_clock(clock.VirtualClock())
+    posts = []
+    server = start_rms(lambda path, body, accepted: posts.append(json.loads(body)), reject=1.0)
+    set_rms_config(RMSConfig(
+        host="http://127.0.0.1",
+        port=server.server_port,
+        request=RequestConfig(workers=1),
+        retry=RetryConfig(base_delay=1, multiplier=2, jitter=0, max_attempts=3),
+        apis=RMSApis(dock_ready="/dock_ready", dock_finish="/dock_finish"),
+    ))
+    rms.set_scheduler(CallbackScheduler(workers=1, name="rms-callback"))
+    try:
+        yield posts
+    finally:
+        rms.set_scheduler(CallbackScheduler(workers=1, name="rms-callback", clock=previous))
+        clock.set_clock(previous)
+        server.shutdown()
+        server.server_close()
+
+
+def _advance(seconds: float) -> None:
+    clock.get_clock().advance(seconds)
+    assert rms.get_scheduler().wait_idle(timeout=5)
+
+
+def _url(path: str) -> str:
+    conf = rms.get_rms_config()
+    return f"{conf.host}:{conf.port}{path}"
+
+
+def test_dead_lettered_after_the_last_attempt(rejecting_rms):
+    dead_letters = rms.get_dead_letters()
+    before = len(dead_letters)
+    rms.submit_delay_callback(0, _url("/dock_ready"), {"serial": "robot-dead", "station_id": "st-1"})
+    _advance(0)
+    assert len(rejecting_rms) == 1
+    # backoff of 1s, then 2s
+    _advance(0.5)
+    assert len(rejecting_rms) == 1
+    _advance(0.5)
+    assert len(rejecting_rms) == 2
+    assert len(dead_letters) == before
+    _advance(2)
+    assert len(rejecting_rms) == 3
+    assert all(post["serial"] == "robot-dead" for post in rejecting_rms)
+
+    entry = dead_letters.list()[-1]
+    assert len(dead_letters) == before + 1
+    assert (entry["params"]["serial"], entry["attempts"], entry["reason"]) == ("robot-dead", 3, "rms rejected")
+    assert not rms.get_registry().select(serial="robot-dead")
+    _advance(60)
+    assert len(rejecting_rms) == 3
+
+
+def test_replay_dead_letters(rejecting_rms):
+    dead_letters = rms.get_dead_letters()
+    rms.submit_delay_callback(0, _url("/dock_finish"), {"serial": "robot-replay", "station_id": "st-2"})
+    _advance(0)
+    _advance(1)
+    _advance(2)
+    entry_id = dead_letters.list()[-1]["id"]
+    assert len(rejecting_rms) == 3
+
+    replayed = rms.replay_dead_letters([entry_id])
+    assert [entry["id"] for entry in replayed] == [entry_id]
+    assert entry_id not in [entry["id"] for entry in dead_letters.list()]
+    assert rms.replay_dead_letters([entry_id]) == []
+
+    # replayed from the first attempt, with its full retries
+    _advance(0)
+    assert len(rejecting_rms) == 4
+    assert rms.get_registry().select(serial="robot-replay")[0].attempt == 2
+    _advance(1)
+    _advance(2)
+    assert len(rejecting_rms) == 6
+    entry = dead_letters.list()[-1]
+    assert entry["id"] != entry_id
+    assert (entry["params"]["serial"], entry["attempts"]) == ("robot-replay", 3)
+
+
+def test_replayed_dead_letter_runs_with_its_site_config(rejecting_rms):
+    top = rms.get_rms_config()
+    site = RMSConfig(host=top.host, port=top.port, request=top.request, apis=top.apis, site="site-b",
+                     retry=RetryConfig(base_delay=1, multiplier=2, jitter=0, max_attempts=2))
+    set_rms_config(top, {"site-b": site})
+    dead_letters = rms.get_dead_letters()
+    rms.submit_delay_callback(0, _url("/dock_ready"), {"serial": "robot-site-b"}, site)
+    _advance(0)
+    _advance(1)
+    entry = dead_letters.list()[-1]
+    assert (entry["params"]["serial"], entry["attempts"], entry["site"]) == ("robot-site-b", 2, "site-b")
+
+    rms.replay_dead_letters([entry["id"]])
+    _advance(0)
+    assert rms.get_registry().select(serial="robot-site-b")[0].conf is site
+    _advance(1)
+    # two attempts again, as site-b allows, not the three of the top-level config
+    assert len(rejecting_rms) == 4
+    assert dead_letters.list()[-1]["site"] == "site-b"
@@ -0,0 +1,100 @@
+import gzip
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from pythonjsonlogger import jsonlogger
+
+from logger import rotation
+from logger.rotation import RotationOptions, SizeTimedRotatingFileHandler, get_archiver, list_segments, query
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# ten seconds of log time between records, from 2026-10-17T00:00:00Z
+START = 1792195200.0
+STEP = 10
+
+
+def _record(i: int) -> logging.LogRecord:
+    record = logging.LogRecord("test-rotation", logging.INFO, __file__, 0, "station prepare request: %s.",
+                               ({"serial": f"robot-{i % 7}", "robot_type": 1, "station_id": f"st-{i % 3}"},), None)
+    record.created = START + i * STEP
+    return record
+
+
+def _write(base: str, records: int) -> SizeTimedRotatingFileHandler:
+    handler = SizeTimedRotatingFileHandler(base, RotationOptions(max_bytes=24 * 1024, backups=100), indexed=True)
+    handler.setFormatter(jsonlogger.JsonFormatter(timestamp=True, json_ensure_ascii=False))
+    for i in range(records):
+        if i == records // 2:
+            # the time boundary passes while the file is far below max_bytes
+            size = handler.stream.tell()
+            segments = len(list_segments(base))
+            handler.rolloverAt = int(time.time())
+            handler.handle(_record(i))
+            assert len(list_segments(base)) == segments + 1
+            assert 0 < size < 24 * 1024
+            continue
+        handler.handle(_record(i))
+    get_archiver().join()
+    return handler
+
+
+def _iso(t: float) -> str:
+    return datetime.fromtimestamp(t, tz=timezone.utc).isoformat()
+
+
+def test_query_by_time_range_past_rotations(tmp_path, monkeypatch):
+    # several blocks per segment, so whole blocks are skipped within a segment too
+    monkeypatch.setattr(rotation, "BLOCK_BYTES", 4096)
+    base = str(tmp_path / "wcs.jsonl")
+    records = 2000
+    handler = _write(base, records)
+    try:
+        segments = list_segments(base)
+        assert len(segments) > 5
+        for segment in segments:
+            index = rotation.read_index(segment)
+            assert segment.endswith(".gz") and index is not None and index["codec"] == "gzip"
+            assert len(index["blocks"]) > 1
+            # every block is a gzip member of its own, together they are one valid gzip file
+            with open(segment, "rb") as f:
+                data = f.read()
+            members = b"".join(gzip.decompress(data[offset:offset + length])
+                               for offset, length, *_ in index["blocks"])
+            assert members == gzip.decompress(data)
+            assert index["records"] == members.count(b"\n")
+        logged = []
+        for path in segments + [base]:
+            with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+                logged += f.read().splitlines()
+        assert len(logged) == records
+
+        since, until = START + 600 * STEP, START + 900 * STEP
+        expected = [i for i in range(600, 901) if i % 7 == 3]
+        counters = {}
+        found = list(query(base, {"serial": "robot-3"}, since, until, counters))
+        assert [json.loads(line)["timestamp"] for line in found] == [_iso(START + i * STEP) for i in expected]
+        assert counters["segments_skipped"] > 0 and counters["blocks_skipped"] > 0
+        assert 0 < counters["segments_read"] < len(segments)
+        # the live file holds the records after the last rotation, beyond until: scanned, nothing matches
+        assert counters["segments_scanned"] == 1
+
+        # the records past the last rotation come from scanning the live file
+        tail = list(query(base, {"station_id": "st-1"}, START + (records - 5) * STEP))
+        assert [json.loads(line)["timestamp"] for line in tail] == [
+            _iso(START + i * STEP) for i in range(records - 5, records) if i % 3 == 1
+        ]
+
+        cli = subprocess.run(
+            [sys.executable, "-m", "logger.query", base, "--serial", "robot-3", "--since", _iso(since),
+             "--until", _iso(until), "--stats"],
+            cwd=ROOT, capture_output=True, check=True,
+        )
+        assert cli.stdout.splitlines() == found
+        assert cli.stderr.startswith(f"{len(expected)} records".encode())
+    finally:
+        handler.close()
@@ -0,0 +1,126 @@
+import threading
+
+from clock import VirtualClock
+from scheduler import CallbackScheduler
+
+
+def test_runs_callbacks_in_due_order():
+    clock = VirtualClock()
+    scheduler = CallbackScheduler(workers=1, clock=clock)
+    scheduler.start()
+    try:
+        ran = []
+        for delay in (3, 1, 2, 0):
+            scheduler.submit(delay, ran.append, delay)
+        assert scheduler.wait_idle(timeout=2)
+        assert ran == [0]
+        clock.advance(1.5)
+        assert scheduler.wait_idle(timeout=2)
+        assert ran == [0, 1]
+        clock.advance(5)
+        assert scheduler.wait_idle(timeout=2)
+        assert ran == [0, 1, 2, 3]
+        assert scheduler.stats()["dispatched"] == 4
+    finally:
+        scheduler.stop()
+
+
+def test_cancelled_callbacks_are_dropped_lazily():
+    clock = VirtualClock()
+    scheduler = CallbackScheduler(workers=1, clock=clock)
+    ran = []
+    handles = [scheduler.submit(delay, ran.append, delay) for delay in range(1, 11)]
+
+    assert scheduler.cancel(handles[4])
+    assert not scheduler.cancel(handles[4])
+    assert not scheduler.cancel(None)
+    assert scheduler.pending() == 9
+    # only marked, the entry stays in the heap until it reaches the top
+    assert len(scheduler._heap) == 10
+
+    # the earliest one is dropped as soon as the top of the heap is looked at
+    assert scheduler.cancel(handles[0])
+    assert scheduler.stats()["pending"] == 8
+    assert len(scheduler._heap) == 9
+
+    # once cancelled entries make up half of the heap, it is rebuilt without them
+    for handle in handles[5:9]:
+        assert scheduler.cancel(handle)
+    assert scheduler.pending() == 4
+    assert len(scheduler._heap) == 4
+
+    scheduler.start()
+    try:
+        clock.advance(20)
+        assert scheduler.wait_idle(timeout=2)
+        assert ran == [2, 3, 4, 10]
+        assert not scheduler.cancel(handles[1])
+    finally:
+        scheduler.stop()
+
+
+def test_wait_idle_follows_the_virtual_clock():
+    clock = VirtualClock()
+    scheduler = CallbackScheduler(workers=2, clock=clock)
+    scheduler.start()
+    try:
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(2)
+
+        scheduler.submit(10, blocking)
+        # nothing is due yet on the virtual clock, however long it takes in real time
+        assert scheduler.wait_idle(timeout=0.05)
+        assert not started.is_set()
+
+        clock.advance(10)
+        assert started.wait(2)
+        # due and still running
+        assert not scheduler.wait_idle(timeout=0.05)
+        release.set()
+        assert scheduler.wait_idle(timeout=2)
+        assert scheduler.pending() == 0
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_take_pending_empties_the_scheduler():
+    scheduler = CallbackScheduler(workers=1, clock=VirtualClock())
+    ran = []
+    scheduler.submit(5, ran.append, "late")
+    scheduler.submit(2, ran.append, "early")
+    scheduler.cancel(scheduler.submit(3, ran.append, "cancelled"))
+    assert scheduler.take_pending() == [(2, ran.append, ("early",)), (5, ran.append, ("late",))]
+    assert scheduler.pending() == 0
+    assert scheduler.take_pending() == []
+
+
+def test_adopt_moves_due_times_onto_its_clock():
+    old = CallbackScheduler(workers=1, clock=VirtualClock())
+    ran = []
+    old.submit(5, ran.append, "late")
+    old.submit(2, ran.append, "early")
+    old.cancel(old.submit(3, ran.append, "cancelled"))
+
+    clock = VirtualClock()
+    clock.advance(100)
+    new = CallbackScheduler(workers=1, clock=clock)
+    new.adopt(old)
+    assert old.pending() == 0
+    assert new.pending() == 2
+    new.start()
+    try:
+        assert new.wait_idle(timeout=2)
+        assert ran == []
+        clock.advance(2)
+        assert new.wait_idle(timeout=2)
+        assert ran == ["early"]
+        clock.advance(3)
+        assert new.wait_idle(timeout=2)
+        assert ran == ["early", "late"]
+    finally:
+        new.stop()
@@ -0,0 +1,56 @@
+import clock
+from config.server import StationsConfig
+from station_state import STATION_ID_MAX_BYTES, StationState, StationTable, _key
+
+
+def test_long_station_id_keeps_its_own_state():
+    table = StationTable(StationsConfig(capacity=64, stripes=4, busy_seconds={"站" * 30: 5}))
+    long_id = "站" * 30
+    other = "站" * 29 + "台"
+    assert len(_key(long_id)) <= STATION_ID_MAX_BYTES
+    assert _key(long_id) != _key(other)
+
+    assert table.transition(long_id, StationState.BUSY)
+    assert table.transition(other, StationState.PREPARING)
+    assert table.transition(other, StationState.DOCKING)
+    assert table.get(long_id)[0] == StationState.BUSY
+    assert table.get(other)[0] == StationState.DOCKING
+    assert not table.check_outbound_ready(long_id)
+    busy = {entry["busy_seconds"] for entry in table.snapshot()}
+    assert busy == {5, 20}
+
+
+def test_full_stripe_overflows():
+    previous = clock.set_clock(clock.VirtualClock())
+    try:
+        table = StationTable(StationsConfig(capacity=2, stripes=1, default_busy_seconds=10))
+        stations = [f"st-{i}" for i in range(5)]
+        for station in stations:
+            table.transition(station, StationState.BUSY)
+        for station in stations:
+            assert table.get(station)[0] == StationState.BUSY
+            assert not table.check_outbound_ready(station)
+        clock.get_clock().advance(10)
+        assert all(table.check_outbound_ready(station) for station in stations)
+        assert sorted(entry["station_id"] for entry in table.snapshot()) == stations
+    finally:
+        clock.set_clock(previous)
+
+
+def test_out_of_order_transition_is_rejected():
+    previous = clock.set_clock(clock.VirtualClock())
+    try:
+        table = StationTable(StationsConfig(capacity=8, stripes=2))
+        assert table.transition("st-1", StationState.PREPARING)
+        since = table.get("st-1")[1]
+        clock.get_clock().advance(1)
+        # docking has to come between preparing and the robot leaving
+        assert not table.transition("st-1", StationState.ROBOT_LEFT)
+        assert table.get("st-1") == (StationState.PREPARING, since)
+        assert table.transition("st-1", StationState.DOCKING)
+        assert table.transition("st-1", StationState.ROBOT_LEFT)
+        # a mode switch sends a station back to idle from anywhere
+        assert table.transition("st-1", StationState.IDLE)
+        assert table.get("st-1")[0] == StationState.IDLE
+    finally:
+        clock.set_clock(previous)
@@ -0,0 +1,33 @@
+import time
+
+from logger.logger import Logger
+
+
+def _wait(condition, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_reporter_restarts_after_reenable():
+    timing_logger = Logger(name="test-timing", log_dir="/nonexistent")
+    timing_logger.configure_timing(enabled=True, report_interval=0.01)
+    with timing_logger.timing("span"):
+        pass
+    first = timing_logger._timing_reporter
+    assert first is not None and first.is_alive()
+
+    timing_logger.configure_timing(enabled=False)
+    assert _wait(lambda: not first.is_alive())
+
+    timing_logger.configure_timing(enabled=True, report_interval=0.01)
+    with timing_logger.timing("span"):
+        pass
+    second = timing_logger._timing_reporter
+    assert second is not None and second is not first and second.is_alive()
+    # the reporter drains the span recorded after re-enabling
+    assert _wait(lambda: not timing_logger._timings.summary())
+    timing_logger.configure_timing(enabled=False)
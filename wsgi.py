@@ -0,0 +1,70 @@
+import socket
+from typing import Any, Callable, Dict, List, Optional
+
+import gevent
+from flask import Flask, Response, request
+from gevent import pywsgi
+
+import controller
+import logger
+from sites import Site
+
+_JSON_CONTENT_TYPE = controller.JSON_CONTENT_TYPE
+
+
+def create_app() -> Flask:
+    """
+    Flask application serving the routes registered in controller. Built when the gevent engine starts, so Flask,
+    Werkzeug and gevent are only imported by a process that serves with them.
+    """
+    app = Flask(__name__)
+    for path, methods in controller.get_routes().items():
+        for method, handler in methods.items():
+            app.add_url_rule(path, f"{handler.__name__}:{method}", _view(handler), methods=[method])
+    app.register_error_handler(404, lambda _: Response(controller.NOT_FOUND, status=404,
+                                                       content_type=_JSON_CONTENT_TYPE))
+    app.register_error_handler(405, lambda _: Response(controller.METHOD_NOT_ALLOWED, status=405,
+                                                       content_type=_JSON_CONTENT_TYPE))
+    return app
+
+
+def _view(handler: controller.Handler) -> Callable[[], Response]:
+    def view() -> Response:
+        reply = controller.dispatch(handler, request.get_data(), request.remote_addr, request.environ.get("wcs.site"))
+        if reply.delay:
+            gevent.sleep(reply.delay)
+        return Response(reply.body, status=reply.status, content_type=reply.content_type)
+
+    view.__name__ = handler.__name__
+    return view
+
+
+def _site_app(app: Flask, site: Site) -> Callable[..., Any]:
+    def site_app(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Any:
+        environ["wcs.site"] = site
+        return app(environ, start_response)
+
+    return site_app
+
+
+class _NoDelayHandler(pywsgi.WSGIHandler):
+    """Turns Nagle off on every accepted connection, as asyncio does in the asyncio engine."""
+
+    def handle(self) -> None:
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().handle()
+
+
+def serve(served: List[Site], sock: Optional[socket.socket] = None) -> None:
+    """Serve every site on the one gevent hub, sock instead of binding for a pre-forked worker."""
+    if sock is not None:
+        gevent.reinit()
+    app = create_app()
+    servers = [pywsgi.WSGIServer(sock if sock is not None else ("0.0.0.0", site.port), _site_app(app, site),
+                                  handler_class=_NoDelayHandler)
+               for site in served]
+    for site, server in zip(served, servers):
+        server.start()
+        logger.info("wcs-baffle serve site: %s on port: %s, engine: gevent", site.name or "-", site.port)
+    # block until every server is stopped
+    gevent.joinall([gevent.spawn(server.serve_forever, stop_timeout=0) for server in servers])